@@ -0,0 +1,111 @@
+import os
+import sys
+import argparse
+import pandas as pd
+import datetime as dt
+
+from sklearn.model_selection import train_test_split
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'dpp_2.0'))
+from group_estimator import GroupbyEstimator, pipeline_factory
+from feature_engineering import SparseOneHotEncoder, load_features
+from dashboard_store import write_dashboard_artifacts
+from utils.connection_manager import db_connection
+
+
+# Prep data for plotting (from training/testing data)
+def format_data(dataframe, filename, test = False):#########
+    #change columns to datetime
+    dataframe.loc[:, 'ndc'] = dataframe.loc[:, 'ndc'].astype('int64') #int64 needed due to size of numbers
+    if test:
+        dataframe.loc[:, ['effective_date_year', 'effective_date_month', 'effective_date_day']] = dataframe.loc[:, ['effective_date_year', 'effective_date_month', 'effective_date_day']].astype(str)
+        dataframe.rename(columns = {'effective_date_year': 'year', 'effective_date_month': 'month', 'effective_date_day': 'day'}, inplace = True)
+        dataframe.loc[:, 'date'] = pd.to_datetime(dataframe[['year', 'month', 'day']], format = '%Y-%m-%d')
+        dataframe.rename({'year': 'effective_date_year', 'month': 'effective_date_month', 'day': 'effective_date_day'}, inplace = True)
+        dataframe.loc[:, ['year', 'month', 'day']] = dataframe.loc[:, ['year', 'month', 'day']].astype(float).astype(int)
+        dataframe.sort_values(['ndc', 'date'])
+    else:
+        dataframe.rename(columns = {'effective_date_year': 'year', 'effective_date_month': 'month', 'effective_date_day': 'day'}, inplace = True)
+    #Keep only unique values
+    dataframe.loc[:, 'year'] = dataframe.loc[:, 'year'].astype(int)
+    dataframe.loc[:, 'month'] = dataframe.loc[:, 'month'].astype(int)
+    dataframe.loc[:, 'day'] = dataframe.loc[:, 'day'].astype(int)
+    dataframe.loc[:, 'nadac_per_unit'] = dataframe.loc[:, 'nadac_per_unit'].astype('float32')
+    return dataframe
+
+def load_drug_names(db_path, table_name):
+    """
+    Get the most recent cleaned drug name (ndc_description) of each NDC from the pipeline's database
+
+    Args:
+        db_path (str): path to the database written by dpp_2.0/main.py
+        table_name (str): name of the cleaned prices table
+
+    Returns:
+        dict of {ndc: name} (empty if the database isn't available)
+    """
+    if not os.path.exists(db_path):
+        print('No database found at {}; drugs will be searchable by NDC only.'.format(db_path))
+        return {}
+    with db_connection(db_path) as conn:
+        names = pd.read_sql_query('SELECT ndc, ndc_description, MAX(effective_date) FROM {} GROUP BY ndc'.format(table_name), conn)
+    return dict(zip(names['ndc'].astype('int64'), names['ndc_description']))
+
+
+def build_dashboard(features_path, output_dir, forecast_date, names = None):
+    """
+    Offline build step of the dashboard: train the per-NDC model and write the per-NDC
+    historical prices and forecasts that bokeh_app.py serves (see dashboard_store)
+
+    Args:
+        features_path (str): feature dataset or pickled feature frame (see feature_engineering.load_features)
+        output_dir (str): folder the artifacts are written to
+        forecast_date (datetime): date the prices are predicted for
+        names (dict): cleaned drug name of each NDC, for the search box (optional)
+
+    Returns:
+        Nothing (artifacts are written to output_dir)
+    """
+    #Import data
+    Price_Patent_Reg = load_features(features_path)
+
+    #Train-test split data
+    train_data, test_data = train_test_split(Price_Patent_Reg,
+                                             test_size = 0.2,
+                                             random_state = 1,
+    #                                          shuffle = True
+                                            )    #shuffle data to avoid correlation to the natural order of the data
+
+    #Categorical columns are one-hot encoded into a sparse matrix by the model, with the vocabulary learned on the training data
+    lin_model = GroupbyEstimator('ndc', pipeline_factory,
+                                 encoder = SparseOneHotEncoder(drop_first = True)).fit(train_data,'nadac_per_unit')
+
+    #Predict every NDC at once (from its first test row, moved to the forecast date)
+    forecast_input = test_data.drop_duplicates('ndc')
+    forecast_input = forecast_input[forecast_input['ndc'].isin(lin_model.groups)].copy()
+    forecast_input.loc[:, 'effective_date_year'] = forecast_date.year
+    forecast_input.loc[:, 'effective_date_month'] = forecast_date.month
+    forecast_input.loc[:, 'effective_date_day'] = forecast_date.day
+    forecast_data = lin_model.predict(forecast_input)
+    forecast_data['ndc'] = forecast_data['ndc'].astype('int64')
+    forecast_data['date'] = pd.Timestamp(forecast_date)
+
+    #Save formatted data as follows
+    historical_data = format_data(train_data, 'historical_data', test = True).copy()
+    historical_data = historical_data.loc[:, ['ndc', 'date', 'nadac_per_unit']]
+
+    write_dashboard_artifacts(output_dir, historical_data, forecast_data, model = lin_model,
+                              metadata = {'forecast_date': forecast_date.strftime('%Y-%m-%d')}, names = names)
+
+
+if __name__ == '__main__':
+    arg_parser = argparse.ArgumentParser(description = 'Build the data served by bokeh_app.py')
+    arg_parser.add_argument('--features', default = os.path.join('data', 'features_created.pkd'))
+    arg_parser.add_argument('--output', default = os.path.join('data', 'dashboard'))
+    arg_parser.add_argument('--forecast-date', default = '2020-03-31')
+    arg_parser.add_argument('--names-db', default = os.path.join('dpp_2.0', 'db', 'drug_data.db'))
+    arg_parser.add_argument('--names-table', default = 'nadac_clean')
+    args = arg_parser.parse_args()
+
+    names = load_drug_names(args.names_db, args.names_table)
+    build_dashboard(args.features, args.output, dt.datetime.strptime(args.forecast_date, '%Y-%m-%d'), names)
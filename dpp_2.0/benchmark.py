@@ -0,0 +1,377 @@
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import tempfile
+import threading
+import contextlib
+import tracemalloc
+from datetime import datetime
+from functools import partial
+from http.server import ThreadingHTTPServer, SimpleHTTPRequestHandler
+
+import numpy as np
+import pandas as pd
+
+import get_price_data
+from get_price_data import create_unique_id_index
+from get_patent_data import merge_orange_data, refresh_orange_data
+from data_cleaner import CleanNames, regex_fn_dict
+from utils.tools import save_to_SQL, bulk_save_to_SQL
+from utils.connection_manager import close_all_pools
+from group_estimator import GroupbyEstimator, pipeline_factory
+from feature_engineering import SparseOneHotEncoder
+from synthetic_data import load_drug_names, synthetic_nadac, socrata_records, synthetic_orange_book, write_orange_book
+
+
+#Number of NADAC rows of each benchmark scale (the Orange Book gets one product per 30 rows)
+SCALES = {'10k': 10000, '1m': 1000000, '10m': 10000000}
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+BASELINE_FILE = os.path.join(BENCHMARK_DIR, 'benchmark_baseline.json')
+PRICE_METADATA_FILE = os.path.join(BENCHMARK_DIR, 'raw_data', 'price_metadata.json')
+
+#Dataset identifier and page size used with the fake Socrata client
+DATA_LOCATION = 'synthetic-nadac'
+PAGE_SIZE = 50000
+
+
+class FakeSocrata:
+    """
+    Stand-in for sodapy.Socrata (swapped in for get_price_data.Socrata while the download is
+    benchmarked) that serves the synthetic rows: it answers the row count and the paged
+    queries of get_price_data, returning records the way the API does (see socrata_records)
+    """
+    dataset = None
+
+    def __init__(self, domain, app_token, timeout=10):
+        self.domain = domain
+        self.timeout = timeout
+        self.uri_prefix = 'https://'
+
+    def get(self, dataset_identifier, content_type='json', **kwargs):
+        if kwargs.get('where'):
+            raise ValueError('FakeSocrata only serves full downloads (got where={!r})'.format(kwargs['where']))
+        if kwargs.get('select', '').startswith('count('):
+            return [{'row_count': str(len(self.dataset))}]
+        offset = int(kwargs.get('offset') or 0)
+        limit = int(kwargs.get('limit') or len(self.dataset))
+        return socrata_records(self.dataset.iloc[offset:offset + limit])
+
+    def close(self):
+        pass
+
+
+class QuietHandler(SimpleHTTPRequestHandler):
+    """Static file handler (with Last-Modified / 304 support) that doesn't log requests"""
+    def log_message(self, format, *args):
+        pass
+
+
+@contextlib.contextmanager
+def serve_folder(folder):
+    """Serve a folder over HTTP on localhost (stands in for the FDA and Socrata metadata downloads)"""
+    server = ThreadingHTTPServer(('127.0.0.1', 0), partial(QuietHandler, directory=folder))
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        yield 'localhost:{}'.format(server.server_address[1])
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def traced_peak_mb(run, args):
+    """
+    Run a stage under tracemalloc and return the peak memory it allocated, in MiB, above what
+    was allocated when it started.  Unlike the resident set size of the process (whose
+    high-water mark is process-wide on most platforms), this is the stage's own peak.
+    numpy (and so pandas) report their buffers to tracemalloc; memory allocated by SQLite
+    or other C libraries is not counted.
+    """
+    tracemalloc.start()
+    try:
+        start, _ = tracemalloc.get_traced_memory()
+        tracemalloc.reset_peak()
+        run(*args)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return max(peak - start, 0) / 1024 ** 2
+
+
+def nadac_frame(context):
+    """Synthetic rows with text columns, as the pipeline holds them after the download"""
+    if 'frame' not in context:
+        nadac = context['nadac']
+        context['frame'] = nadac.astype({col: object for col in nadac.columns if isinstance(nadac[col].dtype, pd.CategoricalDtype)})
+    return context['frame']
+
+
+def indexed_frame(context):
+    if 'indexed' not in context:
+        context['indexed'] = create_unique_id_index(nadac_frame(context))
+    return context['indexed']
+
+
+def model_features(context):
+    """Model input built from the indexed rows: NDC, date parts, categorical columns and the price"""
+    if 'features' not in context:
+        indexed = indexed_frame(context)
+        dates = pd.to_datetime(indexed['effective_date'])
+        context['features'] = pd.DataFrame({'ndc': indexed['ndc'].astype('int64'),
+                                            'effective_date_year': dates.dt.year,
+                                            'effective_date_month': dates.dt.month,
+                                            'effective_date_day': dates.dt.day,
+                                            'pricing_unit': indexed['pricing_unit'],
+                                            'otc': indexed['otc'],
+                                            'explanation_code': indexed['explanation_code'],
+                                            'classification_for_rate_setting': indexed['classification_for_rate_setting'],
+                                            'nadac_per_unit': indexed['nadac_per_unit']})
+    return context['features']
+
+
+def fresh_database(database_name):
+    """Remove a benchmark database (and its WAL files) so that a stage starts from an empty one"""
+    close_all_pools()
+    for suffix in ['', '-wal', '-shm']:
+        path = os.path.join(os.getcwd(), 'db', database_name + suffix)
+        if os.path.exists(path):
+            os.remove(path)
+    return database_name
+
+
+def prepare_download(context):
+    fresh_database('download.db')
+    for path in [get_price_data.METADATA_FILE, os.path.join('raw_data', 'source_state.json')]:
+        if os.path.exists(path):
+            os.remove(path)
+    shutil.rmtree(os.path.join('raw_data', 'nadac_data'), ignore_errors=True)
+    credentials = {'APP_TOKEN': None}
+    nadac_parameters = {'LIMIT': str(len(context['nadac'])), 'PAGE_SIZE': str(PAGE_SIZE), 'WORKERS': '2',
+                        'WEBSITE': context['host'], 'URI_PREFIX': 'http://', 'DATA_LOCATION': DATA_LOCATION,
+                        'TIMEOUT': '60', 'CURRENT_DATE': datetime.now().isoformat()}
+    db_parameters = {'DATABASE_NAME': 'download.db', 'PRICES_TABLE': 'nadac_data'}
+    return context['nadac'], credentials, nadac_parameters, db_parameters
+
+
+def run_download(dataset, credentials, nadac_parameters, db_parameters):
+    FakeSocrata.dataset = dataset
+    socrata = get_price_data.Socrata
+    get_price_data.Socrata = FakeSocrata
+    try:
+        get_price_data.get_socrata_data(credentials, nadac_parameters, db_parameters, 'raw_data')
+    finally:
+        get_price_data.Socrata = socrata
+
+
+def prepare_orange_download(context):
+    fresh_database('patents.db')
+    if os.path.exists(os.path.join('raw_data', 'source_state.json')):
+        os.remove(os.path.join('raw_data', 'source_state.json'))
+    if os.path.exists(os.path.join('raw_data', 'orange_book.zip')):
+        os.remove(os.path.join('raw_data', 'orange_book.zip'))
+    return {'DATABASE_NAME': 'patents.db', 'PATENT_TABLE': 'patent_data'}, 'raw_data', 'http://{}/orange_book.zip'.format(context['host'])
+
+
+def fit_model(features):
+    return GroupbyEstimator('ndc', pipeline_factory, encoder=SparseOneHotEncoder()).fit(features, 'nadac_per_unit')
+
+
+def prepare_predict(context):
+    if 'model' not in context:
+        context['model'] = fit_model(model_features(context))
+    return context['model'], model_features(context)
+
+
+#Benchmarked stages, in order: name, function preparing the arguments (not timed), timed function
+STAGES = [('socrata_download', prepare_download, run_download),
+          ('create_unique_id_index', lambda context: (nadac_frame(context), 'ndc', 'effective_date'), create_unique_id_index),
+          ('clean_names', lambda context: (nadac_frame(context)[['ndc_description']].copy(),),
+           lambda X: CleanNames(regex_fn_dict, cols=['ndc_description']).fit_transform(X)),
+          ('save_to_SQL', lambda context: (fresh_database('save.db'), 'nadac_data', indexed_frame(context)), save_to_SQL),
+          ('bulk_save_to_SQL', lambda context: (fresh_database('bulk_save.db'), 'nadac_data', indexed_frame(context), 'id'),
+           bulk_save_to_SQL),
+          ('orange_book_download', prepare_orange_download, refresh_orange_data),
+          ('merge_orange_data', lambda context: (context['orange_book'], 'raw_data'), merge_orange_data),
+          ('groupby_fit', lambda context: (model_features(context),), fit_model),
+          ('groupby_predict', prepare_predict, lambda model, features: model.predict(features))]
+
+
+def generate_data(scale, workdir, seed=0):
+    """
+    Generate the synthetic NADAC rows and Orange Book archive of a scale, and the files
+    served by the local stand-in server (Socrata metadata and the Orange Book zip)
+
+    Args:
+        scale (str): key of SCALES
+        workdir (str): benchmark working folder
+        seed (int): random seed
+
+    Returns:
+        dict, the benchmark context
+    """
+    names = load_drug_names()
+    n_rows = SCALES[scale]
+    nadac = synthetic_nadac(n_rows, names, seed=seed)
+
+    served = os.path.join(workdir, 'served')
+    metadata_folder = os.path.join(served, 'api', 'views')
+    os.makedirs(metadata_folder, exist_ok=True)
+    with open(PRICE_METADATA_FILE, 'r') as metadata_json:
+        metadata = json.load(metadata_json)
+    metadata['rowsUpdatedAt'] = int(time.time())
+    with open(os.path.join(metadata_folder, DATA_LOCATION + '.json'), 'w') as outfile:
+        json.dump(metadata, outfile)
+    orange_book = os.path.join(served, 'orange_book.zip')
+    write_orange_book(synthetic_orange_book(max(100, n_rows // 30), names, seed=seed), orange_book)
+
+    return {'nadac': nadac, 'orange_book': orange_book, 'served': served}
+
+
+def run_benchmarks(scale, stages=None, workdir=None, seed=0, repeat=1, verbose=False):
+    """
+    Generate a dataset and time each stage on it, then run the stage once more under
+    tracemalloc (not timed, tracing slows allocations) to record its peak memory.  Everything runs offline: Socrata is replaced by FakeSocrata and the
+    metadata and Orange Book downloads are served from a local folder.
+
+    Args:
+        scale (str): key of SCALES
+        stages (list): names of the stages to run (default all, see STAGES)
+        workdir (str): working folder (default a temporary folder, removed afterwards)
+        seed (int): random seed of the generators
+        repeat (int): number of runs of each stage (the fastest is kept)
+        verbose (bool): show the output of the benchmarked functions
+
+    Returns:
+        dict of results: scale, rows, machine and {stage: {seconds, peak_mb}}
+    """
+    temporary = workdir is None
+    workdir = os.path.abspath(workdir or tempfile.mkdtemp(prefix='dpp_benchmark_'))
+    os.makedirs(os.path.join(workdir, 'raw_data'), exist_ok=True)
+    current_dir = os.getcwd()
+    os.chdir(workdir)
+    results = {'scale': scale, 'rows': SCALES[scale], 'repeat': repeat, 'run_at': datetime.now().isoformat(),
+               'machine': {'platform': platform.platform(), 'python': platform.python_version(),
+                           'cpus': os.cpu_count(), 'pandas': pd.__version__, 'numpy': np.__version__},
+               'stages': {}}
+    devnull = open(os.devnull, 'w')
+    try:
+        start = time.perf_counter()
+        context = generate_data(scale, workdir, seed)
+        print('Generated {} rows in {:.1f}s'.format(SCALES[scale], time.perf_counter() - start))
+        with serve_folder(context['served']) as host:
+            context['host'] = host
+            for name, prepare, run in STAGES:
+                if stages and name not in stages:
+                    continue
+                timings = []
+                with contextlib.redirect_stdout(sys.stdout if verbose else devnull):
+                    for _ in range(repeat):
+                        args = prepare(context)
+                        start = time.perf_counter()
+                        run(*args)
+                        timings.append(time.perf_counter() - start)
+                    peak = traced_peak_mb(run, prepare(context))
+                #Fastest run
+                seconds = min(timings)
+                results['stages'][name] = {'seconds': round(seconds, 4), 'peak_mb': round(peak, 1)}
+                print('{:<24} {:>10.3f}s {:>10.1f} MiB peak'.format(name, seconds, peak))
+    finally:
+        devnull.close()
+        close_all_pools()
+        os.chdir(current_dir)
+        if temporary:
+            shutil.rmtree(workdir, ignore_errors=True)
+    return results
+
+
+def compare_with_baseline(results, baseline, tolerance=0.3, min_seconds=0.05, min_mb=1.0):
+    """
+    Compare benchmark results with the baseline of the same scale
+
+    Args:
+        results (dict): results of run_benchmarks
+        baseline (dict): {scale: results} (see BASELINE_FILE)
+        tolerance (float): allowed relative increase of time and peak memory
+        min_seconds (float): slowdowns smaller than this are timing noise, not regressions
+        min_mb (float): peak memory increases smaller than this are ignored
+
+    Returns:
+        List of regressions (str), empty if every stage is within tolerance
+        (raises ValueError if there is no baseline of the scale, or it was measured with a different repeat count)
+    """
+    if results['scale'] not in baseline:
+        raise ValueError('No {} baseline to compare with (record one with --save-baseline)'.format(results['scale']))
+    reference_run = baseline[results['scale']]
+    #Best-of-N timings are only comparable with best-of-N timings
+    if reference_run.get('repeat', 1) != results.get('repeat', 1):
+        raise ValueError('The {} baseline was measured with --repeat {}, this run used --repeat {}'.format(
+                         results['scale'], reference_run.get('repeat', 1), results.get('repeat', 1)))
+    reference = reference_run.get('stages', {})
+    noise = {'seconds': min_seconds, 'peak_mb': min_mb}
+    regressions = []
+    print('{:<24} {:>10} {:>10} {:>7} {:>10} {:>10} {:>7}'.format('stage', 'seconds', 'baseline', 'ratio',
+                                                                 'peak MiB', 'baseline', 'ratio'))
+    for name, measured in results['stages'].items():
+        if name not in reference:
+            print('{:<24} {:>10.3f} {:>10}'.format(name, measured['seconds'], 'n/a'))
+            continue
+        line = [name]
+        for metric in ['seconds', 'peak_mb']:
+            expected = reference[name][metric]
+            ratio = measured[metric] / max(expected, 1e-9)
+            line.extend([measured[metric], expected, ratio])
+            if ratio > 1 + tolerance and measured[metric] - expected >= noise[metric]:
+                regressions.append('{} {}: {:.3f} vs {:.3f} in the baseline ({:+.0%})'.format(
+                                   name, metric, measured[metric], expected, ratio - 1))
+        print('{:<24} {:>10.3f} {:>10.3f} {:>7.2f} {:>10.1f} {:>10.1f} {:>7.2f}'.format(*line))
+    return regressions
+
+
+if __name__ == '__main__':
+    arg_parser = argparse.ArgumentParser(description = 'Benchmark the data pipeline and model on synthetic data (offline)')
+    arg_parser.add_argument('--scale', choices = list(SCALES), default = '10k')
+    arg_parser.add_argument('--stages', help = 'comma-separated stages to run (default all): ' + ', '.join(name for name, _, _ in STAGES))
+    arg_parser.add_argument('--baseline', default = BASELINE_FILE)
+    arg_parser.add_argument('--save-baseline', action = 'store_true', help = 'store these results as the baseline of the scale')
+    arg_parser.add_argument('--tolerance', type = float, default = 0.3, help = 'allowed relative slowdown / memory increase')
+    arg_parser.add_argument('--min-seconds', type = float, default = 0.05, help = 'slowdowns below this are ignored as noise')
+    arg_parser.add_argument('--min-mb', type = float, default = 1.0, help = 'peak memory increases (MiB) below this are ignored')
+    arg_parser.add_argument('--repeat', type = int, help = 'runs of each stage (the fastest is kept); defaults to the repeat count of the baseline')
+    arg_parser.add_argument('--output', help = 'also write the results to this JSON file')
+    arg_parser.add_argument('--workdir', help = 'working folder (kept after the run)')
+    arg_parser.add_argument('--seed', type = int, default = 0)
+    arg_parser.add_argument('--verbose', action = 'store_true')
+    args = arg_parser.parse_args()
+
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline, 'r') as baseline_json:
+            baseline = json.load(baseline_json)
+    if args.repeat is None:
+        args.repeat = baseline.get(args.scale, {}).get('repeat', 1)
+
+    results = run_benchmarks(args.scale, args.stages.split(',') if args.stages else None,
+                             args.workdir, args.seed, args.repeat, args.verbose)
+    if args.output:
+        with open(args.output, 'w') as outfile:
+            json.dump(results, outfile, indent=2)
+
+    if args.save_baseline:
+        baseline[args.scale] = results
+        with open(args.baseline, 'w') as outfile:
+            json.dump(baseline, outfile, indent=2, sort_keys=True)
+        print('Baseline for {} saved to {}'.format(args.scale, args.baseline))
+    else:
+        try:
+            regressions = compare_with_baseline(results, baseline, args.tolerance, args.min_seconds, args.min_mb)
+        except ValueError as error:
+            print(error)
+            sys.exit(2)
+        for regression in regressions:
+            print('REGRESSION', regression)
+        sys.exit(1 if regressions else 0)
@@ -0,0 +1,166 @@
+import os
+import json
+import threading
+from datetime import datetime
+from functools import lru_cache
+
+import numpy as np
+
+from drug_search import DrugSearchIndex
+from model_artifact import save_model, load_model
+
+
+#Per-NDC series stored by the build step (history: training prices, forecast: predicted prices)
+SERIES = ['history', 'forecast']
+
+
+def group_series(dataframe, ndc_column='ndc', date_column='date', value_column='nadac_per_unit'):
+    """
+    Sort a price series by NDC and date and cut it into per-NDC blocks
+
+    Args:
+        dataframe (pandas.DataFrame): prices (one row per NDC and date)
+        ndc_column (str): NDC column
+        date_column (str): date column
+        value_column (str): price column
+
+    Returns:
+        dict of arrays: ndcs (unique, sorted), offsets (rows of ndcs[i] are offsets[i]:offsets[i+1]),
+        dates and values
+    """
+    dataframe = dataframe.sort_values([ndc_column, date_column], kind='mergesort')
+    ndc_values = dataframe[ndc_column].to_numpy(dtype=np.int64)
+    ndcs, starts = np.unique(ndc_values, return_index=True)
+    return {'ndcs': ndcs,
+            'offsets': np.append(starts, len(ndc_values)).astype(np.int64),
+            'dates': dataframe[date_column].to_numpy(dtype='datetime64[ns]'),
+            'values': dataframe[value_column].to_numpy(dtype=np.float32)}
+
+
+def write_dashboard_artifacts(output_dir, history, forecast, model=None, metadata=None, names=None):
+    """
+    Write the dashboard's precomputed data: one set of .npy arrays per series (see
+    group_series), which the dashboard memory-maps, plus the trained model (as a
+    model_artifact folder), the drug names used by the search box and a manifest
+
+    Args:
+        output_dir (str): folder the artifacts are written to
+        history (pandas.DataFrame): historical prices (ndc, date, nadac_per_unit)
+        forecast (pandas.DataFrame): predicted prices (ndc, date, nadac_per_unit)
+        model (GroupbyEstimator): trained model, saved with model_artifact.save_model (optional)
+        metadata (dict): extra values stored in the manifest (optional)
+        names (dict): cleaned drug name (ndc_description) of each NDC (optional)
+
+    Returns:
+        Nothing (artifacts are written to output_dir)
+    """
+    if not os.path.exists(output_dir):
+        os.makedirs(output_dir)
+    counts = {}
+    series_arrays = {name: group_series(dataframe) for name, dataframe in zip(SERIES, [history, forecast])}
+    for name, arrays in series_arrays.items():
+        for key, array in arrays.items():
+            np.save(os.path.join(output_dir, '{}_{}.npy'.format(name, key)), array)
+        counts[name] = {'ndcs': len(arrays['ndcs']), 'rows': len(arrays['values'])}
+    model_info = {}
+    if model is not None:
+        model_manifest = save_model(model, os.path.join(output_dir, 'model'))
+        model_info = {'model_schema_hash': model_manifest['schema_hash']}
+    #Only the forecast NDCs can be selected in the dashboard
+    names = names or {}
+    forecast_arrays = series_arrays['forecast']
+    forecast_names = {str(ndc): names[ndc] for ndc in forecast_arrays['ndcs'].tolist() if ndc in names}
+    with open(os.path.join(output_dir, 'names.json'), 'w') as outfile:
+        json.dump(forecast_names, outfile)
+
+    manifest = {'built_at': datetime.now().isoformat(), 'series': counts}
+    manifest.update(model_info)
+    manifest.update(metadata or {})
+    with open(os.path.join(output_dir, 'manifest.json'), 'w') as outfile:
+        json.dump(manifest, outfile, indent=2)
+    print('Dashboard artifacts written to {}'.format(output_dir))
+
+
+class DashboardStore:
+    """
+    Read-only access to the dashboard artifacts.
+
+    Arrays are memory-mapped (only the pages of the requested NDCs are read), NDCs are
+    looked up in a dict, and the ColumnDataSource payloads of recently requested NDCs
+    are kept in a bounded LRU cache shared by every session, as is the search index over
+    NDCs and drug names.
+    """
+    def __init__(self, artifact_dir, cache_size=1024):
+        self.artifact_dir = artifact_dir
+        with open(os.path.join(artifact_dir, 'manifest.json'), 'r') as manifest_json:
+            self.manifest = json.load(manifest_json)
+        self._series = {}
+        self._positions = {}
+        for name in SERIES:
+            arrays = {key: np.load(os.path.join(artifact_dir, '{}_{}.npy'.format(name, key)), mmap_mode='r')
+                      for key in ['ndcs', 'offsets', 'dates', 'values']}
+            self._series[name] = arrays
+            self._positions[name] = dict(zip(arrays['ndcs'].tolist(), range(len(arrays['ndcs']))))
+        self.payload = lru_cache(maxsize=cache_size)(self._payload)
+
+        names_path = os.path.join(artifact_dir, 'names.json')
+        if os.path.exists(names_path):
+            with open(names_path, 'r') as names_json:
+                self.names = {int(ndc): name for ndc, name in json.load(names_json).items()}
+        else:
+            self.names = {}
+        self.search_index = DrugSearchIndex(self.ndcs, self.names)
+
+    @property
+    def ndcs(self):
+        """NDCs that have a forecast (sorted)"""
+        return self._series['forecast']['ndcs']
+
+    def __contains__(self, ndc):
+        return int(ndc) in self._positions['forecast']
+
+    def _payload(self, name, ndc):
+        position = self._positions[name].get(ndc)
+        if position is None:
+            dates, values = np.array([], dtype='datetime64[ns]'), np.array([], dtype=np.float32)
+        else:
+            arrays = self._series[name]
+            start, stop = arrays['offsets'][position], arrays['offsets'][position + 1]
+            #Copy the slices out of the memory map (the cached payload then owns its data)
+            dates, values = np.array(arrays['dates'][start:stop]), np.array(arrays['values'][start:stop])
+        return {'ndc': np.full(len(values), ndc, dtype=np.int64), 'date': dates, 'nadac_per_unit': values}
+
+    def history(self, ndc):
+        """ColumnDataSource data (ndc, date, nadac_per_unit) of the historical prices of an NDC"""
+        return dict(self.payload('history', int(ndc)))
+
+    def forecast(self, ndc):
+        """ColumnDataSource data (ndc, date, nadac_per_unit) of the predicted prices of an NDC"""
+        return dict(self.payload('forecast', int(ndc)))
+
+    def load_model(self):
+        """Load (memory-map) the trained model saved by the build step, checking it is the one the data was built with"""
+        return load_model(os.path.join(self.artifact_dir, 'model'), expected_hash=self.manifest.get('model_schema_hash'))
+
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+def get_store(artifact_dir, cache_size=1024):
+    """
+    Get the DashboardStore of an artifact folder, opening it on first use (the dashboard
+    module is re-run for every session, so this keeps one store per server process)
+
+    Args:
+        artifact_dir (str): folder written by write_dashboard_artifacts
+        cache_size (int): number of payloads kept in the LRU cache
+
+    Returns:
+        DashboardStore
+    """
+    artifact_dir = os.path.abspath(artifact_dir)
+    with _stores_lock:
+        if artifact_dir not in _stores:
+            _stores[artifact_dir] = DashboardStore(artifact_dir, cache_size)
+        return _stores[artifact_dir]
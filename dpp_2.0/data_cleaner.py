@@ -1,12 +1,17 @@
 import pandas as pd
-import sqlite3
+import numpy as np
 import os
 import re
+import json
+import numbers
+import hashlib
 
 from sklearn.base import BaseEstimator, TransformerMixin
 from sklearn.pipeline import Pipeline
 from sklearn.model_selection import train_test_split
 
+from utils.connection_manager import db_connection, db_cursor
+
 #Import data from SQLite
 def import_db(db_parameters, *num_values, table_name):
     """
@@ -19,20 +24,161 @@ def import_db(db_parameters, *num_values, table_name):
     Returns:
         pandas.DataFrame formatted data
     """
-    db_path = os.path.join('dpp', 'db', db_parameters['DATABASE_NAME'])
+    db_path = os.path.join(os.getcwd(), 'db', db_parameters['DATABASE_NAME'])
     # db_path = 'C:/Users/Lofgran/Documents/Python Scripts/TDI/DrugPricePredictor/dpp/db/drug_data.db'
     print('Location of database: ', db_path)
-    conn = sqlite3.connect(db_path)
-    if num_values:
-        df = pd.read_sql_query('SELECT * FROM {} LIMIT {}'.format(table_name, num_values), conn)
-    else:
-        df = pd.read_sql_query('SELECT * FROM {}'.format(table_name), conn)
+    with db_connection(db_path) as conn:
+        if num_values:
+            df = pd.read_sql_query('SELECT * FROM {} LIMIT ?'.format(table_name), conn, params=(int(num_values[0]),))
+        else:
+            df = pd.read_sql_query('SELECT * FROM {}'.format(table_name), conn)
     print('Details of imported dataframe', '\n', '--------------------------', '\n', df.info())
-    conn.close()
 
     return df
 
 
+def to_db_date(date):
+    """Format a date (str or datetime) the way effective dates are stored in the database"""
+    return pd.Timestamp(date).strftime('%Y-%m-%dT%H:%M:%S.000')
+
+
+def query_prices(db_parameters, ndc=None, ndc_description=None, start_date=None, end_date=None,
+                 columns=None, limit=None, table_name=None):
+    """
+    Query the prices table with parameterized filters (all optional, combined with AND).
+    Filters on ndc and effective_date are served by the indexes created in
+    get_price_data.create_price_indexes.
+
+    Args:
+        db_parameters (dict): Database and tables names
+        ndc (str, int or list): NDC(s) to select
+        ndc_description (str or list): drug description(s) to select
+        start_date (str or datetime): first effective_date to include
+        end_date (str or datetime): last effective_date to include
+        columns (list): columns to return (None returns every column)
+        limit (int): maximum number of rows to return
+        table_name (str): table to query (defaults to db_parameters['PRICES_TABLE'])
+
+    Returns:
+        pandas.DataFrame sorted by ndc and effective_date
+    """
+    table_name = table_name or db_parameters['PRICES_TABLE']
+    db_path = os.path.join(os.getcwd(), 'db', db_parameters['DATABASE_NAME'])
+    with db_connection(db_path) as conn:
+        table_cols = [row[1] for row in conn.execute("PRAGMA table_info('{}')".format(table_name))]
+        if columns is None:
+            columns = table_cols
+        unknown = set(columns) - set(table_cols)
+        if unknown:
+            raise ValueError('Unknown column(s) for {}: {}'.format(table_name, sorted(unknown)))
+
+        conditions, params = [], []
+        for col, values in [('ndc', ndc), ('ndc_description', ndc_description)]:
+            if values is None:
+                continue
+            #numbers.Integral also covers numpy integers (e.g. NDCs taken from a dataframe)
+            if isinstance(values, (str, numbers.Integral)):
+                values = [values]
+            if col == 'ndc':
+                #NDCs are stored as 11 digit text
+                values = ['{:011d}'.format(value) if isinstance(value, numbers.Integral) else value for value in values]
+            conditions.append('{} IN ({})'.format(col, ', '.join(['?'] * len(values))))
+            params.extend(values)
+        if start_date is not None:
+            conditions.append('effective_date >= ?')
+            params.append(to_db_date(start_date))
+        if end_date is not None:
+            conditions.append('effective_date <= ?')
+            params.append(to_db_date(end_date))
+
+        query = 'SELECT {} FROM {}'.format(', '.join('"{}"'.format(col) for col in columns), table_name)
+        if conditions:
+            query += ' WHERE ' + ' AND '.join(conditions)
+        query += ' ORDER BY ndc, effective_date'
+        if limit is not None:
+            query += ' LIMIT ?'
+            params.append(int(limit))
+        df = pd.read_sql_query(query, conn, params=params)
+    return df
+
+
+def import_new_rows(db_parameters, table_name, since=None):
+    """
+    Import rows from SQLite with an effective_date on or after a given date (rows from the
+    watermark date itself are re-read so that late additions to that week aren't missed)
+
+    Args:
+        db_parameters (dict): Database and tables names
+        table_name (str): name of table to read
+        since (str): ISO formatted effective_date watermark (None reads every row)
+
+    Returns:
+        pandas.DataFrame formatted data
+    """
+    df = query_prices(db_parameters, start_date=since, table_name=table_name)
+    print('{} rows with effective_date on or after {}'.format(len(df), since))
+    return df
+
+
+def get_watermark(db_parameters, pipeline_name):
+    """
+    Get the last effective_date processed by a pipeline
+
+    Args:
+        db_parameters (dict): Database and tables names
+            WATERMARK_TABLE: table holding one watermark per pipeline
+        pipeline_name (str): name of the pipeline
+
+    Returns:
+        ISO formatted date (str), or None if the pipeline hasn't run yet
+    """
+    db_path = os.path.join(os.getcwd(), 'db', db_parameters['DATABASE_NAME'])
+    with db_cursor(db_path) as cur:
+        cur.execute('CREATE TABLE IF NOT EXISTS {} (pipeline TEXT PRIMARY KEY, last_effective_date TEXT, '
+                    'updated_at TEXT)'.format(db_parameters['WATERMARK_TABLE']))
+        row = cur.execute('SELECT last_effective_date FROM {} WHERE pipeline = ?'.format(db_parameters['WATERMARK_TABLE']),
+                          (pipeline_name,)).fetchone()
+    return row[0] if row else None
+
+
+def get_latest_effective_date(db_parameters, table_name):
+    """
+    Get the most recent effective_date of a table (served by the effective_date index)
+
+    Args:
+        db_parameters (dict): Database and tables names
+        table_name (str): name of the table
+
+    Returns:
+        ISO formatted date (str), or None if the table is empty
+    """
+    db_path = os.path.join(os.getcwd(), 'db', db_parameters['DATABASE_NAME'])
+    with db_cursor(db_path) as cur:
+        return cur.execute('SELECT MAX(effective_date) FROM {}'.format(table_name)).fetchone()[0]
+
+
+def set_watermark(db_parameters, pipeline_name, last_effective_date):
+    """
+    Record the last effective_date processed by a pipeline
+
+    Args:
+        db_parameters (dict): Database and tables names
+            WATERMARK_TABLE: table holding one watermark per pipeline
+        pipeline_name (str): name of the pipeline
+        last_effective_date (str): ISO formatted date
+
+    Returns:
+        Nothing
+    """
+    db_path = os.path.join(os.getcwd(), 'db', db_parameters['DATABASE_NAME'])
+    with db_cursor(db_path) as cur:
+        cur.execute("INSERT INTO {} (pipeline, last_effective_date, updated_at) VALUES (?, ?, datetime('now')) "
+                    "ON CONFLICT(pipeline) DO UPDATE SET last_effective_date=excluded.last_effective_date, "
+                    "updated_at=excluded.updated_at".format(db_parameters['WATERMARK_TABLE']),
+                    (pipeline_name, last_effective_date))
+    print('Watermark for {} set to {}'.format(pipeline_name, last_effective_date))
+
+
 #Creating (in)dependent variable sets (for transformation)
 def split_dataset(df, dependent_var='nadac_per_unit'): #'nadac_per_unit'
     """
@@ -74,22 +220,44 @@ regex_fn_dict = {r'\sCAP*?\Z|\sCP*?\Z' : ' CAPSULE',
                }
 
 class CleanNames(BaseEstimator, TransformerMixin):
-    """Standardize drug names"""
+    """
+    Standardize drug names.  The regex rules are compiled once and applied in order
+    (later rules depend on the output of earlier ones), but only to the unique values
+    of each column; the cleaned values are then mapped back to every row through the
+    factorized codes.
+    """
     def __init__(self, regex_fn_dict, cols=[]):
         self._cols = cols
         self._regex_fn_dict=regex_fn_dict
+        self._rules = [(re.compile(pattern), replacement) for pattern, replacement in regex_fn_dict.items()]
 
     def fit(self, X, y=None):
         return self
 
+    def clean(self, names):
+        """
+        Apply every rule, in order, to a series of names
+
+        Args:
+            names (pandas.Series): names (str) to be cleaned
+
+        Returns:
+            pandas.Series of cleaned names
+        """
+        for pat, replacement in self._rules:
+            names = names.str.replace(pat, replacement, regex=True)
+        return names
+
     def transform(self, X, y=None):
         #Standardize drug names with regex
-        for pattern, replacement in self._regex_fn_dict.items():
-            pat = re.compile(pattern)
-            for col in self._cols:
-                # print(col, ': ', type(col))
-                if isinstance(X[col], str):
-                    X[col] = X[col].str.replace(pat, replacement)
+        for col in self._cols:
+            codes, uniques = pd.factorize(X[col])
+            if len(uniques) == 0:
+                #Nothing but missing values
+                continue
+            cleaned = self.clean(pd.Series(uniques, dtype=object)).to_numpy(dtype=object)
+            #Missing values have code -1; they stay missing
+            X[col] = np.where(codes >= 0, cleaned[codes], None)
         return X
 
 class SetDtypes(BaseEstimator, TransformerMixin):
@@ -103,7 +271,117 @@ class SetDtypes(BaseEstimator, TransformerMixin):
     def transform(self, X, y=None):
         #Set date datatype
         for col in X[self._cols]:
-            X[col] = pd.to_datetime(X[col], infer_datetime_format = True)
+            #The format is inferred from the first value (infer_datetime_format was removed in pandas 3)
+            X[col] = pd.to_datetime(X[col])
+        return X
+
+class ExpandDates(BaseEstimator, TransformerMixin):
+    """
+    Build the daily price panel: one row per drug per day between its first and last
+    effective date, each day carrying the most recent observation (a forward fill).
+
+    The panel is built in one vectorized pass: rows are sorted by drug and date, and each
+    row is repeated once per day until the drug's next observation.  With mode='intervals'
+    only the change points are kept instead (rows whose value_cols differ from the drug's
+    previous row), with the last day of each price interval in '<date_col>_end'.
+    """
+    def __init__(self, group_col='ndc', date_col='effective_date', value_cols=['nadac_per_unit'], mode='daily'):
+        if mode not in ('daily', 'intervals'):
+            raise ValueError("mode must be 'daily' or 'intervals', got {!r}".format(mode))
+        self._group_col = group_col
+        self._date_col = date_col
+        self._value_cols = value_cols
+        self._mode = mode
+
+    def fit(self, X, y=None):
+        return self
+
+    def _group_starts(self, groups):
+        #True on the first row of each drug (rows are sorted by drug)
+        starts = np.ones(len(groups), dtype=bool)
+        starts[1:] = groups[1:] != groups[:-1]
+        return starts
+
+    def transform(self, X, y=None):
+        X = X.sort_values([self._group_col, self._date_col], kind='mergesort')
+        X = X.drop_duplicates(subset=[self._group_col, self._date_col], keep='last').reset_index(drop=True)
+        groups = X[self._group_col].to_numpy()
+        days = X[self._date_col].to_numpy(dtype='datetime64[D]').astype(np.int64)
+        group_starts = self._group_starts(groups)
+        #The last row of each drug covers only its own date
+        group_ends = np.append(group_starts[1:], True)
+
+        if self._mode == 'intervals':
+            #Last observed day of each row's drug
+            last_days = days[group_ends][np.cumsum(group_starts) - 1]
+            values = X[self._value_cols]
+            changed = group_starts | values.ne(values.shift()).any(axis=1).to_numpy()
+            X, days, last_days = X[changed].reset_index(drop=True), days[changed], last_days[changed]
+            #Each interval ends the day before the next change (the drug's last interval on its last observation)
+            is_last = np.append(group_starts[changed][1:], True)
+            end_days = np.where(is_last, last_days, np.append(days[1:], 0) - 1)
+            return X.assign(**{self._date_col + '_end': pd.to_datetime(end_days.astype('datetime64[D]').astype('datetime64[ns]'))})
+
+        #Number of days each row is carried forward (until the drug's next observation)
+        counts = np.where(group_ends, 1, np.append(days[1:], 0) - days)
+        rows = np.repeat(np.arange(len(X)), counts)
+        #Day offset of each output row within its interval
+        offsets = np.arange(len(rows)) - np.repeat(np.cumsum(counts) - counts, counts)
+        panel = X.take(rows).reset_index(drop=True)
+        panel[self._date_col] = pd.to_datetime((days[rows] + offsets).astype('datetime64[D]').astype('datetime64[ns]'))
+        return panel
+
+def metadata_to_dtypes(metadata_path='raw_data/price_metadata.json', int_cols=['ndc'], float_dtype='float64'):
+    """
+    Build pandas dtypes from the Socrata metadata (see get_price_data.metadata_to_schema):
+    text columns become categoricals (descriptions, units, flags and classifications repeat
+    across millions of rows), numbers become floats and calendar dates become datetimes
+
+    Args:
+        metadata_path (str): location of price_metadata.json
+        int_cols (list): text columns holding integer codes (e.g. 11 digit NDCs)
+        float_dtype (str): dtype for numeric columns ('float32' or 'float64')
+
+    Returns:
+        Dictionary of {column name: dtype}
+    """
+    with open(metadata_path, 'r') as metadata_json:
+        metadata = json.load(metadata_json)
+    type_map = {'text': 'category', 'number': float_dtype, 'calendar_date': 'datetime64[ns]'}
+    dtypes = {}
+    for column in metadata['columns']:
+        col = column['name'].replace(' ', '_').lower()
+        dtypes[col] = 'int64' if col in int_cols else type_map.get(column['dataTypeName'], 'object')
+    return dtypes
+
+class CompactDtypes(BaseEstimator, TransformerMixin):
+    """Convert columns to compact dtypes (see metadata_to_dtypes) and report the memory saved"""
+    def __init__(self, dtypes={}):
+        self._dtypes = dtypes
+
+    def fit(self, X, y=None):
+        return self
+
+    def transform(self, X, y=None):
+        memory_before = X.memory_usage(deep=True).sum()
+        typed = {}
+        for col, dtype in self._dtypes.items():
+            if col not in X:
+                continue
+            if dtype.startswith('datetime'):
+                typed[col] = pd.to_datetime(X[col], errors='coerce')
+            elif dtype.startswith('int'):
+                values = pd.to_numeric(X[col], errors='coerce')
+                #Nullable integers only where values are missing
+                typed[col] = values.astype('Int64' if values.isna().any() else dtype)
+            elif dtype.startswith('float'):
+                typed[col] = pd.to_numeric(X[col], errors='coerce').astype(dtype)
+            else:
+                typed[col] = X[col].astype(dtype)
+        X = X.assign(**typed)
+        memory_after = X.memory_usage(deep=True).sum()
+        print('Memory usage: {:.1f} MB -> {:.1f} MB ({:.1f}x smaller)'.format(
+            memory_before / 1e6, memory_after / 1e6, memory_before / max(memory_after, 1)))
         return X
 
 class RemoveData(BaseEstimator, TransformerMixin):
@@ -122,59 +400,167 @@ class RemoveData(BaseEstimator, TransformerMixin):
         return X
 
 
+#Entities predicted by the drug name model (models/drug_names)
+NER_LABELS = ['DRUGNAME', 'QUANTITY', 'MECHANISM']
+
+
+def model_fingerprint(model_name):
+    """
+    Fingerprint a saved spaCy model from its meta.json (changes whenever the model is re-saved
+    with different metadata, e.g. a new version, pipeline or label set)
+
+    Args:
+        model_name (str): path to the saved model
+
+    Returns:
+        Hex digest (str)
+    """
+    with open(os.path.join(model_name, 'meta.json'), 'rb') as meta_file:
+        return hashlib.sha1(meta_file.read()).hexdigest()
+
+
+def normalize_descriptions(descriptions):
+    """Normalize (non-missing) descriptions for use as cache keys (uppercase, single spaces, no padding)"""
+    return descriptions.astype(str).str.upper().str.replace(r'\s+', ' ', regex=True).str.strip()
+
+
 class DrugNameNER(BaseEstimator,  TransformerMixin):
-    def __init__(self, col, model_name):
+    """
+    Extract drug name, quantity and mechanism entities from drug descriptions with
+    the trained spaCy NER model.  The model is loaded once (with every pipeline
+    component except the entity recognizer disabled) and descriptions are streamed
+    through nlp.pipe in batches, optionally across n_process worker processes
+    (n_process=-1 uses every core).
+
+    NER only runs once per normalized description (see normalize_descriptions), on the
+    original text of its first row; missing descriptions get no entities.  If cache_db is
+    given, entities are stored in cache_table of that database, keyed by the normalized
+    description and the model fingerprint, so only descriptions never seen by the current
+    model are run.
+    """
+    def __init__(self, col, model_name, batch_size=1000, n_process=1, cache_db=None, cache_table='ner_cache'):
         self._col = col
+        self._model_name = model_name
+        self._batch_size = batch_size
+        self._n_process = n_process
+        self._cache_db = cache_db
+        self._cache_table = cache_table
+        self._nlp = None
+
+    def _load_model(self):
+        #Load model only once per estimator (worker processes receive a copy from nlp.pipe)
+        if self._nlp is None:
+            #Imported here, so that the rest of the module can be used without spaCy installed
+            import spacy
+            self._nlp = spacy.load(self._model_name)
+            unused_pipes = [name for name in self._nlp.pipe_names if name != 'ner']
+            if unused_pipes:
+                self._nlp.disable_pipes(*unused_pipes)
+        return self._nlp
 
     def fit(self, X, y=None):
         return self
+
+    def extract_entities(self, texts):
+        """
+        Run NER over a list of descriptions
+
+        Args:
+            texts (list): drug descriptions (str)
+
+        Returns:
+            Dictionary of {entity label: numpy array of the first matching entity text (or None) per description}
+        """
+        entities = {label: np.full(len(texts), None, dtype=object) for label in NER_LABELS}
+        if not texts:
+            return entities
+        nlp = self._load_model()
+        docs = nlp.pipe(texts, batch_size=self._batch_size, n_process=self._n_process)
+        for i, doc in enumerate(docs):
+            for ent in doc.ents:
+                values = entities.get(ent.label_)
+                if values is not None and values[i] is None:
+                    values[i] = ent.text
+        return entities
+
+    def cached_entities(self, keys, texts):
+        """
+        Look descriptions up in the NER cache, run NER on the ones that are missing and
+        add their entities to the cache
+
+        Args:
+            keys (list): unique, normalized drug descriptions (str), used as cache keys
+            texts (list): original text of each description, passed to the model
+
+        Returns:
+            Dictionary of {entity label: numpy array of entity text (or None) per description}
+        """
+        fingerprint = model_fingerprint(self._model_name)
+        label_cols = ', '.join(label.lower() for label in NER_LABELS)
+        with db_connection(self._cache_db) as conn:
+            with conn:
+                conn.execute('CREATE TABLE IF NOT EXISTS {} (description TEXT, model_fingerprint TEXT, {}, '
+                             'PRIMARY KEY (description, model_fingerprint)) WITHOUT ROWID'.format(
+                                 self._cache_table, ', '.join('{} TEXT'.format(label.lower()) for label in NER_LABELS)))
+            cache = pd.read_sql_query('SELECT description, {} FROM {} WHERE model_fingerprint = ?'.format(label_cols, self._cache_table),
+                                      conn, params=(fingerprint,), index_col='description')
+        #Mark cached rows before reindexing (a cached description may have no entities at all)
+        cache['cached'] = True
+        cache = cache.reindex(keys)
+        is_missing = cache['cached'].isna().to_numpy()
+        missing = list(cache.index[is_missing])
+        print('NER cache: {} of {} descriptions found, {} to process'.format(len(keys) - len(missing), len(keys), len(missing)))
+        if missing:
+            new_entities = self.extract_entities([text for text, absent in zip(texts, is_missing) if absent])
+            rows = zip(missing, [fingerprint] * len(missing), *[new_entities[label] for label in NER_LABELS])
+            with db_connection(self._cache_db) as conn:
+                with conn:
+                    conn.executemany('INSERT OR REPLACE INTO {} (description, model_fingerprint, {}) VALUES (?, ?, {})'.format(
+                        self._cache_table, label_cols, ', '.join(['?'] * len(NER_LABELS))), rows)
+            for label in NER_LABELS:
+                cache.loc[missing, label.lower()] = new_entities[label]
+
+        cache = cache.astype(object).where(cache.notna(), None)
+        return {label: cache[label.lower()].to_numpy(dtype=object) for label in NER_LABELS}
+
     def transform(self, X, y=None):
-        nlp = spacy.load(model_name)
-        #Run NLP; add results to dataframe
-        X['temp'] = X.apply(lambda row: [nlp(i) for i in row])
-        #Create a dictionary to save entities in
-        ner_dict = {'DRUGNAME': [], 'QUANTITY': [], 'MECHANISM': []}
-        for name in X['temp']:
-            #If the entity was predicted NOT to exist by Ner in the drug name
-            annotations_found = [i.label_ for i in name.ents]
-            if 'DRUGNAME' not in annotations_found:
-                print("'DRUGNAME' doesn't exist for:   {}".format(name.text))
-                ner_dict['DRUGNAME'].append(None)
-            elif 'QUANTITY' not in annotations_found:
-                print("'QUANTITY' doesn't exist for:   {}".format(name.text))
-                ner_dict['QUANTITY'].append(None)
-            elif 'MECHANISM' not in annotations_found:
-                print("'MECHANISM' doesn't exist for:   {}".format(name.text))
-                ner_dict['MECHANISM'].append(None)
-
-            #If the entity was predicted to exist by Ner in the drug name
-            for ent in name.ents:
-                if (ent.label_=='DRUGNAME'):
-                    ner_dict[ent.label_].append(ent.text)
-
-                if (ent.label_=='QUANTITY'):
-                    ner_dict[ent.label_].append(ent.text)
-
-                if (ent.label_=='MECHANISM'):
-                    ner_dict[ent.label_].append(ent.text)
-        X.join(pd.DataFrame(ner_dict))
-        X.drop(['temp'], inplace=True)
+        #Run NLP once per normalized description (on its first original text), then map the results back to every row
+        descriptions = X[self._col]
+        present = descriptions.notna().to_numpy()
+        codes, keys = pd.factorize(normalize_descriptions(descriptions[present]))
+        first_rows = np.unique(codes, return_index=True)[1]
+        texts = descriptions[present].iloc[first_rows].tolist()
+        if self._cache_db is not None:
+            entities = self.cached_entities(list(keys), texts)
+        else:
+            entities = self.extract_entities(texts)
+        columns = {}
+        for label, values in entities.items():
+            missing = sum(value is None for value in values)
+            if missing:
+                print("'{}' doesn't exist for {} of {} names".format(label, missing, len(values)))
+            #Rows without a description get no entities
+            columns[label] = np.full(len(X), None, dtype=object)
+            columns[label][present] = values[codes]
+        return X.assign(**columns)
 
 #################################
-from utils.tools import load_env_vars
-
-
-df = import_db(db_parameters, *num_values, table_name)
-X, y = split_dataset(df, dependent_var='nadac_per_unit')
-
-#Build processing pipeline
-pipe = Pipeline(steps=[('clean_names', CleanNames(regex_fn_dict,
-                                                  cols=['ndc_description'])),
-                       ('remove_data', RemoveData(drop_cols=['corresponding_generic_drug_nadac_per_unit',
-                                                             'corresponding_generic_drug_effective_date',
-                                                             'as_of_date'])),
-                       ('set_dtypes', SetDtypes(cols=['effective_date'])),
-                       ('drug_name_ner', DrugNameNER(col='ndc_description',
-                                                     model_name='models/drug_names'))])
-df_transform = pipe.fit_transform(df)
-print(df_transform.info())
+if __name__ == '__main__':
+    from utils.tools import load_env_vars
+
+    load_env_vars()
+    db_parameters = {'DATABASE_NAME': os.getenv('DATABASE_NAME')}
+    df = import_db(db_parameters, table_name=os.getenv('PRICES_TABLE'))
+    X, y = split_dataset(df, dependent_var='nadac_per_unit')
+
+    #Build processing pipeline
+    pipe = Pipeline(steps=[('clean_names', CleanNames(regex_fn_dict,
+                                                      cols=['ndc_description'])),
+                           ('remove_data', RemoveData(drop_cols=['corresponding_generic_drug_nadac_per_unit',
+                                                                 'corresponding_generic_drug_effective_date',
+                                                                 'as_of_date'])),
+                           ('set_dtypes', SetDtypes(cols=['effective_date'])),
+                           ('drug_name_ner', DrugNameNER(col='ndc_description',
+                                                         model_name='models/drug_names'))])
+    df_transform = pipe.fit_transform(df)
+    print(df_transform.info())
@@ -0,0 +1,96 @@
+import re
+from bisect import bisect_left
+
+import numpy as np
+
+
+def normalize_query(text):
+    """Uppercase a name or query and collapse its whitespace (names are matched case-insensitively)"""
+    return re.sub(r'\s+', ' ', str(text)).strip().upper()
+
+
+class DrugSearchIndex:
+    """
+    Search index over drug IDs (NDCs) and their cleaned names (ndc_description), built
+    once and shared by every session.
+
+    Matches are ranked in two tiers: entries with a word (the NDC itself or any word of
+    the name) starting with the query, found by binary search in a sorted word list, then
+    entries containing the query anywhere, found by scanning one joined string.  Only the
+    requested page of results is produced, so the cost of a keystroke depends on the page
+    size rather than on the size of the catalog.
+    """
+    def __init__(self, ndcs, names=None):
+        names = names or {}
+        self.ndcs = [int(ndc) for ndc in ndcs]
+        self._entries = {ndc: entry for entry, ndc in enumerate(self.ndcs)}
+        self.labels = []
+        keys = []
+        words = []
+        for entry, ndc in enumerate(self.ndcs):
+            name = normalize_query(names.get(ndc, ''))
+            self.labels.append('{} - {}'.format(ndc, name) if name else str(ndc))
+            key = '{} {}'.format(ndc, name).strip()
+            keys.append(key)
+            words.extend((word, entry) for word in set(key.split(' ')))
+        words.sort()
+        self._words = [word for word, _ in words]
+        self._word_entries = [entry for _, entry in words]
+
+        #Every key on its own line (the query never contains a newline), and where each line starts
+        self._text = '\n'.join(keys)
+        self._line_starts = np.cumsum([0] + [len(key) + 1 for key in keys[:-1]])
+
+    def label(self, ndc):
+        """Label (NDC - name) shown for an NDC"""
+        return self.labels[self._entries[int(ndc)]]
+
+    def __len__(self):
+        return len(self.ndcs)
+
+    def _prefix_matches(self, query):
+        position = bisect_left(self._words, query)
+        while position < len(self._words) and self._words[position].startswith(query):
+            yield self._word_entries[position]
+            position += 1
+
+    def _substring_matches(self, query):
+        position = self._text.find(query)
+        while position != -1:
+            entry = int(np.searchsorted(self._line_starts, position, side='right')) - 1
+            yield entry
+            #Continue after the end of this entry's line
+            next_line = self._text.find('\n', position)
+            if next_line == -1:
+                return
+            position = self._text.find(query, next_line + 1)
+
+    def search(self, query, k=20, page=0):
+        """
+        Find the entries matching a query
+
+        Args:
+            query (str): part of an NDC or of a drug name (case-insensitive)
+            k (int): number of results per page
+            page (int): page of results to return (0 is the best matches)
+
+        Returns:
+            List of (ndc, label) tuples (at most k); an empty query returns the first NDCs
+        """
+        query = normalize_query(query)
+        first, last = page * k, (page + 1) * k
+        if not query:
+            return [(self.ndcs[entry], self.labels[entry]) for entry in range(first, min(last, len(self.ndcs)))]
+
+        seen = set()
+        results = []
+        for matches in (self._prefix_matches(query), self._substring_matches(query)):
+            for entry in matches:
+                if entry in seen:
+                    continue
+                seen.add(entry)
+                if len(seen) > first:
+                    results.append((self.ndcs[entry], self.labels[entry]))
+                if len(seen) >= last:
+                    return results
+        return results
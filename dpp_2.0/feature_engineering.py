@@ -0,0 +1,270 @@
+import os
+import json
+
+import dill
+import numpy as np
+import pandas as pd
+import scipy.sparse as sp
+from sklearn.base import BaseEstimator, TransformerMixin
+
+from utils.parquet_store import truncate_parquet, save_to_parquet, load_parquet
+
+
+#Written in a feature dataset: the columns of the feature frame and the pickle it was converted from (see load_features)
+FEATURES_SOURCE_FILE = '_source.json'
+#Position of each row in the saved frame (partitions are read back month by month), so loads keep the row order
+ROW_ORDER_COL = '_row_order'
+
+
+def to_days(dates):
+    """Convert dates to float days since 1970-01-01 (NaT becomes NaN)"""
+    dates = pd.to_datetime(pd.Series(dates)).to_numpy(dtype='datetime64[ns]')
+    days = dates.astype('datetime64[D]').astype(np.int64).astype(np.float64)
+    days[np.isnat(dates)] = np.nan
+    return days
+
+
+def group_positions(codes):
+    """
+    Locate the groups of rows sorted by group code
+
+    Args:
+        codes (numpy.ndarray): integer group code of each row (sorted)
+
+    Returns:
+        Tuple of the index of the first row of each group and the position of each row within its group
+    """
+    starts = np.flatnonzero(np.r_[len(codes) > 0, codes[1:] != codes[:-1]])
+    sizes = np.diff(np.r_[starts, len(codes)])
+    positions = np.arange(len(codes)) - np.repeat(starts, sizes)
+    return starts, positions
+
+
+def group_min(values, starts):
+    """Minimum of each group of sorted rows, ignoring NaNs (NaN for groups without values)"""
+    #reduceat needs at least one group
+    if len(starts) == 0:
+        return np.empty(0, dtype=np.float64)
+    return np.fmin.reduceat(values, starts)
+
+
+def group_lag(values, positions, lag):
+    """Value `lag` rows earlier in the same group (NaN for the first `lag` rows of each group)"""
+    if lag < 1:
+        raise ValueError('lag must be at least 1, got {}'.format(lag))
+    lagged = np.full(len(values), np.nan)
+    lagged[lag:] = values[:-lag]
+    lagged[positions < lag] = np.nan
+    return lagged
+
+
+def group_rolling_mean(values, positions, window):
+    """Mean of the last `window` values of each group, including the current row (NaNs are skipped)"""
+    present = ~np.isnan(values)
+    sums = np.cumsum(np.where(present, values, 0.0))
+    counts = np.cumsum(present)
+    #Totals `window` rows back, or at the start of the group if it is closer
+    back = np.arange(len(values)) - np.minimum(positions + 1, window)
+    prev_sums = np.where(back >= 0, sums[np.maximum(back, 0)], 0.0)
+    prev_counts = np.where(back >= 0, counts[np.maximum(back, 0)], 0)
+    window_counts = counts - prev_counts
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return np.where(window_counts > 0, (sums - prev_sums) / window_counts, np.nan)
+
+
+def group_change_count(values, starts, positions):
+    """Number of times the value changed within the group up to (and including) each row"""
+    changes = np.zeros(len(values), dtype=np.int64)
+    changes[1:] = (values[1:] != values[:-1]) & ~(np.isnan(values[1:]) & np.isnan(values[:-1]))
+    changes[positions == 0] = 0
+    totals = np.cumsum(changes)
+    return totals - np.repeat(totals[starts], np.diff(np.r_[starts, len(values)]))
+
+
+class GroupFeatures(BaseEstimator, TransformerMixin):
+    """
+    Per-drug features, computed on integer-coded NDCs in one pass over the rows sorted by
+    drug and date (the rows are returned in their original order):
+        drug_age: days between the drug's first approval date and the reference date
+        days_before_patent_expires: days between approval and patent expiry
+        days_until_*: days from each row's effective date to the expiry dates in expiry_cols
+        <value_col>_lag_<k>: value k observations earlier
+        <value_col>_rolling_mean_<w>: mean of the last w observations
+        <value_col>_changes: number of value changes so far
+    Features whose source columns are missing are skipped; all features are float32.
+    """
+    def __init__(self, group_col='ndc', date_col='effective_date', value_col='nadac_per_unit',
+                 approval_col='approval_date', patent_col='patent_expire_date_text',
+                 expiry_cols={'patent_expire_date_text': 'days_until_patent_expiry',
+                              'exclusivity_date': 'days_until_exclusivity_expiry'},
+                 lags=[1, 4], rolling_windows=[4, 12], reference_date=None):
+        self._group_col = group_col
+        self._date_col = date_col
+        self._value_col = value_col
+        self._approval_col = approval_col
+        self._patent_col = patent_col
+        self._expiry_cols = expiry_cols
+        self._lags = lags
+        self._rolling_windows = rolling_windows
+        self._reference_date = reference_date
+
+    def fit(self, X, y=None):
+        #drug_age is measured from a fixed date, so that transforms after fit are consistent
+        self.reference_date_ = pd.Timestamp(self._reference_date or pd.Timestamp.today().normalize())
+        return self
+
+    def transform(self, X, y=None):
+        if not hasattr(self, 'reference_date_'):
+            self.fit(X)
+        #Features are added to a copy (the caller's frame is left as it is)
+        X = X.copy()
+        codes = pd.factorize(X[self._group_col])[0]
+        dates = to_days(X[self._date_col])
+        order = np.lexsort((dates, codes))
+        starts, positions = group_positions(codes[order])
+
+        def add_feature(name, sorted_values):
+            #Stored as float32 in the original row order as soon as it is computed (one temporary array at a time)
+            column = np.empty(len(order), dtype=np.float32)
+            column[order] = sorted_values
+            X[name] = column
+
+        if self._approval_col in X:
+            approval = to_days(X[self._approval_col])
+            first_approval = np.repeat(group_min(approval[order], starts), np.diff(np.r_[starts, len(order)]))
+            add_feature('drug_age', to_days([self.reference_date_])[0] - first_approval)
+            if self._patent_col in X:
+                add_feature('days_before_patent_expires', (to_days(X[self._patent_col]) - approval)[order])
+        for col, name in self._expiry_cols.items():
+            if col in X:
+                add_feature(name, (to_days(X[col]) - dates)[order])
+
+        if self._value_col in X:
+            values = X[self._value_col].to_numpy(dtype=np.float64)[order]
+            for lag in self._lags:
+                add_feature('{}_lag_{}'.format(self._value_col, lag), group_lag(values, positions, lag))
+            for window in self._rolling_windows:
+                add_feature('{}_rolling_mean_{}'.format(self._value_col, window), group_rolling_mean(values, positions, window))
+            add_feature('{}_changes'.format(self._value_col), group_change_count(values, starts, positions))
+        return X
+
+
+class SparseOneHotEncoder(BaseEstimator, TransformerMixin):
+    """
+    One-hot encode categorical columns into a scipy sparse matrix, with the vocabulary
+    learned in fit and reused by every later transform, so training and prediction
+    matrices always have the same columns (unseen categories are left as all zeros).
+    Numeric and boolean columns are passed through; columns are named like
+    pandas.get_dummies (feature_names_).
+    """
+    def __init__(self, categorical_cols=None, drop_first=False):
+        self._categorical_cols = categorical_cols
+        self._drop_first = drop_first
+
+    def fit(self, X, y=None):
+        if self._categorical_cols is None:
+            self.categorical_cols_ = [col for col in X.columns
+                                      if not (pd.api.types.is_numeric_dtype(X[col]) or pd.api.types.is_bool_dtype(X[col]))]
+        else:
+            self.categorical_cols_ = list(self._categorical_cols)
+        self.numeric_cols_ = [col for col in X.columns if col not in self.categorical_cols_]
+        self.vocabulary_ = {}
+        for col in self.categorical_cols_:
+            categories = sorted(pd.unique(X[col].dropna()), key=str)
+            self.vocabulary_[col] = categories[1:] if self._drop_first else categories
+        self.feature_names_ = list(self.numeric_cols_) + ['{}_{}'.format(col, category)
+                                                          for col in self.categorical_cols_
+                                                          for category in self.vocabulary_[col]]
+        return self
+
+    def transform(self, X, y=None):
+        numeric = sp.csr_matrix(X[self.numeric_cols_].to_numpy(dtype=np.float64)) if self.numeric_cols_ \
+            else sp.csr_matrix((len(X), 0))
+        rows, cols = [], []
+        offset = len(self.numeric_cols_)
+        for col in self.categorical_cols_:
+            vocabulary = self.vocabulary_[col]
+            codes = pd.Categorical(X[col], categories=vocabulary).codes
+            present = np.flatnonzero(codes >= 0)
+            rows.append(present)
+            cols.append(codes[present].astype(np.int64) + offset)
+            offset += len(vocabulary)
+        rows = np.concatenate(rows) if rows else np.array([], dtype=np.int64)
+        cols = np.concatenate(cols) if cols else np.array([], dtype=np.int64)
+        categorical = sp.csr_matrix((np.ones(len(rows)), (rows, cols - len(self.numeric_cols_))),
+                                    shape=(len(X), offset - len(self.numeric_cols_)))
+        return sp.hstack([numeric, categorical], format='csr')
+
+
+def features_dataset_path(features_path):
+    """Parquet dataset a pickled feature frame is converted to (features_created.pkd -> features_created.parquet)"""
+    return os.path.splitext(features_path)[0] + '.parquet'
+
+
+def save_features(features, dataset_path, date_col='effective_date', source=None):
+    """
+    Save a feature frame as a Parquet dataset partitioned by the month of date_col (built
+    from the <date_col>_year/_month/_day columns if the frame only has those), replacing
+    the dataset if it exists
+
+    Args:
+        features (pandas.DataFrame): feature frame (see FeatureEngineering notebook)
+        dataset_path (str): folder the dataset is written to
+        date_col (str): date column the dataset is partitioned on
+        source (list): signature of the file the frame was read from (optional, see load_features)
+
+    Returns:
+        Nothing (files are written to dataset_path)
+    """
+    columns = list(features.columns)
+    features = features.assign(**{ROW_ORDER_COL: np.arange(len(features))})
+    if date_col not in features:
+        parts = {part: features['{}_{}'.format(date_col, part)].astype(int) for part in ['year', 'month', 'day']}
+        features = features.assign(**{date_col: pd.to_datetime(pd.DataFrame(parts))})
+    truncate_parquet(dataset_path)
+    save_to_parquet(features, dataset_path, partition_col=date_col)
+    with open(os.path.join(dataset_path, FEATURES_SOURCE_FILE), 'w') as outfile:
+        json.dump({'columns': columns, 'date_col': date_col, 'source': source}, outfile)
+
+
+def load_features(features_path, columns=None, ndcs=None, groupby_column='ndc'):
+    """
+    Load the feature frame from its Parquet dataset, reading only the requested columns and
+    NDCs.  A pickled frame (features_created.pkd, as saved by the FeatureEngineering
+    notebook) is converted to a dataset next to it on first use, and again whenever the
+    pickle changes.
+
+    Args:
+        features_path (str): feature dataset (see save_features), or pickled feature frame
+        columns (list): columns to read; those the frame doesn't have are skipped (None reads every column)
+        ndcs (list): only read these NDCs (optional)
+        groupby_column (str): NDC column
+
+    Returns:
+        pandas.DataFrame
+    """
+    if os.path.isdir(features_path):
+        dataset_path = features_path
+    else:
+        dataset_path = features_dataset_path(features_path)
+        stat = os.stat(features_path)
+        source = [os.path.abspath(features_path), stat.st_size, stat.st_mtime]
+        source_file = os.path.join(dataset_path, FEATURES_SOURCE_FILE)
+        stored = None
+        if os.path.exists(source_file):
+            with open(source_file, 'r') as source_json:
+                stored = json.load(source_json)['source']
+        if stored != source:
+            print('Converting {} to a Parquet dataset at {}'.format(features_path, dataset_path))
+            with open(features_path, 'rb') as features_file:
+                save_features(dill.load(features_file), dataset_path, source=source)
+
+    with open(os.path.join(dataset_path, FEATURES_SOURCE_FILE), 'r') as source_json:
+        dataset_info = json.load(source_json)
+    if columns is None:
+        columns = dataset_info['columns']
+    else:
+        columns = [col for col in columns if col in dataset_info['columns']]
+    filters = [(groupby_column, 'in', list(ndcs))] if ndcs else None
+    features = load_parquet(dataset_path, columns=columns + [ROW_ORDER_COL], filters=filters, partition_col=dataset_info['date_col'])
+    return features.sort_values(ROW_ORDER_COL, kind='mergesort').drop(columns=ROW_ORDER_COL).reset_index(drop=True)
@@ -0,0 +1,306 @@
+import os
+import json
+import hashlib
+import argparse
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from utils.tools import load_env_vars
+from utils.connection_manager import db_connection
+from model_artifact import load_model, read_manifest
+from feature_engineering import load_features
+
+
+#Date columns of the feature frame, set to the horizon date when forecasting
+DATE_PART_COLS = {'effective_date_year': 'year', 'effective_date_month': 'month', 'effective_date_day': 'day'}
+
+#Tracks the finished chunks of each run (see run_key), so an interrupted run can be resumed
+PROGRESS_TABLE = 'forecast_progress'
+PROGRESS_FILE = '_progress.json'
+
+
+def model_input_columns(model):
+    """Columns of the feature frame a model reads (before encoding)"""
+    if model.encoder is not None:
+        return list(model.encoder.numeric_cols_) + list(model.encoder.categorical_cols_)
+    return list(model.feature_columns)
+
+
+def load_base_rows(features_path, groups, ndcs=None, groupby_column='ndc', columns=None):
+    """
+    Get the latest feature row of every NDC the model knows (forecasts start from it)
+
+    Args:
+        features_path (str): feature dataset or pickled feature frame (see feature_engineering.load_features)
+        groups (pandas.Index): NDCs the model was fitted on
+        ndcs (list): only forecast these NDCs (optional)
+        groupby_column (str): NDC column
+        columns (list): feature columns the model reads (optional, every column by default)
+
+    Returns:
+        pandas.DataFrame with one row per NDC, sorted by NDC
+    """
+    if columns is not None:
+        columns = [groupby_column] + list(DATE_PART_COLS) + [col for col in columns if col not in DATE_PART_COLS]
+    features = load_features(features_path, columns, ndcs, groupby_column)
+    keep = features[groupby_column].isin(groups)
+    if ndcs:
+        keep &= features[groupby_column].isin(ndcs)
+    features = features[keep]
+    date_cols = [col for col in DATE_PART_COLS if col in features]
+    #Date parts may be float16 (as in the notebooks' feature frames), which pandas can't sort on
+    features = features.sort_values([groupby_column] + date_cols, kind='mergesort',
+                                    key=lambda col: col.astype(np.float64) if col.dtype == np.float16 else col)
+    return features.drop_duplicates(groupby_column, keep='last').reset_index(drop=True)
+
+
+def horizon_dates(horizons=None, start=None, end=None, freq='MS'):
+    """
+    Forecast dates: the listed horizons plus a date range, restricted to [start, end]
+
+    Args:
+        horizons (list): dates to forecast (optional)
+        start (str): first forecast date; with end, also generates dates every freq (optional)
+        end (str): last forecast date (optional)
+        freq (str): pandas frequency of the generated dates (default month starts)
+
+    Returns:
+        Sorted list of unique pandas Timestamps
+    """
+    dates = [pd.Timestamp(horizon) for horizon in horizons or []]
+    if start is not None and end is not None:
+        dates.extend(pd.date_range(start, end, freq=freq))
+    dates = sorted(set(dates))
+    if start is not None:
+        dates = [date for date in dates if date >= pd.Timestamp(start)]
+    if end is not None:
+        dates = [date for date in dates if date <= pd.Timestamp(end)]
+    return dates
+
+
+def run_key(schema_hash, features_path, horizons, ndcs, chunk_size):
+    """Identify a forecast run: resuming only skips chunks finished by a run with the same model, data and options"""
+    stat = os.stat(features_path)
+    key = {'schema_hash': schema_hash,
+           'features': [os.path.abspath(features_path), stat.st_size, stat.st_mtime],
+           'horizons': [date.strftime('%Y-%m-%d') for date in horizons],
+           'ndcs': sorted(int(ndc) for ndc in ndcs or []),
+           'chunk_size': chunk_size}
+    return hashlib.sha1(json.dumps(key, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+def score_chunk(model, base_rows, horizons):
+    """
+    Predict the prices of a chunk of NDCs at every horizon with one vectorized predict call
+
+    Args:
+        model (GroupbyEstimator): fitted model
+        base_rows (pandas.DataFrame): latest feature row of each NDC in the chunk
+        horizons (list): forecast dates
+
+    Returns:
+        pandas.DataFrame (ndc, forecast_date, nadac_per_unit)
+    """
+    rows = pd.concat([base_rows] * len(horizons), ignore_index=True)
+    dates = pd.DatetimeIndex(np.repeat(np.array(horizons, dtype='datetime64[ns]'), len(base_rows)))
+    for col, part in DATE_PART_COLS.items():
+        if col in rows:
+            rows[col] = getattr(dates, part)
+    predictions = model.predict(rows)
+    return pd.DataFrame({'ndc': predictions[model.groupby_column].to_numpy().astype(np.int64),
+                         'forecast_date': dates.strftime('%Y-%m-%d'),
+                         'nadac_per_unit': predictions[model.label].to_numpy(dtype=np.float64)})
+
+
+class SQLForecastWriter:
+    """
+    Write forecasts to a SQLite table keyed (and indexed) by (ndc, forecast_date), with
+    an index on forecast_date; a chunk's rows and its progress entry are committed in
+    the same transaction
+    """
+    def __init__(self, database_name, table_name='forecasts'):
+        self.db_file = os.path.join(os.getcwd(), 'db', database_name)
+        self.table_name = table_name
+        with db_connection(self.db_file) as conn, conn:
+            conn.execute('''CREATE TABLE IF NOT EXISTS {} (
+                                ndc INTEGER NOT NULL,
+                                forecast_date TEXT NOT NULL,
+                                nadac_per_unit REAL,
+                                model_schema_hash TEXT,
+                                created_at TEXT,
+                                PRIMARY KEY (ndc, forecast_date)) WITHOUT ROWID'''.format(table_name))
+            conn.execute('CREATE INDEX IF NOT EXISTS {0}_forecast_date ON {0} (forecast_date)'.format(table_name))
+            conn.execute('''CREATE TABLE IF NOT EXISTS {} (
+                                run_key TEXT NOT NULL,
+                                chunk INTEGER NOT NULL,
+                                finished_at TEXT,
+                                PRIMARY KEY (run_key, chunk)) WITHOUT ROWID'''.format(PROGRESS_TABLE))
+
+    def finished_chunks(self, key):
+        with db_connection(self.db_file) as conn:
+            return {chunk for chunk, in conn.execute('SELECT chunk FROM {} WHERE run_key=?'.format(PROGRESS_TABLE), (key,))}
+
+    def reset(self, key):
+        with db_connection(self.db_file) as conn, conn:
+            conn.execute('DELETE FROM {} WHERE run_key=?'.format(PROGRESS_TABLE), (key,))
+
+    def write(self, key, chunk, forecasts, schema_hash):
+        now = datetime.now().isoformat()
+        rows = zip(forecasts['ndc'].tolist(), forecasts['forecast_date'].tolist(), forecasts['nadac_per_unit'].tolist(),
+                   [schema_hash] * len(forecasts), [now] * len(forecasts))
+        with db_connection(self.db_file) as conn, conn: #commits the chunk as a single transaction
+            conn.executemany('INSERT OR REPLACE INTO {} VALUES (?, ?, ?, ?, ?)'.format(self.table_name), rows)
+            conn.execute('INSERT OR REPLACE INTO {} VALUES (?, ?, ?)'.format(PROGRESS_TABLE), (key, chunk, now))
+
+
+class ParquetForecastWriter:
+    """
+    Write forecasts to a Parquet dataset partitioned by forecast date
+    (forecast_date=YYYY-MM-DD/part-<chunk>.parquet); finished chunks are recorded in a
+    progress file once their files are written
+    """
+    def __init__(self, dataset_path):
+        self.dataset_path = dataset_path
+        self.progress_path = os.path.join(dataset_path, PROGRESS_FILE)
+        if not os.path.exists(dataset_path):
+            os.makedirs(dataset_path)
+
+    def _progress(self):
+        if not os.path.exists(self.progress_path):
+            return {}
+        with open(self.progress_path, 'r') as progress_json:
+            return json.load(progress_json)
+
+    def _save_progress(self, progress):
+        with open(self.progress_path + '.tmp', 'w') as outfile:
+            json.dump(progress, outfile)
+        os.replace(self.progress_path + '.tmp', self.progress_path)
+
+    def finished_chunks(self, key):
+        return set(self._progress().get(key, []))
+
+    def reset(self, key):
+        progress = self._progress()
+        progress.pop(key, None)
+        self._save_progress(progress)
+
+    def write(self, key, chunk, forecasts, schema_hash):
+        for date, rows in forecasts.groupby('forecast_date'):
+            folder = os.path.join(self.dataset_path, 'forecast_date={}'.format(date))
+            if not os.path.exists(folder):
+                os.makedirs(folder)
+            table = pa.Table.from_pandas(rows.drop(columns='forecast_date').assign(model_schema_hash=schema_hash),
+                                         preserve_index=False)
+            #Rewriting a chunk (e.g. after a crash mid-chunk) replaces its files
+            path = os.path.join(folder, 'part-{:05d}.parquet'.format(chunk))
+            pq.write_table(table, path + '.tmp')
+            os.replace(path + '.tmp', path)
+        progress = self._progress()
+        progress[key] = sorted(set(progress.get(key, [])) | {chunk})
+        self._save_progress(progress)
+
+
+def batch_forecast(model_dir, features_path, horizons, writer, ndcs=None, chunk_size=5000, resume=True):
+    """
+    Forecast the price of every NDC at every horizon, a chunk of NDCs at a time, skipping
+    the chunks an earlier identical run already finished
+
+    Args:
+        model_dir (str): model artifact folder (see model_artifact)
+        features_path (str): feature dataset or pickled feature frame the model was trained on
+        horizons (list): forecast dates
+        writer (SQLForecastWriter or ParquetForecastWriter): where forecasts are saved
+        ndcs (list): only forecast these NDCs (optional)
+        chunk_size (int): number of NDCs scored at a time
+        resume (bool): skip finished chunks (False starts the run over)
+
+    Returns:
+        Number of forecasts written
+    """
+    if not horizons:
+        raise ValueError('No forecast dates given')
+    schema_hash = read_manifest(model_dir)['schema_hash']
+    model = load_model(model_dir, expected_hash=schema_hash)
+    base_rows = load_base_rows(features_path, model.groups, ndcs, model.groupby_column, model_input_columns(model))
+    key = run_key(schema_hash, features_path, horizons, ndcs, chunk_size)
+    if not resume:
+        writer.reset(key)
+    finished = writer.finished_chunks(key)
+
+    n_chunks = -(-len(base_rows) // chunk_size)
+    print('Forecasting {} NDCs at {} dates in {} chunks ({} already finished)'.format(
+          len(base_rows), len(horizons), n_chunks, len(finished)))
+    written = 0
+    for chunk in range(n_chunks):
+        if chunk in finished:
+            continue
+        forecasts = score_chunk(model, base_rows.iloc[chunk * chunk_size:(chunk + 1) * chunk_size], horizons)
+        writer.write(key, chunk, forecasts, schema_hash)
+        written += len(forecasts)
+        print('Chunk {}/{} done ({} forecasts)'.format(chunk + 1, n_chunks, len(forecasts)))
+    return written
+
+
+def read_forecasts(database_name, ndcs=None, start=None, end=None, table_name='forecasts'):
+    """
+    Read precomputed forecasts from the database (uses the table's (ndc, forecast_date) key)
+
+    Args:
+        database_name (str): name of the database
+        ndcs (list): NDCs to read (optional, all by default)
+        start (str): first forecast date (optional)
+        end (str): last forecast date (optional)
+        table_name (str): forecasts table
+
+    Returns:
+        pandas.DataFrame (ndc, forecast_date, nadac_per_unit)
+    """
+    conditions, params = [], []
+    if ndcs:
+        conditions.append('ndc IN ({})'.format(', '.join(['?'] * len(ndcs))))
+        params.extend(int(ndc) for ndc in ndcs)
+    if start is not None:
+        conditions.append('forecast_date >= ?')
+        params.append(pd.Timestamp(start).strftime('%Y-%m-%d'))
+    if end is not None:
+        conditions.append('forecast_date <= ?')
+        params.append(pd.Timestamp(end).strftime('%Y-%m-%d'))
+    query = 'SELECT ndc, forecast_date, nadac_per_unit FROM {}'.format(table_name)
+    if conditions:
+        query += ' WHERE ' + ' AND '.join(conditions)
+    with db_connection(os.path.join(os.getcwd(), 'db', database_name)) as conn:
+        forecasts = pd.read_sql_query(query + ' ORDER BY ndc, forecast_date', conn, params=params)
+    forecasts['forecast_date'] = pd.to_datetime(forecasts['forecast_date'])
+    return forecasts
+
+
+if __name__ == '__main__':
+
+    load_env_vars()
+
+    arg_parser = argparse.ArgumentParser(description = 'Precompute price forecasts of every NDC')
+    arg_parser.add_argument('--model', default = os.path.join('..', 'data', 'dashboard', 'model'))
+    arg_parser.add_argument('--features', default = os.path.join('..', 'data', 'features_created.pkd'))
+    arg_parser.add_argument('--horizon', action = 'append', default = [], help = 'forecast date (YYYY-MM-DD), may be repeated')
+    arg_parser.add_argument('--start', help = 'first forecast date; with --end, forecasts every --freq in between')
+    arg_parser.add_argument('--end', help = 'last forecast date')
+    arg_parser.add_argument('--freq', default = 'MS', help = 'pandas frequency of the dates between --start and --end')
+    arg_parser.add_argument('--ndc', action = 'append', type = int, default = [], help = 'only forecast this NDC, may be repeated')
+    arg_parser.add_argument('--chunk-size', type = int, default = 5000)
+    arg_parser.add_argument('--parquet', help = 'write a Parquet dataset to this folder instead of the database')
+    arg_parser.add_argument('--table', default = os.getenv('FORECAST_TABLE', 'forecasts'))
+    arg_parser.add_argument('--restart', action = 'store_true', help = 'ignore chunks finished by an earlier run')
+    args = arg_parser.parse_args()
+
+    if args.parquet:
+        writer = ParquetForecastWriter(args.parquet)
+    else:
+        writer = SQLForecastWriter(os.getenv('DATABASE_NAME'), args.table)
+    horizons = horizon_dates(args.horizon, args.start, args.end, args.freq)
+    written = batch_forecast(args.model, args.features, horizons, writer,
+                             ndcs = args.ndc, chunk_size = args.chunk_size, resume = not args.restart)
+    print('{} forecasts written.'.format(written))
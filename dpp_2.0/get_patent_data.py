@@ -1,65 +1,162 @@
 import os
 from zipfile import ZipFile
-from io import BytesIO
 import pandas as pd
-from urllib.request import urlopen
-import glob
 import dotenv
-import json
 
-from utils.tools import check_build_filepath, save_to_disk, connect_to_database, save_to_SQL
+from utils.tools import check_build_filepath, replace_SQL_table
+from utils.source_refresh import load_source_state, save_source_state, conditional_download
 
 
-def get_orange_data(data_dest='raw_data', source_url='https://www.fda.gov/media/76860/download'):
+#Column types of the Orange Book files (application and product numbers keep their leading zeros)
+ORANGE_BOOK_DTYPES = {'products': {'ingredient': 'string', 'df;route': 'category', 'trade_name': 'string',
+                                   'applicant': 'category', 'strength': 'string', 'appl_type': 'category',
+                                   'appl_no': 'string', 'product_no': 'string', 'te_code': 'category',
+                                   'approval_date': 'string', 'rld': 'category', 'rs': 'category',
+                                   'type': 'category', 'applicant_full_name': 'category'},
+                      'patent': {'appl_type': 'category', 'appl_no': 'string', 'product_no': 'string',
+                                 'patent_no': 'string', 'patent_expire_date_text': 'string',
+                                 'drug_substance_flag': 'category', 'drug_product_flag': 'category',
+                                 'patent_use_code': 'category', 'delist_flag': 'category',
+                                 'submission_date': 'string'},
+                      'exclusivity': {'appl_type': 'category', 'appl_no': 'string', 'product_no': 'string',
+                                      'exclusivity_code': 'category', 'exclusivity_date': 'string'}}
+
+#Date columns (written like "Jan 1, 1982") of each file
+ORANGE_BOOK_DATES = {'products': ['approval_date'],
+                     'patent': ['patent_expire_date_text', 'submission_date'],
+                     'exclusivity': ['exclusivity_date']}
+
+
+def get_orange_data(data_dest='raw_data', source_url='https://www.fda.gov/media/76860/download', source_state=None):
     """
-    Get drug patent data from The Orange Book
+    Get drug patent data from The Orange Book (with a conditional request, so an unchanged
+    archive isn't downloaded again; see utils.source_refresh.conditional_download)
 
     Args:
         data_dest (str): Destination folder of downloaded data
         source_url (str): URL of zipped dataset
+        source_state (dict): stored validators of the archive (updated in place)
 
     Returns:
-        Nothing (dataset is downloaded and unzipped)
+        True if a new version of the archive was saved to data_dest/orange_book.zip
+        (it is read directly, without being extracted)
     """
     current_dir = os.getcwd()
     check_build_filepath(data_dest)
-    data_dir = os.path.join(current_dir, data_dest)
+    zip_path = os.path.join(current_dir, data_dest, 'orange_book.zip')
 
-    # Download and unzip the patent datasets
-    with urlopen(source_url) as zip_response:
-        with ZipFile(BytesIO(zip_response.read())) as zfile:
-            zfile.extractall(data_dir)
+    # Stream the zipped patent datasets to disk (the archive is never held in memory)
+    return conditional_download(source_url, zip_path, source_state if source_state is not None else {})
 
 
-def merge_orange_data(data_loc='raw_data', merging_indices=['appl_no', 'product_no']):
+def read_orange_file(file_obj, name):
     """
-    Orange book data comes in three files.  Merge these files and save them as a single JSON
+    Parse one "~"-separated Orange Book file with the C parser, explicit column types and parsed dates.
+    Columns are matched by name (case-insensitive) with the file's own header, so columns the FDA adds
+    or moves don't shift the data; other columns are skipped.
 
     Args:
-        data_loc (str): location of the raw data (after download)
+        file_obj (file-like or str): open member of the zip file (or path of an extracted file)
+        name (str): name of the file without extension (products, patent or exclusivity)
+
+    Returns:
+        pandas.DataFrame with lowercase column names
+    """
+    dtypes = ORANGE_BOOK_DTYPES[name]
+    #Read the header first, then parse the file from the start again
+    header = pd.read_csv(file_obj, sep='~', engine='c', encoding='latin-1', nrows=0).columns
+    if hasattr(file_obj, 'seek'):
+        file_obj.seek(0)
+    file_cols = {col.strip().lower(): col for col in header}
+    missing = [col for col in dtypes if col not in file_cols]
+    if missing:
+        raise ValueError('Orange Book {} file is missing column(s) {} (found {})'.format(name, missing, list(header)))
+    df = pd.read_csv(file_obj, sep='~', engine='c', encoding='latin-1', header=0,
+                     usecols=[file_cols[col] for col in dtypes],
+                     dtype={file_cols[col]: dtype for col, dtype in dtypes.items()})
+    df = df.rename(columns={file_cols[col]: col for col in dtypes})[list(dtypes)]
+    for col in ORANGE_BOOK_DATES[name]:
+        #Products approved before 1982 are listed as "Approved Prior to Jan 1, 1982"
+        dates = df[col].str.replace('Approved Prior to ', '', regex=False)
+        df[col] = pd.to_datetime(dates, format='%b %d, %Y', errors='coerce')
+    return df
+
+
+def load_orange_data(source, merging_indices=['appl_no', 'product_no']):
+    """
+    Read the three Orange Book files (products, patent and exclusivity) and merge them
+
+    Args:
+        source (str): path of the Orange Book zip file, or of a folder holding the extracted files
         merging_indices (list): columns on which merging will occur (should be unique in combination)
 
     Returns:
-        Nothing (merged dataset saved as JSON to disk)
+        pandas.DataFrame (one row per product / patent / exclusivity combination)
     """
-    #Read in data (dictionary of dataframes with format {filename:pandas.DataFrame})
     df_dict = {}
-    for root, dirs, files in os.walk(data_loc):
-        for file in files:
-            filename, extension = os.path.splitext(file)
-            if extension == '.txt':
-                df_dict[filename] = pd.read_csv(os.path.join(root, file), sep='~', engine='python')
-                df_dict[filename].columns = map(str.lower, df_dict[filename].columns) #lowercase column names
-    # for k, v in df_dict.items():
-    #     print(k, '\n', '-----------')
-    #     print(v.info())
-    #     print('\n'*2)
-    #Merging patent datasets
-    all_patent_data = pd.merge(df_dict['products'], df_dict['patent'], on=merging_indices, how='left')
-    all_patent_data = pd.merge(all_patent_data, df_dict['exclusivity'], on=merging_indices, how='left')
-    #Save merged dataset to disk
-    # print(all_patent_data.info())
-    save_to_disk(os.path.join(data_loc, 'patent_data.json'), all_patent_data.to_json())
+    if os.path.isdir(source):
+        for name in ORANGE_BOOK_DTYPES:
+            df_dict[name] = read_orange_file(os.path.join(source, name + '.txt'), name)
+    else:
+        #Parse the members straight out of the archive
+        with ZipFile(source) as zfile:
+            for member in zfile.namelist():
+                name = os.path.splitext(os.path.basename(member))[0].lower()
+                if name in ORANGE_BOOK_DTYPES:
+                    with zfile.open(member) as file_obj:
+                        df_dict[name] = read_orange_file(file_obj, name)
+
+    #Merging patent datasets (appl_type is the same for a given application)
+    all_patent_data = pd.merge(df_dict['products'], df_dict['patent'].drop(columns='appl_type'), on=merging_indices, how='left')
+    all_patent_data = pd.merge(all_patent_data, df_dict['exclusivity'].drop(columns='appl_type'), on=merging_indices, how='left')
+    return all_patent_data
+
+
+def merge_orange_data(source=os.path.join('raw_data', 'orange_book.zip'), data_loc='raw_data', merging_indices=['appl_no', 'product_no']):
+    """
+    Orange book data comes in three files.  Merge these files and save them as a single Parquet file
+
+    Args:
+        source (str): Orange Book zip file (or folder of extracted files), see get_orange_data
+        data_loc (str): folder the Parquet file is saved to
+        merging_indices (list): columns on which merging will occur (should be unique in combination)
+
+    Returns:
+        Merged pandas.DataFrame (also saved as Parquet to disk)
+    """
+    all_patent_data = load_orange_data(source, merging_indices)
+    all_patent_data.to_parquet(os.path.join(data_loc, 'patent_data.parquet'), index=False)
+    return all_patent_data
+
+
+def refresh_orange_data(db_parameters, data_dest='raw_data', source_url='https://www.fda.gov/media/76860/download'):
+    """
+    Download, merge and load the Orange Book into the patent table, only if the archive
+    changed since it was last loaded
+
+    Args:
+        db_parameters (dict): parameters specific to database (table names, locations)
+            DATABASE_NAME: filename of database
+            PATENT_TABLE: name of the patent table
+        data_dest (str): Destination folder of downloaded data
+        source_url (str): URL of zipped dataset
+
+    Returns:
+        True if the patent table was reloaded, False if the archive didn't change
+    """
+    source_state = load_source_state().get('orange_book', {})
+    if not get_orange_data(data_dest, source_url, source_state):
+        print('Orange Book unchanged since last load; no update needed.')
+        save_source_state('orange_book', source_state)
+        return False
+    df = merge_orange_data(os.path.join(data_dest, 'orange_book.zip'), data_dest)
+
+    #Replace the patent table (the old one is kept if loading the new rows fails)
+    replace_SQL_table(db_parameters['DATABASE_NAME'], db_parameters['PATENT_TABLE'], df, batch_size=max(len(df), 1))
+
+    #Mark this version of the archive as loaded
+    save_source_state('orange_book', source_state)
+    return True
 
 
 if __name__=='__main__':
@@ -73,12 +170,4 @@ if __name__=='__main__':
     db_parameters['PRICES_TABLE'] = os.getenv('PRICES_TABLE')
     db_parameters['PATENT_TABLE'] = os.getenv('PATENT_TABLE')
 
-    #JSON to Pandas.DataFrame
-    filepath = os.path.join('raw_data', 'patent_data.json')
-    print(filepath)
-    with open(filepath, "r") as read_file:
-        data = json.load(read_file)
-    df = pd.read_json(data)
-
-    #Save dataframe to SQL
-    save_to_SQL(db_parameters['DATABASE_NAME'], db_parameters['PATENT_TABLE'], df)
+    refresh_orange_data(db_parameters)
@@ -6,10 +6,22 @@ import json
 import re
 
 import sqlite3
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from collections import deque
+from contextlib import closing
 from datetime import datetime
 from dateutil import parser
+from requests.exceptions import RequestException
 
-from utils.tools import check_build_filepath, save_to_disk, connect_to_database, save_to_SQL
+from utils.tools import check_build_filepath, bulk_save_to_SQL
+from utils.connection_manager import db_connection, db_cursor
+from utils.parquet_store import save_to_parquet, truncate_parquet
+from utils.source_refresh import load_source_state, save_source_state, conditional_download, metadata_signature
+
+
+METADATA_FILE = os.path.join('raw_data', 'price_metadata.json')
 
 
 def setup_socrata_client(credentials, nadac_parameters):
@@ -20,34 +32,47 @@ def setup_socrata_client(credentials, nadac_parameters):
         credentials (dict): Socrata app token from .env file
         nadac_parameters (dict): Parameters for downloading NADAC dataset from .env file
             WEBSITE: url of dataset (less 'http://www.')
+            URI_PREFIX: scheme used to reach WEBSITE (optional, defaults to 'https://';
+                        'http://' allows pointing the client at a local stand-in server)
 
     Returns:
         Socrata client
     """
     client=Socrata(nadac_parameters['WEBSITE'], credentials['APP_TOKEN'])
     client.timeout = int(nadac_parameters['TIMEOUT'])
+    if nadac_parameters.get('URI_PREFIX'):
+        client.uri_prefix = nadac_parameters['URI_PREFIX']
     return client
 
 
-def get_socrata_metadata(credentials, nadac_parameters):
+def socrata_metadata_url(nadac_parameters):
+    """URL of the metadata of the NADAC dataset (the endpoint used by Socrata.get_metadata)"""
+    return '{}{}/api/views/{}.json'.format(nadac_parameters.get('URI_PREFIX') or 'https://',
+                                           nadac_parameters['WEBSITE'],
+                                           nadac_parameters['DATA_LOCATION'])
+
+
+def get_socrata_metadata(credentials, nadac_parameters, source_state=None):
     """
-    Get metadata from socrata dataset
+    Get metadata from socrata dataset (with a conditional request, so unchanged metadata
+    isn't downloaded again; see utils.source_refresh.conditional_download)
 
     Args:
         credentials (dict): Socrata app token from .env file
         nadac_parameters (dict): Parameters for downloading NADAC metadata from .env file
             DATA_LOCATION: location where metadata should be saved
+        source_state (dict): stored validators of the metadata file (updated in place)
 
     Returns:
-        Nothing (saves price_metadata.json to disk)
+        True if new metadata was saved to raw_data/price_metadata.json
     """
-    client = setup_socrata_client(credentials, nadac_parameters)
-    metadata = client.get_metadata(nadac_parameters['DATA_LOCATION'],
-                                   content_type='json')
-
     check_build_filepath('raw_data')
-    save_to_disk('raw_data/price_metadata.json', metadata)
-    client.close()
+    headers = {'Accept': 'application/json'}
+    if credentials.get('APP_TOKEN'):
+        headers['X-App-Token'] = credentials['APP_TOKEN']
+    return conditional_download(socrata_metadata_url(nadac_parameters), METADATA_FILE,
+                                source_state if source_state is not None else {},
+                                headers=headers, timeout=int(nadac_parameters['TIMEOUT']))
 
 
 def metadata_to_schema(credentials, nadac_parameters):
@@ -63,11 +88,11 @@ def metadata_to_schema(credentials, nadac_parameters):
         A schema in dictionary format
     """
     #Check if metadata file exists
-    if not os.path.exists('raw_data/price_metadata.json'):
+    if not os.path.exists(METADATA_FILE):
         get_socrata_metadata(credentials, nadac_parameters)
 
     #Load metadata file
-    with open('raw_data/price_metadata.json', 'r') as metadata_json:
+    with open(METADATA_FILE, 'r') as metadata_json:
         metadata = json.load(metadata_json)
     #Build SQL schema from metadata
     schema_dict = {i['name']:i['dataTypeName'] for i in metadata['columns']}
@@ -83,6 +108,16 @@ def metadata_to_schema(credentials, nadac_parameters):
     return schema_dict
 
 
+#Storage types of the NADAC columns in the Parquet copy of the raw data
+PARQUET_DICTIONARY_COLS = ['ndc_description', 'pharmacy_type_indicator', 'otc', 'explanation_code',
+                           'classification_for_rate_setting', 'pricing_unit']
+PARQUET_FLOAT_COLS = ['nadac_per_unit', 'corresponding_generic_drug_nadac_per_unit']
+PARQUET_DATE_COLS = ['effective_date', 'corresponding_generic_drug_effective_date']
+
+#Dates are stored in the unique id as days since 1970-01-01, so they must fit in 5 digits
+ID_DATE_DIGITS = 100000
+
+
 def create_table_from_schema(credentials, nadac_parameters, db_parameters):
     """
     Create a SQLite table from the schema file_location_name
@@ -95,55 +130,333 @@ def create_table_from_schema(credentials, nadac_parameters, db_parameters):
     Returns:
         Nothing (table is created in SQLite database)
     """
-    conn = connect_to_database(os.path.join(os.getcwd(), 'db', db_parameters['DATABASE_NAME']))
     metadata_schema = metadata_to_schema(credentials, nadac_parameters)
-    c = conn.cursor()
     print('Building table from schema')
-    #Build table schema and execute table creation
-    fieldset = ["id INT PRIMARY KEY ON CONFLICT IGNORE"] #initialized with this because doesn't exist in metadata
-    for col, definition in metadata_schema.items():
-        fieldset.append("'{0}' {1}".format(col, definition))
-    if len(fieldset) > 0:
-        query = "CREATE TABLE IF NOT EXISTS {0} ({1})".format(db_parameters['PRICES_TABLE'], ", ".join(fieldset))
-    c.execute(query)
+    with db_cursor(os.path.join(os.getcwd(), 'db', db_parameters['DATABASE_NAME'])) as c:
+        c.execute(build_prices_table_query(db_parameters['PRICES_TABLE'], metadata_schema))
+    create_price_indexes(db_parameters)
     print('Table built.')
 
 
-def create_unique_id_index(dataframe, column_1, column_2):
+def create_price_indexes(db_parameters):
+    """
+    Create the secondary indexes of the prices table (if they don't exist yet):
+        (ndc, effective_date, nadac_per_unit): covers per-drug price history lookups
+        (effective_date): date range filters and MAX(effective_date)
+        (ndc_description): lookups by drug name
+
+    Args:
+        db_parameters (dict): parameters specific to database (table names, locations)
+            DATABASE_NAME: filename of database
+            PRICES_TABLE: name of the prices table
+
+    Returns:
+        Nothing (indexes are created in SQLite database)
     """
-    Create unique index in dataframe to be used in sqlite database
+    table_name = db_parameters['PRICES_TABLE']
+    indexes = {'ndc_date': ['ndc', 'effective_date', 'nadac_per_unit'],
+               'date': ['effective_date'],
+               'description': ['ndc_description']}
+    with db_cursor(os.path.join(os.getcwd(), 'db', db_parameters['DATABASE_NAME'])) as c:
+        for index_name, cols in indexes.items():
+            c.execute('CREATE INDEX IF NOT EXISTS idx_{0}_{1} ON {0} ({2})'.format(table_name, index_name, ', '.join(cols)))
+
+
+def build_prices_table_query(table_name, schema_dict):
+    """
+    Build the CREATE TABLE statement for the prices table
+
+    Args:
+        table_name (str): name of the table to be created
+        schema_dict (dict): column names and SQLite types (see metadata_to_schema)
+
+    Returns:
+        SQL query (str)
+    """
+    #id is an integer (rowid) key made from ndc and effective_date (see create_unique_id_index)
+    fieldset = ["id INTEGER PRIMARY KEY ON CONFLICT IGNORE"] #initialized with this because doesn't exist in metadata
+    for col, definition in schema_dict.items():
+        if col != 'id':
+            fieldset.append("'{0}' {1}".format(col, definition))
+    return "CREATE TABLE IF NOT EXISTS {0} ({1})".format(table_name, ", ".join(fieldset))
+
+
+def sync_table_schema(db_parameters, schema_dict):
+    """
+    Add columns that appeared in the dataset's metadata to an existing prices table
+    (columns that disappeared are kept, and simply receive NULLs from then on)
+
+    Args:
+        db_parameters (dict): parameters specific to database (table names, locations)
+        schema_dict (dict): column names and SQLite types (see metadata_to_schema)
+
+    Returns:
+        List of the added columns
+    """
+    table_name = db_parameters['PRICES_TABLE']
+    with db_cursor(os.path.join(os.getcwd(), 'db', db_parameters['DATABASE_NAME'])) as c:
+        existing = {row[1] for row in c.execute('PRAGMA table_info({})'.format(table_name))}
+        added = [col for col in schema_dict if col not in existing]
+        for col in added:
+            c.execute('ALTER TABLE {} ADD COLUMN "{}" {}'.format(table_name, col, schema_dict[col]))
+    if added:
+        print('Added columns to {}: {}'.format(table_name, ', '.join(added)))
+    return added
+
+
+def create_unique_id_index(dataframe, ndc_column='ndc', date_column='effective_date'):
+    """
+    Create unique index in dataframe to be used in sqlite database.
+
+    The id packs the NDC and the number of days since 1970-01-01 into a single
+    64-bit integer (ndc * 100000 + days), so it is computed without any per-row
+    Python code, can't collide for distinct (ndc, date) pairs, and is stored as
+    an INTEGER PRIMARY KEY (the table's rowid).
 
     Args:
         dataframe (pandas.DataFrame): dataframe with which to create unique index
-        column_1 (str): name of first column in dataframe to make up unique index
-        column_2 (str): name of second column in dataframe to make up unique index
+        ndc_column (str): name of the column holding the (11 digit) NDC
+        date_column (str): name of the column holding the effective date
     Returns:
         dataframe with the new unique index
     """
+    dataframe = dataframe.drop(['as_of_date'], axis=1, errors='ignore')
 
-    dataframe = dataframe.drop(['as_of_date'], axis=1)
+    ndc = pd.to_numeric(dataframe[ndc_column], errors='coerce')
+    dates = pd.to_datetime(dataframe[date_column], errors='coerce')
+    invalid = ndc.isna() | dates.isna()
+    if invalid.any():
+        print('Dropping {} rows without a valid {} or {}'.format(invalid.sum(), ndc_column, date_column))
+        dataframe, ndc, dates = dataframe[~invalid], ndc[~invalid], dates[~invalid]
 
-    dataframe['id'] = dataframe[column_1] + dataframe[column_2]
-    dataframe['id'] = dataframe.apply(lambda row: row['id'].replace('T', ''), axis=1) #remove 'T' (preceeds the time)
-    dataframe['id'] = dataframe['id'].str.replace(r'[\W]', '') #Remove any non-alphaneumeric (or underscore) characters
-    dataframe['id'] = dataframe['id'].str.replace(r'0{9,}', '') #Remove consecutive zeros with length > 5
+    days = dates.to_numpy().astype('datetime64[D]').astype('int64')
+    dataframe = dataframe.assign(id=ndc.to_numpy().astype('int64') * ID_DATE_DIGITS + days)
 
     # Print out duplicate rows by index
-    duplicate_rows = dataframe[dataframe.duplicated(subset=['id'])]
-    print('Count of duplicate rows: ', len(duplicate_rows))
-    print('Duplicated rows:', duplicate_rows, sep='\n')
+    duplicated = dataframe.duplicated(subset=['id'])
+    print('Count of duplicate rows: ', duplicated.sum())
+    if duplicated.any():
+        print('Duplicated rows:', dataframe[duplicated], sep='\n')
 
     #Drop duplicates
-    dataframe = dataframe[~dataframe.duplicated(subset=['id'])]
+    dataframe = dataframe[~duplicated]
 
     return dataframe
 
 
+def migrate_unique_id_index(db_parameters, ndc_column='ndc', date_column='effective_date'):
+    """
+    Rebuild a prices table created with the old text ids (description + date with
+    characters stripped) so that it uses the integer ids from create_unique_id_index.
+    The ids are recomputed inside SQLite, so the table is never loaded into Python.
+    Tables that already use an INTEGER id are left untouched.
+
+    Args:
+        db_parameters (dict): parameters to access database and table
+            DATABASE_NAME: filename of database
+            PRICES_TABLE: name of the prices table
+        ndc_column (str): name of the column holding the NDC
+        date_column (str): name of the column holding the effective date
+
+    Returns:
+        Nothing (table is migrated in place)
+    """
+    table_name = db_parameters['PRICES_TABLE']
+    with db_connection(os.path.join(os.getcwd(), 'db', db_parameters['DATABASE_NAME'])) as conn:
+        cur = conn.cursor()
+        columns = [(name, col_type) for _, name, col_type, _, _, _ in cur.execute("PRAGMA table_info('{}')".format(table_name))]
+        if dict(columns).get('id', '').upper() == 'INTEGER':
+            return
+
+        print('Migrating {} to integer ids'.format(table_name))
+        schema_dict = {name: col_type for name, col_type in columns if name != 'id'}
+        new_table = '{}_migrated'.format(table_name)
+        col_list = ", ".join('"{}"'.format(col) for col in schema_dict)
+        #Same formula as create_unique_id_index (julianday 2440587.5 is 1970-01-01)
+        id_expression = ("CAST({0} AS INTEGER) * {1} + "
+                         "CAST(julianday(substr({2}, 1, 10)) - 2440587.5 AS INTEGER)").format(ndc_column, ID_DATE_DIGITS, date_column)
+        with conn:
+            cur.execute("DROP TABLE IF EXISTS {}".format(new_table))
+            cur.execute(build_prices_table_query(new_table, schema_dict))
+            cur.execute("INSERT OR IGNORE INTO {0} (id, {1}) SELECT {2}, {1} FROM {3} "
+                        "WHERE {4} IS NOT NULL AND julianday(substr({5}, 1, 10)) IS NOT NULL".format(
+                            new_table, col_list, id_expression, table_name, ndc_column, date_column))
+            cur.execute("DROP TABLE {}".format(table_name))
+            cur.execute("ALTER TABLE {} RENAME TO {}".format(new_table, table_name))
+        conn.execute('VACUUM')
+    print('Migration complete.')
+
+
+def count_socrata_rows(client, nadac_parameters, where=None):
+    """
+    Count the rows of a Socrata dataset (optionally matching a filter)
+
+    Args:
+        client (sodapy.Socrata): Socrata client (see setup_socrata_client)
+        nadac_parameters (dict): Parameters for downloading NADAC dataset from .env file
+            DATA_LOCATION: dataset identifier on Socrata
+        where (str): SoQL filter (optional)
+
+    Returns:
+        Number of rows (int)
+    """
+    results = client.get(nadac_parameters['DATA_LOCATION'],
+                         content_type='json',
+                         select='count(*) AS row_count',
+                         where=where)
+    return int(results[0]['row_count'])
+
+
+def fetch_socrata_page(client, nadac_parameters, offset, limit, where=None, retries=3, backoff=1.0):
+    """
+    Fetch a single page of a Socrata dataset, retrying failed requests with exponential backoff
+
+    Args:
+        client (sodapy.Socrata): Socrata client (see setup_socrata_client)
+        nadac_parameters (dict): Parameters for downloading NADAC dataset from .env file
+            DATA_LOCATION: dataset identifier on Socrata
+        offset (int): index of the first row of the page
+        limit (int): number of rows in the page
+        where (str): SoQL filter (optional)
+        retries (int): number of retries after the first failed attempt
+        backoff (float): seconds to wait before the first retry (doubled on every retry)
+
+    Returns:
+        List of records (dicts) in the page
+    """
+    for attempt in range(retries + 1):
+        try:
+            #Order by the row identifier so that pages don't overlap
+            return client.get(nadac_parameters['DATA_LOCATION'],
+                              content_type='json',
+                              where=where,
+                              order=':id',
+                              limit=limit,
+                              offset=offset)
+        except RequestException as e:
+            if attempt == retries:
+                raise
+            wait = backoff * 2 ** attempt
+            print('Page at offset {} failed ({}); retrying in {}s'.format(offset, e, wait))
+            time.sleep(wait)
+
+
+def iter_socrata_pages(credentials, nadac_parameters, where=None, max_rows=None):
+    """
+    Page through a Socrata dataset, yielding one page of results at a time.
+
+    The dataset is split into offset ranges of PAGE_SIZE rows which are fetched by a
+    pool of WORKERS threads. Pages are yielded in order, and at most twice as many
+    pages as there are workers are held in memory at once.
+
+    Args:
+        credentials (dict): Socrata app token from .env file
+        nadac_parameters (dict): Parameters for downloading NADAC dataset from .env file
+            DATA_LOCATION: dataset identifier on Socrata
+            PAGE_SIZE: number of rows requested per page
+            WORKERS: number of pages fetched concurrently (optional, defaults to 1)
+        where (str): SoQL filter applied to every page (optional)
+        max_rows (int): maximum number of rows to download in total (optional)
+
+    Yields:
+        pandas.DataFrame for each page of results
+    """
+    page_size = int(nadac_parameters['PAGE_SIZE'])
+    workers = int(nadac_parameters.get('WORKERS') or 1)
+
+    client = setup_socrata_client(credentials, nadac_parameters)
+    try:
+        total_rows = count_socrata_rows(client, nadac_parameters, where)
+    finally:
+        client.close()
+    if max_rows is not None:
+        total_rows = min(total_rows, max_rows)
+    print('{} rows to download in pages of {} ({} worker(s))'.format(total_rows, page_size, workers))
+
+    #requests sessions aren't thread-safe, so every worker thread gets its own client
+    thread_data = threading.local()
+    clients = []
+    def fetch(offset):
+        if not hasattr(thread_data, 'client'):
+            thread_data.client = setup_socrata_client(credentials, nadac_parameters)
+            clients.append(thread_data.client)
+        return fetch_socrata_page(thread_data.client, nadac_parameters, offset,
+                                  min(page_size, total_rows - offset), where)
+
+    pending = deque()
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            try:
+                #Keep a bounded number of pages in flight, and hand them back in order
+                for offset in range(0, total_rows, page_size):
+                    pending.append(executor.submit(fetch, offset))
+                    if len(pending) >= workers * 2:
+                        yield pd.DataFrame.from_records(pending.popleft().result())
+                while pending:
+                    yield pd.DataFrame.from_records(pending.popleft().result())
+            finally:
+                for future in pending:
+                    future.cancel()
+    finally:
+        #Also when a page fails for good or the caller stops early (the pool has finished its running pages by now)
+        for client in clients:
+            client.close()
+
+
+def ingest_socrata_pages(pages, db_parameters, download_location, since=None):
+    """
+    Index each page of NADAC data, append it to disk and push it to the prices table
+    as it arrives, so memory use is bounded by the page size
+
+    The raw data is kept as a Parquet dataset (download_location/nadac_data) partitioned
+    by effective_date month, with typed prices and dates and dictionary encoded text.
+
+    Args:
+        pages (iterable): pandas.DataFrame pages (see iter_socrata_pages)
+        db_parameters (dict): parameters to access database and table for data addition
+        download_location (str): location to which data should be downloaded
+        since (str): first effective_date being downloaded; rows from this date on are replaced
+                     in the Parquet dataset (None replaces the whole dataset)
+
+    Returns:
+        Number of rows added to the database
+    """
+    check_build_filepath(download_location)
+    dataset_path = os.path.join(download_location, 'nadac_data')
+    #Rows being downloaded again replace the ones already on disk
+    truncate_parquet(dataset_path, since)
+
+    row_count = 0
+    for page_num, page in enumerate(pages):
+        #Create unique ID index
+        page = create_unique_id_index(page, 'ndc', 'effective_date')
+        # Save page to disk
+        save_to_parquet(page, dataset_path,
+                        dictionary_cols=PARQUET_DICTIONARY_COLS,
+                        float_cols=PARQUET_FLOAT_COLS,
+                        date_cols=PARQUET_DATE_COLS)
+        # Push page to database (revised prices replace the existing rows)
+        bulk_save_to_SQL(database_name=db_parameters['DATABASE_NAME'],
+                         table_name=db_parameters['PRICES_TABLE'],
+                         source_df=page,
+                         upsert_key='id')
+        row_count += len(page)
+        print('Page {} loaded ({} rows so far)'.format(page_num + 1, row_count))
+    print('File saved!')
+    return row_count
+
+
 def get_socrata_data(credentials, nadac_parameters, db_parameters, download_location):
     """
     Get metadata and data from Socrata database, build needed file structure,
-    store the (meta)data as raw JSON, and either build an entirely new database
-    (if non exists), or update the current database.
+    store the raw data as Parquet, and either build an entirely new database
+    (if non exists), or update the current database.  Nothing is downloaded if
+    the dataset's metadata shows no change since the last load.
+
+    Data is downloaded in pages of nadac_parameters['PAGE_SIZE'] rows (fetched
+    concurrently by nadac_parameters['WORKERS'] threads), and each page is written
+    out as it arrives, so peak memory is set by the page size rather than by the
+    size of the dataset.
 
     Args:
         credentials (dict): parameters to access Socrata API
@@ -152,25 +465,42 @@ def get_socrata_data(credentials, nadac_parameters, db_parameters, download_loca
         download_location (str): location to which data should be downloaded
 
     Returns:
-        Nothing (data is retrieved and added to database)
+        True if the dataset changed since the last load (its rowsUpdatedAt in the
+        metadata), False if the download was skipped
     """
-    client = setup_socrata_client(credentials, nadac_parameters)
-
     #Build databasefolder if it doesn't yet exist
     # if not os.path.exists(os.path.join(os.getcwd(), 'db', db_parameters['DATABASE_NAME'])):
     #     print('No database found. Creating database.')
     check_build_filepath('db')
 
+    #Refresh the metadata (conditional request) and summarize it
+    source_state = load_source_state().get('nadac', {})
+    get_socrata_metadata(credentials, nadac_parameters, source_state)
+    with open(METADATA_FILE, 'r') as metadata_json:
+        signature = metadata_signature(json.load(metadata_json))
+
     #Build table if not yet created
-    conn = connect_to_database(os.path.join(os.getcwd(), 'db', db_parameters['DATABASE_NAME']))
-    cur = conn.cursor()
-    if cur.execute("SELECT name FROM sqlite_master WHERE name='{}'".format(db_parameters['PRICES_TABLE'])).fetchone():
+    db_path = os.path.join(os.getcwd(), 'db', db_parameters['DATABASE_NAME'])
+    with db_cursor(db_path) as cur:
+        table_exists = cur.execute("SELECT name FROM sqlite_master WHERE name=?", (db_parameters['PRICES_TABLE'],)).fetchone()
+    if table_exists:
         print('Table already exists')
+        migrate_unique_id_index(db_parameters)
+        #Re-derive the schema when the dataset's columns changed
+        if source_state.get('columns') != signature['columns']:
+            sync_table_schema(db_parameters, metadata_to_schema(credentials, nadac_parameters))
+        create_price_indexes(db_parameters)
+        #Skip the download when no rows changed since the last load
+        if source_state.get('rows_updated_at') == signature['rows_updated_at']:
+            print('NADAC rows unchanged since last load; no update needed.')
+            save_source_state('nadac', source_state)
+            return False
     else:
         create_table_from_schema(credentials, nadac_parameters, db_parameters)
 
-    # Get most recent date from prices table to determine when the last date update was made
-    query_date = cur.execute('SELECT MAX(effective_date) FROM {};'.format(db_parameters['PRICES_TABLE'])).fetchone()[0]
+    # Get most recent date from prices table to determine when the last date update was made (uses the effective_date index)
+    with db_cursor(db_path) as cur:
+        query_date = cur.execute('SELECT MAX(effective_date) FROM {};'.format(db_parameters['PRICES_TABLE'])).fetchone()[0]
     if query_date:
         db_current_date = str(parser.parse(query_date).isoformat())
     else:
@@ -183,46 +513,21 @@ def get_socrata_data(credentials, nadac_parameters, db_parameters, download_loca
         print('Database is already current; no update needed.')
 
     elif db_current_date == None: #No data in database
-        # try:
         print('Downloading a fresh dataset now...')
-        results = client.get(nadac_parameters['DATA_LOCATION'],
-                             content_type='json',
-                             limit=int(nadac_parameters['LIMIT']))
-        nadac_data = pd.DataFrame(results)
-        #Create unique ID index
-        nadac_data = create_unique_id_index(nadac_data, 'ndc_description', 'effective_date')
-
-        # Save file to disk
-        check_build_filepath(download_location)
-        with open(os.path.join(download_location, 'nadac_data.json'), 'w') as outfile:
-            json.dump(nadac_data.to_json(), outfile)
-        print('File saved!')
-        # Push data to database
-        save_to_SQL(database_name=db_parameters['DATABASE_NAME'],
-                    table_name=db_parameters['PRICES_TABLE'],
-                    source_df=nadac_data)
-        # except:
-            # print('Error downloading full database')
+        #closing() shuts the download threads down at once if ingesting a page fails
+        with closing(iter_socrata_pages(credentials, nadac_parameters,
+                                        max_rows=int(nadac_parameters['LIMIT']))) as pages:
+            ingest_socrata_pages(pages, db_parameters, download_location)
+
     else: #current date > db_current_date --> update data
-        # try:
         print('Downloading updates...')
         print('Current date:     ', current_date, '\n',
               'db_current_date: ', db_current_date)
-        results = client.get_all(nadac_parameters['DATA_LOCATION'],
-                             content_type='json',
-                             where="effective_date between '{}' and '{}'".format(db_current_date, current_date))
-        nadac_data = pd.DataFrame.from_records(results)
-        #Create unique ID index
-        # nadac_data = create_unique_id_index(nadac_data, 'ndc', 'effective_date')
-        nadac_data = create_unique_id_index(nadac_data, 'ndc_description', 'effective_date')
-
-        # Save file to disk
-        check_build_filepath(download_location)
-        with open(os.path.join(download_location, 'nadac_data.json'), 'w') as outfile:
-            json.dump(nadac_data.to_json(), outfile)
-        print('File saved!')
-        # Push data to database
-        save_to_SQL(database_name=db_parameters['DATABASE_NAME'],
-                    table_name=db_parameters['PRICES_TABLE'],
-                    source_df=nadac_data)
-    conn.close()
+        with closing(iter_socrata_pages(credentials, nadac_parameters,
+                                        where="effective_date between '{}' and '{}'".format(db_current_date, current_date))) as pages:
+            ingest_socrata_pages(pages, db_parameters, download_location, since=db_current_date)
+
+    #Mark this version of the dataset as loaded
+    source_state.update(signature)
+    save_source_state('nadac', source_state)
+    return True
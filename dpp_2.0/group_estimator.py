@@ -0,0 +1,256 @@
+import numpy as np
+import pandas as pd
+from concurrent.futures import ProcessPoolExecutor
+from scipy import linalg
+import scipy.sparse as sp
+
+from sklearn import base
+from sklearn.pipeline import Pipeline
+from sklearn.linear_model import LinearRegression
+
+
+#Groups whose centered Gram matrix is more ill-conditioned than this (smallest / largest
+#eigenvalue), or that have no more rows than features, are solved with lstsq on their
+#rows instead of the normal equations, exactly as LinearRegression solves them
+GRAM_RCOND = 1e-8
+
+#Singular value cutoff LinearRegression passes to scipy.linalg.lstsq (None before sklearn added `tol`)
+LSTSQ_COND = getattr(LinearRegression(), 'tol', None)
+
+#Memory budget of the Gram matrices solve_groups stacks at a time (n_features^2 floats per group)
+GRAM_CHUNK_BYTES = 64 * 1024 * 1024
+
+
+def solve_groups(X, y, starts, gram_chunk_bytes=None):
+    """
+    Solve the ordinary least squares problems (with intercept) of consecutive groups of rows.
+
+    Rows are centered on their group means, X^T X and X^T y are accumulated per group,
+    and the well-conditioned systems are solved in batched calls, in chunks of groups
+    whose Gram matrices fit in gram_chunk_bytes; the remaining (rank-deficient) groups
+    get the minimum-norm lstsq solution LinearRegression gives.
+
+    Args:
+        X (numpy.ndarray): features, rows sorted by group
+        y (numpy.ndarray): labels, in the same order
+        starts (numpy.ndarray): index of the first row of each group
+        gram_chunk_bytes (int): memory budget of the Gram matrices stacked at a time (defaults to GRAM_CHUNK_BYTES)
+
+    Returns:
+        Tuple of coefficients (n_groups x n_features) and intercepts (n_groups)
+    """
+    n_groups, n_features = len(starts), X.shape[1]
+    stops = np.append(starts[1:], len(X))
+    counts = stops - starts
+
+    x_mean = np.add.reduceat(X, starts, axis=0) / counts[:, None]
+    y_mean = np.add.reduceat(y, starts) / counts
+    X_centered = X - np.repeat(x_mean, counts, axis=0)
+    y_centered = y - np.repeat(y_mean, counts)
+
+    coefs = np.zeros((n_groups, n_features))
+    if gram_chunk_bytes is None:
+        gram_chunk_bytes = GRAM_CHUNK_BYTES
+    chunk_size = max(1, gram_chunk_bytes // (8 * max(n_features, 1) ** 2))
+    for first in range(0, n_groups, chunk_size):
+        chunk = np.arange(first, min(first + chunk_size, n_groups))
+        gram = np.empty((len(chunk), n_features, n_features))
+        xty = np.empty((len(chunk), n_features))
+        for j, (start, stop) in enumerate(zip(starts[chunk], stops[chunk])):
+            gram[j] = X_centered[start:stop].T @ X_centered[start:stop]
+            xty[j] = X_centered[start:stop].T @ y_centered[start:stop]
+
+        eigvals = np.linalg.eigvalsh(gram)
+        well_posed = (counts[chunk] > n_features) & (eigvals[:, 0] > GRAM_RCOND * eigvals[:, -1])
+        if well_posed.any():
+            coefs[chunk[well_posed]] = np.linalg.solve(gram[well_posed], xty[well_posed][..., None])[..., 0]
+        for i in chunk[~well_posed]:
+            coefs[i] = linalg.lstsq(X_centered[starts[i]:stops[i]], y_centered[starts[i]:stops[i]], cond=LSTSQ_COND)[0]
+    intercepts = y_mean - np.einsum('ij,ij->i', x_mean, coefs)
+    return coefs, intercepts
+
+
+def solve_sparse_groups(X, y, starts):
+    """
+    Sparse version of solve_groups: each group is densified on the columns that vary within
+    it only (one-hot columns are mostly constant per drug).  Columns that are constant in
+    a group are zero once centered, so leaving them out gives the same minimum-norm
+    solution (their coefficients are 0), and memory scales with the non-zeros.
+
+    Args:
+        X (scipy.sparse.csr_matrix): features, rows sorted by group
+        y (numpy.ndarray): labels, in the same order
+        starts (numpy.ndarray): index of the first row of each group
+
+    Returns:
+        Tuple of coefficients (n_groups x n_features) and intercepts (n_groups)
+    """
+    X = sp.csr_matrix(X)
+    n_groups, n_features = len(starts), X.shape[1]
+    stops = np.append(starts[1:], X.shape[0])
+    coefs = np.zeros((n_groups, n_features))
+    intercepts = np.empty(n_groups)
+    for i, (start, stop) in enumerate(zip(starts, stops)):
+        X_group, y_group = X[start:stop], y[start:stop]
+        x_mean = np.asarray(X_group.mean(axis=0)).ravel()
+        y_mean = y_group.mean()
+        #Columns that vary within the group (columns without non-zeros are constant)
+        present = np.unique(X_group.indices)
+        X_dense = X_group[:, present].toarray()
+        is_varying = (X_dense != X_dense[:1]).any(axis=0)
+        varying = present[is_varying]
+        if len(varying):
+            X_centered = X_dense[:, is_varying] - x_mean[varying]
+            y_centered = y_group - y_mean
+            gram = X_centered.T @ X_centered
+            eigvals = np.linalg.eigvalsh(gram)
+            if len(X_centered) > len(varying) and eigvals[0] > GRAM_RCOND * eigvals[-1]:
+                coefs[i, varying] = np.linalg.solve(gram, X_centered.T @ y_centered)
+            else:
+                coefs[i, varying] = linalg.lstsq(X_centered, y_centered, cond=LSTSQ_COND)[0]
+        intercepts[i] = y_mean - x_mean @ coefs[i]
+    return coefs, intercepts
+
+
+def _solve_chunk(args):
+    X, y, starts = args
+    return solve_sparse_groups(X, y, starts) if sp.issparse(X) else solve_groups(X, y, starts)
+
+
+def fit_groups(X, y, starts, n_jobs=1):
+    """
+    Fit one linear regression per group of consecutive rows, optionally spreading the
+    groups over a pool of processes (in chunks of roughly equal numbers of rows)
+
+    Args:
+        X (numpy.ndarray or scipy.sparse matrix): features, rows sorted by group
+        y (numpy.ndarray): labels, in the same order
+        starts (numpy.ndarray): index of the first row of each group
+        n_jobs (int): number of processes (1 fits in this process)
+
+    Returns:
+        Tuple of coefficients (n_groups x n_features) and intercepts (n_groups)
+    """
+    if n_jobs == 1 or len(starts) < 2:
+        return _solve_chunk((X, y, starts))
+
+    #Cut the groups into chunks of about the same number of rows (a few per process, to balance the load)
+    n_chunks = min(len(starts), n_jobs * 4)
+    cuts = np.unique(np.searchsorted(starts, np.linspace(0, X.shape[0], n_chunks + 1)[1:-1]))
+    group_chunks = np.split(np.arange(len(starts)), cuts)
+    tasks = []
+    for chunk in group_chunks:
+        if len(chunk) == 0:
+            continue
+        first_row = starts[chunk[0]]
+        last_row = starts[chunk[-1] + 1] if chunk[-1] + 1 < len(starts) else X.shape[0]
+        tasks.append((X[first_row:last_row], y[first_row:last_row], starts[chunk] - first_row))
+
+    with ProcessPoolExecutor(max_workers=n_jobs) as executor:
+        results = list(executor.map(_solve_chunk, tasks))
+    return np.vstack([coefs for coefs, _ in results]), np.concatenate([intercepts for _, intercepts in results])
+
+
+class GroupbyEstimator(base.BaseEstimator, base.RegressorMixin):
+
+
+    def __init__(self, groupby_column, pipeline_factory, n_jobs=1, encoder=None):
+        # column is the value to group by; estimator_factory can be called to produce estimators
+        # encoder (e.g. feature_engineering.SparseOneHotEncoder) turns the feature columns into a sparse
+        # matrix with a vocabulary fixed in fit; without one, features are one-hot encoded with pd.get_dummies
+        self.groupby_column = groupby_column
+        self.pipeline_factory = pipeline_factory
+        self.n_jobs = n_jobs
+        self.encoder = encoder
+
+
+    def fit(self, dataframe, label, solver = 'closed_form'):
+        # Create an estimator and fit it with the portion in each group (create and fit a model per city
+        # solver='closed_form' solves every group's least squares problem in batch (see fit_groups);
+        # solver='pipeline' fits one pipeline_factory() per group (needed for non-linear pipelines)
+        self.drugs_dict = {}
+        self.label = label
+        self.coefs_dict = {}
+        self.intercepts_dict = {}
+
+        if self.encoder is None:
+            dataframe = pd.get_dummies(dataframe)  #onehot encoder had problems with the data, so I'm getting the dummies with pandas here
+        dataframe = dataframe[dataframe[self.groupby_column].notna()]
+        features = dataframe.drop(columns = [label, self.groupby_column])
+        if self.encoder is not None:
+            X_all = self.encoder.fit(features).transform(features)
+            self.feature_columns = list(self.encoder.feature_names_)
+        else:
+            X_all = features.to_numpy(dtype = np.float64)
+            self.feature_columns = list(features.columns)
+
+        if solver == 'pipeline':
+            for name, rows in dataframe.groupby(self.groupby_column).indices.items():
+                y = dataframe[label].iloc[rows]
+                X = X_all[rows]
+                self.drugs_dict[name] = self.pipeline_factory().fit(X, y)
+                self.coefs_dict[name] = self.drugs_dict[name].named_steps["lin_reg"].coef_
+                self.intercepts_dict[name] = self.drugs_dict[name].named_steps["lin_reg"].intercept_
+        elif solver == 'closed_form':
+            #Sort rows by group once, so each group is a contiguous block of rows
+            groups = dataframe[self.groupby_column].to_numpy()
+            order = np.argsort(groups, kind = 'stable')
+            names, starts = np.unique(groups[order], return_index = True)
+            X = X_all[order]
+            y = dataframe[label].to_numpy(dtype = np.float64)[order]
+            coefs, intercepts = fit_groups(X, y, starts, self.n_jobs)
+            self.coefs_dict = dict(zip(names, coefs))
+            self.intercepts_dict = dict(zip(names, intercepts))
+        else:
+            raise ValueError("solver must be 'closed_form' or 'pipeline', got {!r}".format(solver))
+        self._stack_coefs()
+        return self
+
+    def _stack_coefs(self):
+        # Stack the per-group coefficients into one matrix (one row per group) for batch prediction
+        self.groups = pd.Index(list(self.coefs_dict.keys()))
+        self.coef_matrix = np.vstack([np.ravel(self.coefs_dict[name]) for name in self.groups]).astype(np.float64)
+        self.intercepts = np.array([np.ravel(self.intercepts_dict[name])[0] for name in self.groups], dtype = np.float64)
+
+    #Method to get the coefficients for each regression
+    def get_coefs(self):
+        return self.coefs_dict
+
+    #Method to get the intercepts for each regression
+    def get_intercepts(self):
+        return self.intercepts_dict
+
+    def _feature_matrix(self, test_data):
+        # Features selected by name, in the order used in fit
+        X = test_data.drop(columns = [self.label, self.groupby_column], errors = 'ignore')
+        if self.encoder is not None:
+            return self.encoder.transform(X)
+        missing = [col for col in self.feature_columns if col not in X.columns]
+        if missing:
+            raise ValueError('Missing feature columns: {}'.format(missing))
+        return X[self.feature_columns].to_numpy(dtype = np.float64)
+
+    def predict(self, test_data):
+        # Predict every row at once: gather each row's group coefficients and take the row-wise dot product
+        # (the per-group pipelines must be plain linear regressions, as built by pipeline_factory)
+        group_idx = self.groups.get_indexer(test_data[self.groupby_column])
+        if (group_idx < 0).any():
+            unknown = test_data[self.groupby_column][group_idx < 0].unique()
+            raise KeyError('No model fitted for {} {}'.format(self.groupby_column, list(unknown[:10])))
+        X = self._feature_matrix(test_data)
+        if sp.issparse(X):
+            # Only the non-zeros are multiplied: each one by its row's coefficient for its column
+            X = sp.csr_matrix(X)
+            rows = np.repeat(np.arange(X.shape[0]), np.diff(X.indptr))
+            products = X.data * self.coef_matrix[group_idx[rows], X.indices]
+            price_pred = np.bincount(rows, weights = products, minlength = X.shape[0]) + self.intercepts[group_idx]
+        else:
+            price_pred = np.einsum('ij,ij->i', X, self.coef_matrix[group_idx]) + self.intercepts[group_idx]
+        return pd.DataFrame({self.groupby_column: test_data[self.groupby_column].to_numpy(),
+                             self.label: price_pred},
+                            index = test_data.index)
+
+def pipeline_factory():
+    return Pipeline([
+                     ('lin_reg', LinearRegression())
+                    ])
@@ -1,10 +1,37 @@
 import get_price_data
 import os
+import pandas as pd
 from datetime import datetime
-from utils.tools import load_env_vars
+from utils.tools import load_env_vars, bulk_save_to_SQL, replace_SQL_table
 
 from sklearn.pipeline import Pipeline
-from data_cleaner import CleanNames, RemoveData, SetDtypes, DrugNameNER
+from data_cleaner import CleanNames, RemoveData, CompactDtypes, DrugNameNER, metadata_to_dtypes, import_new_rows, get_watermark, set_watermark, get_latest_effective_date
+
+def build_pipeline(regex_fn_dict, metadata_path='raw_data/price_metadata.json', cache_db=None):
+    """
+    Build the cleaning pipeline of the NADAC rows (effective_date and the other columns are
+    given their dtypes from the Socrata metadata by CompactDtypes)
+
+    Args:
+        regex_fn_dict (dict): regex rules used to standardize drug names (see CleanNames)
+        metadata_path (str): location of price_metadata.json
+        cache_db (str): database holding the NER cache (optional, see DrugNameNER)
+
+    Returns:
+        sklearn.pipeline.Pipeline
+    """
+    return Pipeline(steps=[('clean_names', CleanNames(regex_fn_dict,
+                                                      cols=['ndc_description'])),
+                           ('remove_data', RemoveData(drop_cols=['corresponding_generic_drug_nadac_per_unit',
+                                                                 'corresponding_generic_drug_effective_date',
+                                                                 'as_of_date'])),
+                           ('compact_dtypes', CompactDtypes(dtypes=metadata_to_dtypes(metadata_path))),
+                           ('drug_name_ner', DrugNameNER(col='ndc_description',
+                                                         model_name='models/drug_names',
+                                                         batch_size=1000,
+                                                         n_process=-1,
+                                                         cache_db=cache_db))])
+
 
 if __name__ == '__main__':
 
@@ -17,6 +44,8 @@ if __name__ == '__main__':
     #Parameters to access NADAC dataset
     nadac_parameters = {}
     nadac_parameters['LIMIT'] = os.getenv('LIMIT')
+    nadac_parameters['PAGE_SIZE'] = os.getenv('PAGE_SIZE')
+    nadac_parameters['WORKERS'] = os.getenv('WORKERS')
     nadac_parameters['WEBSITE'] = os.getenv('WEBSITE')
     nadac_parameters['DATA_LOCATION'] = os.getenv('DATA_LOCATION')
     nadac_parameters['TIMEOUT'] = os.getenv('TIMEOUT')
@@ -28,9 +57,24 @@ if __name__ == '__main__':
     db_parameters['DATABASE_NAME'] = os.getenv('DATABASE_NAME')
     db_parameters['PRICES_TABLE'] = os.getenv('PRICES_TABLE')
     db_parameters['PATENT_TABLE'] = os.getenv('PATENT_TABLE')
+    db_parameters['CLEAN_TABLE'] = os.getenv('CLEAN_TABLE')
+    db_parameters['WATERMARK_TABLE'] = os.getenv('WATERMARK_TABLE')
 
-    #Download new data or update database
-    df = get_price_data.get_socrata_data(credentials, nadac_parameters, db_parameters, 'raw_data')
+    #'incremental' only transforms rows from the last processed effective_date onwards; 'full' rebuilds the clean table
+    pipeline_mode = os.getenv('PIPELINE_MODE', 'incremental')
+
+    #Download new data or update database (skipped if the dataset didn't change)
+    prices_changed = get_price_data.get_socrata_data(credentials, nadac_parameters, db_parameters, 'raw_data')
+
+    #Read the rows that haven't been cleaned yet.  Nothing is read only if nothing was downloaded and every
+    #date in the prices table was already cleaned (rows downloaded by a run that failed before the cleaned
+    #rows were saved are still past the watermark, so they are picked up by the next run)
+    watermark = get_watermark(db_parameters, db_parameters['CLEAN_TABLE']) if pipeline_mode == 'incremental' else None
+    latest_price_date = get_latest_effective_date(db_parameters, db_parameters['PRICES_TABLE'])
+    if watermark is not None and not prices_changed and (latest_price_date is None or latest_price_date <= watermark):
+        df = pd.DataFrame()
+    else:
+        df = import_new_rows(db_parameters, db_parameters['PRICES_TABLE'], since=watermark)
 
     #Class (and regex functions) for cleaning data
     regex_fn_dict = {r'\sCAP*?\Z|\sCP*?\Z' : ' CAPSULE',
@@ -58,13 +102,18 @@ if __name__ == '__main__':
                    }
 
     #Build processing pipeline
-    pipe = Pipeline(steps=[('clean_names', CleanNames(regex_fn_dict,
-                                                      cols=['ndc_description'])),
-                           ('remove_data', RemoveData(drop_cols=['corresponding_generic_drug_nadac_per_unit',
-                                                                 'corresponding_generic_drug_effective_date',
-                                                                 'as_of_date'])),
-                           ('set_dtypes', SetDtypes(cols=['effective_date'])),
-                           ('drug_name_ner', DrugNameNER(col='ndc_description',
-                                                         model_name='models/drug_names'))])
-    df_transform = pipe.fit_transform(df)
-    print(df_transform.info())
+    pipe = build_pipeline(regex_fn_dict, cache_db=os.path.join('db', db_parameters['DATABASE_NAME']))
+    if df.empty:
+        print('No new rows to process.')
+    else:
+        last_effective_date = df['effective_date'].max()
+        df_transform = pipe.fit_transform(df)
+        print(df_transform.info())
+
+        #Persist the cleaned rows (rows from the watermark date are re-processed, so upsert on id)
+        #A full run replaces the table (the old one is kept if loading the new rows fails)
+        if pipeline_mode != 'incremental':
+            replace_SQL_table(db_parameters['DATABASE_NAME'], db_parameters['CLEAN_TABLE'], df_transform, upsert_key='id')
+        else:
+            bulk_save_to_SQL(db_parameters['DATABASE_NAME'], db_parameters['CLEAN_TABLE'], df_transform, upsert_key='id')
+        set_watermark(db_parameters, db_parameters['CLEAN_TABLE'], last_effective_date)
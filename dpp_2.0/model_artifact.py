@@ -0,0 +1,186 @@
+import os
+import json
+import hashlib
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+from group_estimator import GroupbyEstimator, pipeline_factory
+from feature_engineering import SparseOneHotEncoder
+
+
+#Version of the on-disk layout written by save_model; load_model refuses other versions
+ARTIFACT_VERSION = 1
+
+MANIFEST_FILE = 'model.json'
+ARRAY_FILES = {'groups': 'groups.npy', 'coef_matrix': 'coef_matrix.npy', 'intercepts': 'intercepts.npy'}
+
+
+def _json_value(value):
+    #numpy scalars (e.g. categories of numeric columns) as plain Python values
+    return value.item() if hasattr(value, 'item') else value
+
+
+def model_schema(model):
+    """
+    Everything a model's inputs must agree with: the group and label columns, the feature
+    columns in order and, for models with an encoder, the category vocabulary
+
+    Args:
+        model (GroupbyEstimator): fitted model
+
+    Returns:
+        dict (JSON serializable)
+    """
+    schema = {'groupby_column': model.groupby_column,
+              'label': model.label,
+              'feature_columns': [str(col) for col in model.feature_columns],
+              'encoder': None}
+    encoder = model.encoder
+    if encoder is not None:
+        schema['encoder'] = {'categorical_cols': list(encoder.categorical_cols_),
+                             'numeric_cols': list(encoder.numeric_cols_),
+                             'vocabulary': {col: [_json_value(category) for category in categories]
+                                            for col, categories in encoder.vocabulary_.items()},
+                             'drop_first': encoder._drop_first}
+    return schema
+
+
+def schema_hash(schema):
+    """sha256 of a model schema (see model_schema)"""
+    return hashlib.sha256(json.dumps(schema, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+def save_model(model, artifact_dir):
+    """
+    Save a fitted GroupbyEstimator as a versioned artifact: the group index, coefficient
+    matrix and intercepts as .npy arrays (memory-mappable, no pickle), and a JSON manifest
+    with the schema (feature columns and vocabulary) and its hash.  The manifest is
+    written last, so a folder without one is an incomplete artifact.
+
+    Args:
+        model (GroupbyEstimator): fitted model
+        artifact_dir (str): folder the artifact is written to
+
+    Returns:
+        dict, the manifest
+    """
+    if not os.path.exists(artifact_dir):
+        os.makedirs(artifact_dir)
+    manifest_path = os.path.join(artifact_dir, MANIFEST_FILE)
+    if os.path.exists(manifest_path):
+        os.remove(manifest_path)
+
+    #Object groups can mix key types (e.g. int and str NDCs), which the .npy file can't hold without
+    #pickling: it gets their string form and the manifest keeps the keys themselves
+    groups = np.asarray(model.groups)
+    group_keys = None
+    if groups.dtype == object:
+        group_keys = [_json_value(name) for name in groups]
+        if not all(isinstance(name, (str, int, float)) for name in group_keys):
+            group_keys = None
+        groups = groups.astype(str)
+    arrays = {'groups': groups,
+              'coef_matrix': np.ascontiguousarray(model.coef_matrix, dtype=np.float64),
+              'intercepts': np.ascontiguousarray(model.intercepts, dtype=np.float64)}
+    for key, array in arrays.items():
+        np.save(os.path.join(artifact_dir, ARRAY_FILES[key]), array, allow_pickle=False)
+
+    schema = model_schema(model)
+    manifest = {'format_version': ARTIFACT_VERSION,
+                'created_at': datetime.now().isoformat(),
+                'n_groups': len(groups),
+                'groups_dtype': str(model.groups.dtype),
+                'group_keys': group_keys,
+                'n_features': arrays['coef_matrix'].shape[1],
+                'schema': schema,
+                'schema_hash': schema_hash(schema)}
+    with open(manifest_path + '.tmp', 'w') as outfile:
+        json.dump(manifest, outfile, indent=2)
+    os.replace(manifest_path + '.tmp', manifest_path)
+    return manifest
+
+
+def read_manifest(artifact_dir, expected_hash=None):
+    """Read and check the manifest of a model artifact (see check_compatibility)"""
+    manifest_path = os.path.join(artifact_dir, MANIFEST_FILE)
+    if not os.path.exists(manifest_path):
+        raise FileNotFoundError('No model artifact at {} (missing {})'.format(artifact_dir, MANIFEST_FILE))
+    with open(manifest_path, 'r') as manifest_json:
+        manifest = json.load(manifest_json)
+    check_compatibility(manifest, expected_hash)
+    return manifest
+
+
+def check_compatibility(manifest, expected_hash=None, feature_columns=None):
+    """
+    Check that a model artifact can be used: its format version is the one this code
+    reads, its schema matches its hash and, optionally, the schema callers expect
+
+    Args:
+        manifest (dict): manifest of the artifact
+        expected_hash (str): schema hash the caller was built against (optional)
+        feature_columns (list): feature columns the caller will provide (optional)
+
+    Returns:
+        Nothing (raises ValueError if the artifact is incompatible)
+    """
+    version = manifest.get('format_version')
+    if version != ARTIFACT_VERSION:
+        raise ValueError('Model artifact format version {} is not supported (expected {})'.format(version, ARTIFACT_VERSION))
+    actual_hash = schema_hash(manifest['schema'])
+    if actual_hash != manifest['schema_hash']:
+        raise ValueError('Model artifact schema does not match its hash (the manifest was modified)')
+    if expected_hash is not None and actual_hash != expected_hash:
+        raise ValueError('Model artifact schema {} does not match the expected schema {}'.format(actual_hash[:12], expected_hash[:12]))
+    if feature_columns is not None and [str(col) for col in feature_columns] != manifest['schema']['feature_columns']:
+        raise ValueError('Feature columns do not match the model artifact')
+
+
+def load_model(artifact_dir, mmap=True, expected_hash=None):
+    """
+    Load a model saved by save_model.  With mmap, the arrays are memory-mapped read-only,
+    so loading is nearly instant and processes loading the same artifact share one copy
+    through the page cache.
+
+    Args:
+        artifact_dir (str): folder written by save_model
+        mmap (bool): memory-map the arrays instead of reading them into memory
+        expected_hash (str): schema hash the caller expects (optional, see check_compatibility)
+
+    Returns:
+        GroupbyEstimator ready to predict (solved with the closed form; per-group pipelines are not stored)
+    """
+    manifest = read_manifest(artifact_dir, expected_hash)
+    arrays = {key: np.load(os.path.join(artifact_dir, filename), mmap_mode='r' if mmap else None, allow_pickle=False)
+              for key, filename in ARRAY_FILES.items()}
+    if arrays['coef_matrix'].shape != (manifest['n_groups'], manifest['n_features']) \
+            or arrays['intercepts'].shape != (manifest['n_groups'],) or arrays['groups'].shape != (manifest['n_groups'],):
+        raise ValueError('Model artifact arrays do not match its manifest')
+
+    schema = manifest['schema']
+    encoder = None
+    if schema['encoder'] is not None:
+        encoder = SparseOneHotEncoder(categorical_cols=schema['encoder']['categorical_cols'],
+                                      drop_first=schema['encoder']['drop_first'])
+        encoder.categorical_cols_ = list(schema['encoder']['categorical_cols'])
+        encoder.numeric_cols_ = list(schema['encoder']['numeric_cols'])
+        encoder.vocabulary_ = schema['encoder']['vocabulary']
+        encoder.feature_names_ = list(schema['feature_columns'])
+
+    model = GroupbyEstimator(schema['groupby_column'], pipeline_factory, encoder=encoder)
+    model.label = schema['label']
+    model.feature_columns = list(schema['feature_columns'])
+    if manifest.get('group_keys') is not None:
+        model.groups = pd.Index(manifest['group_keys'], dtype=object)
+    else:
+        model.groups = pd.Index(arrays['groups'])
+    if 'groups_dtype' in manifest:
+        model.groups = model.groups.astype(manifest['groups_dtype'])
+    model.coef_matrix = arrays['coef_matrix']
+    model.intercepts = arrays['intercepts']
+    model.drugs_dict = {}
+    model.coefs_dict = dict(zip(model.groups, model.coef_matrix))
+    model.intercepts_dict = dict(zip(model.groups, model.intercepts))
+    return model
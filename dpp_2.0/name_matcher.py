@@ -0,0 +1,174 @@
+import os
+import hashlib
+import numpy as np
+import pandas as pd
+import dotenv
+
+from sklearn.feature_extraction.text import TfidfVectorizer
+
+from utils.connection_manager import db_connection
+
+
+def orange_book_names(patent_df):
+    """
+    Build one matchable name per Orange Book product (trade name + strength + dosage form,
+    which is how NADAC descriptions are written) from the output of
+    get_patent_data.merge_orange_data
+
+    Args:
+        patent_df (pandas.DataFrame): merged Orange Book data (lowercase column names)
+
+    Returns:
+        pandas.DataFrame with patent_name, ingredient, appl_no and product_no (one row per name)
+    """
+    dosage_form = patent_df['df;route'].astype(str).str.split(';').str[0]
+    names = pd.DataFrame({'patent_name': (patent_df['trade_name'].astype(str) + ' ' +
+                                          patent_df['strength'].astype(str) + ' ' + dosage_form).str.upper(),
+                          'ingredient': patent_df['ingredient'].astype(str).str.upper(),
+                          'appl_no': patent_df['appl_no'],
+                          'product_no': patent_df['product_no']})
+    return names.drop_duplicates(subset=['patent_name']).reset_index(drop=True)
+
+
+def sort_tokens(names):
+    """
+    Normalize names (strengths written as "600MG", punctuation removed) and sort their
+    words, so word order doesn't affect the score (as in token_sort_ratio)
+    """
+    names = names.str.replace(r'(\d)\s+(MG|MCG|G|ML|%|UNIT)\b', r'\1\2', regex=True)
+    return names.str.replace(r'[^\w\s.%/-]', ' ', regex=True).str.split().map(lambda tokens: ' '.join(sorted(tokens)))
+
+
+def first_token(names):
+    """First word of each name (usually the active ingredient or the brand name)"""
+    return names.str.extract(r'^\W*(\w+)', expand=False).fillna('')
+
+
+def match_names(price_names, patent_names, min_score=0.6, pair_chunk_size=500000):
+    """
+    Match NADAC descriptions to Orange Book product names.
+
+    Candidates are blocked on the first word of the description, which is compared with
+    the first word of both the Orange Book trade name and its active ingredient, so only
+    plausible pairs are scored instead of every (description, product) pair.  Names are
+    embedded as TF-IDF vectors of character 3-grams (of the token-sorted names), with the
+    vocabulary and weights learned from the Orange Book names only, so a description's
+    score doesn't depend on the other descriptions matched with it (see cached_match_names).
+    The candidate pairs are scored in vectorized chunks by the cosine similarity of those vectors.
+
+    Args:
+        price_names (list or pandas.Series): unique (cleaned) NADAC descriptions
+        patent_names (pandas.DataFrame): output of orange_book_names
+        min_score (float): minimum cosine similarity (0-1) of an accepted match
+        pair_chunk_size (int): number of candidate pairs scored at a time
+
+    Returns:
+        pandas.DataFrame with ndc_description, patent_name, appl_no, product_no and score
+        (best match per description; descriptions without a match are omitted)
+    """
+    columns = ['ndc_description', 'patent_name', 'appl_no', 'product_no', 'score']
+    price_names = pd.Series(pd.unique(pd.Series(price_names, dtype=object).dropna()), dtype=object)
+    #Products are referred to by position (the rows of patent_vectors), whatever the index of patent_names
+    patent_names = patent_names.reset_index(drop=True)
+    if len(price_names) == 0 or len(patent_names) == 0:
+        return pd.DataFrame(columns=columns)
+    price_sorted = sort_tokens(price_names.str.upper())
+    patent_sorted = sort_tokens(patent_names['patent_name'])
+
+    vectorizer = TfidfVectorizer(analyzer='char_wb', ngram_range=(3, 3), dtype=np.float32)
+    try:
+        vectorizer.fit(patent_sorted)
+    except ValueError:
+        #Empty vocabulary: no Orange Book name is long enough to have a 3-gram
+        return pd.DataFrame(columns=columns)
+    price_vectors = vectorizer.transform(price_sorted).tocsr()
+    patent_vectors = vectorizer.transform(patent_sorted).tocsr()
+
+    #Blocking: candidate pairs share the first word (trade name or ingredient)
+    price_keys = pd.DataFrame({'price_idx': np.arange(len(price_names)), 'key': first_token(price_names.str.upper())})
+    patent_keys = pd.concat([pd.DataFrame({'patent_idx': np.arange(len(patent_names)), 'key': first_token(patent_names['patent_name'])}),
+                             pd.DataFrame({'patent_idx': np.arange(len(patent_names)), 'key': first_token(patent_names['ingredient'])})])
+    pairs = price_keys.merge(patent_keys.drop_duplicates(), on='key')[['price_idx', 'patent_idx']]
+    print('{} descriptions x {} products: scoring {} candidate pairs'.format(len(price_names), len(patent_names), len(pairs)))
+
+    #Row-wise dot products of (L2 normalized) vectors = cosine similarity
+    scores = np.empty(len(pairs), dtype=np.float32)
+    price_idx, patent_idx = pairs['price_idx'].to_numpy(), pairs['patent_idx'].to_numpy()
+    for start in range(0, len(pairs), pair_chunk_size):
+        stop = start + pair_chunk_size
+        products = price_vectors[price_idx[start:stop]].multiply(patent_vectors[patent_idx[start:stop]])
+        scores[start:stop] = np.asarray(products.sum(axis=1)).ravel()
+    pairs = pairs.assign(score=scores)
+
+    #Keep the best candidate per description
+    best = pairs[pairs['score'] >= min_score].sort_values('score', ascending=False).drop_duplicates('price_idx')
+    matches = pd.DataFrame({'ndc_description': price_names.to_numpy()[best['price_idx']],
+                            'score': best['score'].to_numpy()})
+    matches = matches.join(patent_names[['patent_name', 'appl_no', 'product_no']].iloc[best['patent_idx'].to_numpy()].reset_index(drop=True))
+    print('{} of {} descriptions matched'.format(len(matches), len(price_names)))
+    return matches[columns]
+
+
+def orange_book_fingerprint(patent_names):
+    """Fingerprint a set of Orange Book names (cached matches are only valid for the same names)"""
+    return hashlib.sha1('\n'.join(sorted(patent_names['patent_name'])).encode()).hexdigest()
+
+
+def cached_match_names(db_path, price_names, patent_names, min_score=0.6, cache_table='name_matches'):
+    """
+    Match NADAC descriptions to Orange Book products (see match_names), reusing matches
+    cached in the database for the same Orange Book names and match threshold, and
+    caching the matches of descriptions seen for the first time
+
+    Args:
+        db_path (str): path to the database holding the cache table
+        price_names (list or pandas.Series): (cleaned) NADAC descriptions
+        patent_names (pandas.DataFrame): output of orange_book_names
+        min_score (float): minimum cosine similarity (0-1) of an accepted match
+        cache_table (str): name of the cache table
+
+    Returns:
+        pandas.DataFrame with ndc_description, patent_name, appl_no, product_no and score
+    """
+    fingerprint = '{}-{}'.format(orange_book_fingerprint(patent_names), min_score)
+    price_names = pd.unique(pd.Series(price_names, dtype=object).dropna())
+    with db_connection(db_path) as conn:
+        with conn:
+            #Descriptions without a match are cached too (with a NULL patent_name)
+            conn.execute('CREATE TABLE IF NOT EXISTS {} (ndc_description TEXT, fingerprint TEXT, patent_name TEXT, '
+                         'appl_no TEXT, product_no TEXT, score REAL, '
+                         'PRIMARY KEY (ndc_description, fingerprint)) WITHOUT ROWID'.format(cache_table))
+        cache = pd.read_sql_query('SELECT ndc_description, patent_name, appl_no, product_no, score FROM {} '
+                                  'WHERE fingerprint = ?'.format(cache_table), conn, params=(fingerprint,))
+
+    new_names = pd.Series(price_names)[~pd.Series(price_names).isin(cache['ndc_description'])]
+    print('Name match cache: {} of {} descriptions found'.format(len(price_names) - len(new_names), len(price_names)))
+    if len(new_names):
+        new_matches = match_names(new_names, patent_names, min_score=min_score)
+        new_matches = pd.DataFrame({'ndc_description': new_names}).merge(new_matches, on='ndc_description', how='left')
+        rows = zip(new_matches['ndc_description'], [fingerprint] * len(new_matches),
+                   *[new_matches[col].astype(object).where(new_matches[col].notna(), None)
+                     for col in ['patent_name', 'appl_no', 'product_no', 'score']])
+        with db_connection(db_path) as conn:
+            with conn:
+                conn.executemany('INSERT OR REPLACE INTO {} (ndc_description, fingerprint, patent_name, appl_no, product_no, score) '
+                                 'VALUES (?, ?, ?, ?, ?, ?)'.format(cache_table), rows)
+        cache = pd.concat([cache, new_matches], ignore_index=True)
+
+    matches = cache.dropna(subset=['patent_name'])
+    return matches[matches['ndc_description'].isin(price_names)].reset_index(drop=True)
+
+
+if __name__=='__main__':
+    #Import environment variables
+    dotenv_file = dotenv.find_dotenv()
+    dotenv.load_dotenv(dotenv_file)
+    db_path = os.path.join('db', os.getenv('DATABASE_NAME'))
+
+    #Orange Book products (see get_patent_data.merge_orange_data) and cleaned NADAC names (see main.py)
+    patent_names = orange_book_names(pd.read_parquet(os.path.join('raw_data', 'patent_data.parquet')))
+    with db_connection(db_path) as conn:
+        price_names = pd.read_sql_query('SELECT DISTINCT ndc_description FROM {}'.format(os.getenv('CLEAN_TABLE')), conn)['ndc_description']
+
+    matches = cached_match_names(db_path, price_names, patent_names)
+    print(matches.head())
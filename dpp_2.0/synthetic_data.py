@@ -0,0 +1,239 @@
+import os
+import json
+from zipfile import ZipFile, ZIP_DEFLATED
+
+import numpy as np
+import pandas as pd
+
+
+#Drug names used as the vocabulary of synthetic descriptions and trade names
+DRUG_NAMES_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'raw_data', 'drug_names.json')
+
+#Abbreviations found in raw NADAC descriptions (undone by data_cleaner.CleanNames)
+NADAC_ABBREVIATIONS = {' TABLET': ' TAB', ' CAPSULE': ' CAP', ' SOLUTION': ' SOLN', ' CREAM': ' CRM',
+                       ' HYDROCHLORIDE': ' HCL', ' SYRINGE': ' SYR'}
+
+#Header lines of the Orange Book files (the columns are renamed when the files are read)
+ORANGE_BOOK_HEADERS = {'products': ['Ingredient', 'DF;Route', 'Trade_Name', 'Applicant', 'Strength', 'Appl_Type',
+                                    'Appl_No', 'Product_No', 'TE_Code', 'Approval_Date', 'RLD', 'RS', 'Type',
+                                    'Applicant_Full_Name'],
+                       'patent': ['Appl_Type', 'Appl_No', 'Product_No', 'Patent_No', 'Patent_Expire_Date_Text',
+                                  'Drug_Substance_Flag', 'Drug_Product_Flag', 'Patent_Use_Code', 'Delist_Flag',
+                                  'Submission_Date'],
+                       'exclusivity': ['Appl_Type', 'Appl_No', 'Product_No', 'Exclusivity_Code', 'Exclusivity_Date']}
+
+
+def load_drug_names(path=DRUG_NAMES_FILE):
+    """Cleaned drug names (a JSON list, see raw_data/drug_names.json)"""
+    with open(path, 'r') as names_json:
+        return json.load(names_json)
+
+
+def abbreviate(names, rng, share=0.5):
+    """Write a share of the names the way raw NADAC descriptions are written (TAB, CAP, HCL...)"""
+    names = pd.Series(names, dtype=object)
+    abbreviated = names.copy()
+    for full, short in NADAC_ABBREVIATIONS.items():
+        abbreviated = abbreviated.str.replace(full, short, regex=False)
+    return np.where(rng.random(len(names)) < share, abbreviated, names)
+
+
+def format_dates(dates, fmt):
+    """Format dates (NaT becomes None)"""
+    dates = pd.Series(pd.to_datetime(dates))
+    return dates.dt.strftime(fmt).where(dates.notna(), None).to_numpy(dtype=object)
+
+
+def synthetic_nadac(n_rows, names=None, start_date='2013-11-28', seed=0):
+    """
+    Generate NADAC-like price rows: NDCs observed on consecutive weekly effective dates
+    (up to five years of weeks, so larger datasets have more NDCs), with descriptions drawn
+    from a vocabulary of drug names and prices that mostly stay flat from week to week.
+    Text columns are categoricals of the strings Socrata returns (dates included, in the
+    Socrata format), which keeps even 10M rows compact.
+
+    Args:
+        n_rows (int): number of rows
+        names (list): vocabulary of drug names (defaults to raw_data/drug_names.json)
+        start_date (str): first effective date
+        seed (int): random seed
+
+    Returns:
+        pandas.DataFrame with the columns of the NADAC dataset
+    """
+    rng = np.random.default_rng(seed)
+    names = names if names is not None else load_drug_names()
+    n_weeks = int(np.clip(n_rows // 1000, 4, 260))
+    n_ndcs = -(-n_rows // n_weeks)
+
+    #Every NDC is observed each week (rows are sorted by NDC, then date)
+    ndc_codes = rng.choice(10 ** 11 - 10 ** 9, size=n_ndcs, replace=False) + 10 ** 9
+    ndcs = pd.Series(ndc_codes).astype(str).str.zfill(11).to_numpy()
+    row_ndc = np.repeat(np.arange(n_ndcs), n_weeks)[:n_rows]
+    row_week = np.tile(np.arange(n_weeks), n_ndcs)[:n_rows]
+    weeks = pd.Timestamp(start_date) + pd.to_timedelta(7 * np.arange(n_weeks + 1), unit='D')
+    week_labels = format_dates(weeks, '%Y-%m-%dT%H:%M:%S.000')
+
+    #Prices: a random walk per NDC that changes in about one week out of seven
+    base_price = rng.lognormal(-1.0, 1.5, n_ndcs)
+    steps = np.where(rng.random(n_rows) < 0.15, rng.normal(0.0, 0.03, n_rows), 0.0)
+    steps[row_week == 0] = 0.0
+    walk = np.cumsum(steps)
+    starts = np.flatnonzero(row_week == 0)
+    walk -= np.repeat(walk[starts], np.diff(np.r_[starts, n_rows]))
+    prices = np.round(base_price[row_ndc] * np.exp(walk), 5)
+
+    descriptions = abbreviate(np.asarray(names, dtype=object)[rng.integers(len(names), size=n_ndcs)], rng)
+    classification = rng.choice(['G', 'B'], size=n_ndcs, p=[0.8, 0.2])
+    is_brand = classification[row_ndc] == 'B'
+    generic_price = np.where(is_brand, np.round(prices * rng.uniform(0.1, 0.6, n_rows), 5), np.nan)
+
+    def per_ndc(values):
+        values = np.asarray(values)
+        categories, codes = np.unique(values, return_inverse=True)
+        return pd.Categorical.from_codes(codes[row_ndc], categories)
+
+    def per_week(codes):
+        return pd.Categorical.from_codes(codes, week_labels)
+
+    return pd.DataFrame({'ndc_description': per_ndc(descriptions),
+                         'ndc': pd.Categorical.from_codes(row_ndc, ndcs),
+                         'nadac_per_unit': prices,
+                         'effective_date': per_week(row_week),
+                         'pricing_unit': per_ndc(rng.choice(['EA', 'ML', 'GM'], size=n_ndcs, p=[0.8, 0.15, 0.05])),
+                         'pharmacy_type_indicator': per_ndc(np.full(n_ndcs, 'C/I')),
+                         'otc': per_ndc(rng.choice(['N', 'Y'], size=n_ndcs, p=[0.85, 0.15])),
+                         'explanation_code': pd.Categorical(rng.choice(['1', '1, 5', '4', '6'], size=n_rows, p=[0.7, 0.1, 0.1, 0.1])),
+                         'classification_for_rate_setting': per_ndc(classification),
+                         'corresponding_generic_drug_nadac_per_unit': generic_price,
+                         'corresponding_generic_drug_effective_date': per_week(np.where(is_brand, row_week, -1)),
+                         'as_of_date': per_week(row_week + 1)})
+
+
+def socrata_records(dataframe):
+    """
+    Convert NADAC rows to the records the Socrata API returns: every value is a string,
+    and missing values are left out of their record
+
+    Args:
+        dataframe (pandas.DataFrame): rows from synthetic_nadac
+
+    Returns:
+        List of dicts
+    """
+    columns = {}
+    for col in dataframe.columns:
+        values = dataframe[col]
+        if pd.api.types.is_float_dtype(values):
+            text = values.map('{:.5f}'.format).to_numpy(dtype=object)
+        else:
+            text = values.to_numpy(dtype=object)
+        columns[col] = np.where(values.isna().to_numpy(), None, text)
+    return [{col: value for col, value in zip(columns, row) if value is not None}
+            for row in zip(*columns.values())]
+
+
+def synthetic_orange_book(n_products, names=None, seed=0):
+    """
+    Generate the three Orange Book files (products, patent and exclusivity) as they are
+    published: text columns, dates written like "Jul 6, 2020" (some approvals "Approved
+    Prior to Jan 1, 1982"), zero-padded application and product numbers.  About 60% of
+    products have a patent row and 30% an exclusivity row.
+
+    Args:
+        n_products (int): number of products
+        names (list): vocabulary of drug names (defaults to raw_data/drug_names.json)
+        seed (int): random seed
+
+    Returns:
+        dict of {file name: pandas.DataFrame} with the files' header names
+    """
+    rng = np.random.default_rng(seed)
+    names = names if names is not None else load_drug_names()
+
+    def random_dates(n, first='1982-01-01', last='2035-12-31'):
+        first, last = pd.Timestamp(first), pd.Timestamp(last)
+        days = rng.integers(0, (last - first).days, size=n)
+        return format_dates(first + pd.to_timedelta(days, unit='D'), '%b %d, %Y')
+
+    def orange_dates(n, **kwargs):
+        #Days aren't zero-padded (Jul 6, 2020)
+        return pd.Series(random_dates(n, **kwargs)).str.replace(' 0', ' ', regex=False).to_numpy(dtype=object)
+
+    #Products come in applications of one or two products each
+    n_applications = -(-n_products // 2)
+    application_codes = rng.choice(999999, size=n_applications, replace=False) + 1
+    product_application = np.arange(n_products) // 2
+    appl_no = pd.Series(application_codes[product_application]).astype(str).str.zfill(6).to_numpy(dtype=object)
+    product_no = pd.Series(np.arange(n_products) % 2 + 1).astype(str).str.zfill(3).to_numpy(dtype=object)
+    appl_type = rng.choice(['N', 'A'], size=n_applications, p=[0.3, 0.7])[product_application]
+
+    vocabulary = pd.Series(names, dtype=object)
+    trade_names = vocabulary.str.split(' ').str[0].str.upper().to_numpy(dtype=object)
+    strengths = vocabulary.str.extract(r'(\d[\d.]*\s?(?:MG|MCG|ML|%|MEQ))', expand=False).fillna('10MG')
+    strengths = strengths.str.replace(' ', '', regex=False).to_numpy(dtype=object)
+    drug = rng.integers(len(names), size=n_products)
+    applicants = np.array(['PHARMA{}'.format(i) for i in range(max(1, n_products // 50))], dtype=object)
+    applicant = applicants[rng.integers(len(applicants), size=n_products)]
+    approval_dates = orange_dates(n_products, last='2020-12-31')
+    approval_dates[rng.random(n_products) < 0.05] = 'Approved Prior to Jan 1, 1982'
+
+    products = pd.DataFrame({'Ingredient': trade_names[drug],
+                             'DF;Route': rng.choice(['TABLET;ORAL', 'CAPSULE;ORAL', 'INJECTABLE;INJECTION',
+                                                     'SOLUTION;ORAL', 'CREAM;TOPICAL'], size=n_products),
+                             'Trade_Name': trade_names[drug],
+                             'Applicant': applicant,
+                             'Strength': strengths[drug],
+                             'Appl_Type': appl_type,
+                             'Appl_No': appl_no,
+                             'Product_No': product_no,
+                             'TE_Code': rng.choice(['AB', 'AP', ''], size=n_products),
+                             'Approval_Date': approval_dates,
+                             'RLD': rng.choice(['Yes', 'No'], size=n_products, p=[0.2, 0.8]),
+                             'RS': rng.choice(['Yes', 'No'], size=n_products, p=[0.2, 0.8]),
+                             'Type': rng.choice(['RX', 'OTC', 'DISCN'], size=n_products, p=[0.6, 0.1, 0.3]),
+                             'Applicant_Full_Name': applicant + ' INC'})
+
+    n_patents = int(n_products * 0.6)
+    patented = rng.integers(n_products, size=n_patents)
+    patent = pd.DataFrame({'Appl_Type': appl_type[patented],
+                           'Appl_No': appl_no[patented],
+                           'Product_No': product_no[patented],
+                           'Patent_No': rng.integers(4000000, 11000000, size=n_patents).astype(str),
+                           'Patent_Expire_Date_Text': orange_dates(n_patents, first='2000-01-01'),
+                           'Drug_Substance_Flag': rng.choice(['Y', ''], size=n_patents),
+                           'Drug_Product_Flag': rng.choice(['Y', ''], size=n_patents),
+                           'Patent_Use_Code': rng.choice(['U-{}'.format(i) for i in range(1, 300)] + [''], size=n_patents),
+                           'Delist_Flag': rng.choice(['', 'Y'], size=n_patents, p=[0.98, 0.02]),
+                           'Submission_Date': orange_dates(n_patents, first='2000-01-01', last='2020-12-31')})
+
+    n_exclusivities = int(n_products * 0.3)
+    exclusive = rng.integers(n_products, size=n_exclusivities)
+    exclusivity = pd.DataFrame({'Appl_Type': appl_type[exclusive],
+                                'Appl_No': appl_no[exclusive],
+                                'Product_No': product_no[exclusive],
+                                'Exclusivity_Code': rng.choice(['ODE-64', 'NCE', 'M-123', 'PED', 'NP'], size=n_exclusivities),
+                                'Exclusivity_Date': orange_dates(n_exclusivities, first='2015-01-01', last='2030-12-31')})
+    return {'products': products[ORANGE_BOOK_HEADERS['products']],
+            'patent': patent[ORANGE_BOOK_HEADERS['patent']],
+            'exclusivity': exclusivity[ORANGE_BOOK_HEADERS['exclusivity']]}
+
+
+def write_orange_book(tables, zip_path):
+    """
+    Write Orange Book files to a zip archive laid out like the FDA download
+    (products.txt, patent.txt and exclusivity.txt, "~"-separated, latin-1)
+
+    Args:
+        tables (dict): {file name: pandas.DataFrame} from synthetic_orange_book
+        zip_path (str): path of the archive
+
+    Returns:
+        Nothing (the archive is written to zip_path)
+    """
+    folder = os.path.dirname(zip_path)
+    if folder and not os.path.exists(folder):
+        os.makedirs(folder)
+    with ZipFile(zip_path, 'w', ZIP_DEFLATED) as zfile:
+        for name, table in tables.items():
+            zfile.writestr(name + '.txt', table.to_csv(sep='~', index=False).encode('latin-1'))
@@ -0,0 +1,70 @@
+import os
+import json
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from data_cleaner import CleanNames, regex_fn_dict
+
+
+NADAC_SAMPLE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'raw_data', 'nadac_data.json')
+
+
+def legacy_clean(df, regex_fn_dict, cols):
+    #Rule-by-rule str.replace over every row, as CleanNames used to work
+    df = df.copy()
+    for col in cols:
+        for pattern, replacement in regex_fn_dict.items():
+            df[col] = df[col].str.replace(pattern, replacement, regex=True)
+    return df
+
+
+def assert_same_names(actual, expected):
+    actual, expected = pd.Series(actual, dtype=object), pd.Series(expected, dtype=object)
+    assert (actual.isna() == expected.isna()).all()
+    assert (actual[actual.notna()] == expected[expected.notna()]).all()
+
+
+@pytest.fixture(scope='module')
+def descriptions():
+    with open(NADAC_SAMPLE, 'r') as nadac_json:
+        sample = json.loads(json.load(nadac_json))
+    return pd.Series(list(sample['ndc_description'].values()), dtype=object)
+
+
+def test_matches_legacy_loop_on_nadac_descriptions(descriptions):
+    df = pd.DataFrame({'ndc_description': descriptions})
+    expected = legacy_clean(df, regex_fn_dict, ['ndc_description'])
+    actual = CleanNames(regex_fn_dict, cols=['ndc_description']).fit_transform(df.copy())
+    assert_same_names(actual['ndc_description'], expected['ndc_description'])
+
+
+def test_matches_legacy_loop_with_missing_values(descriptions):
+    names = descriptions.iloc[:200].copy()
+    names.iloc[::7] = np.nan
+    names.iloc[3] = None
+    df = pd.DataFrame({'ndc_description': names})
+    expected = legacy_clean(df, regex_fn_dict, ['ndc_description'])
+    actual = CleanNames(regex_fn_dict, cols=['ndc_description']).fit_transform(df.copy())
+    assert_same_names(actual['ndc_description'], expected['ndc_description'])
+
+
+def test_rules_applied_in_order():
+    #Later rules see the output of earlier ones (TAB CHW must not become TABLET CHW)
+    overlapping = {r'\sTAB\sCHW\Z': ' CHEWABLE TABLET',
+                   r'\sTAB\Z': ' TABLET',
+                   r'TABLET': 'TAB-LET',
+                   ' +': ' '}
+    df = pd.DataFrame({'name': ['ASPIRIN 81 MG TAB CHW', 'ASPIRIN 81 MG TAB', 'ASPIRIN  81 MG TABLET', np.nan,
+                                'ASPIRIN 81 MG TAB']})
+    expected = legacy_clean(df, overlapping, ['name'])
+    actual = CleanNames(overlapping, cols=['name']).fit_transform(df.copy())
+    assert_same_names(actual['name'], expected['name'])
+    assert actual['name'].iloc[0] == 'ASPIRIN 81 MG CHEWABLE TAB-LET'
+
+
+def test_all_missing_column():
+    df = pd.DataFrame({'ndc_description': [np.nan, None, np.nan]}, dtype=object)
+    actual = CleanNames(regex_fn_dict, cols=['ndc_description']).fit_transform(df.copy())
+    assert actual['ndc_description'].isna().all()
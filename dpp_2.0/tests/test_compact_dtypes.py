@@ -0,0 +1,61 @@
+import json
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from data_cleaner import CompactDtypes, metadata_to_dtypes
+
+
+METADATA = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'raw_data', 'price_metadata.json')
+
+
+def test_metadata_to_dtypes():
+    dtypes = metadata_to_dtypes(METADATA)
+    assert dtypes['ndc'] == 'int64'
+    assert dtypes['ndc_description'] == 'category'
+    assert dtypes['nadac_per_unit'] == 'float64'
+    assert dtypes['effective_date'] == 'datetime64[ns]'
+    assert dtypes['as_of_date'] == 'datetime64[ns]'
+    assert metadata_to_dtypes(METADATA, float_dtype='float32')['nadac_per_unit'] == 'float32'
+
+
+def test_unknown_metadata_types(tmp_path):
+    metadata_path = str(tmp_path / 'metadata.json')
+    with open(metadata_path, 'w') as outfile:
+        json.dump({'columns': [{'name': 'Location', 'dataTypeName': 'point'}, {'name': 'OTC', 'dataTypeName': 'text'}]}, outfile)
+    assert metadata_to_dtypes(metadata_path) == {'location': 'object', 'otc': 'category'}
+
+
+@pytest.fixture
+def rows():
+    #Text values as read from the prices table, plus a column the metadata doesn't describe
+    return pd.DataFrame({'ndc_description': ['GABAPENTIN 600MG TABLET', 'TELMISARTAN 40MG TABLET', 'GABAPENTIN 600MG TABLET'],
+                         'ndc': ['68001041100', '42571022730', '68001041100'],
+                         'nadac_per_unit': ['0.10423', '0.38687', 'n/a'],
+                         'effective_date': ['2020-11-18T00:00:00.000', '2020-11-25T00:00:00.000', 'not a date'],
+                         'id': ['a', 'b', 'c']})
+
+
+def test_target_dtypes(rows):
+    df = CompactDtypes(dtypes=metadata_to_dtypes(METADATA)).fit_transform(rows)
+    assert isinstance(df['ndc_description'].dtype, pd.CategoricalDtype)
+    assert df['ndc'].dtype == np.int64 and df['ndc'].tolist() == [68001041100, 42571022730, 68001041100]
+    assert df['nadac_per_unit'].dtype == np.float64 and np.isnan(df['nadac_per_unit'].iloc[2])
+    assert pd.api.types.is_datetime64_any_dtype(df['effective_date']) and pd.isna(df['effective_date'].iloc[2])
+    #Columns without metadata are left alone, and metadata columns missing from the frame aren't added
+    assert df['id'].tolist() == ['a', 'b', 'c'] and df['id'].dtype == rows['id'].dtype
+    assert list(df.columns) == list(rows.columns)
+
+
+def test_missing_integers_use_nullable_dtype(rows):
+    rows.loc[1, 'ndc'] = None
+    df = CompactDtypes(dtypes={'ndc': 'int64'}).fit_transform(rows)
+    assert df['ndc'].dtype == 'Int64' and df['ndc'].isna().tolist() == [False, True, False]
+
+
+def test_input_frame_unchanged(rows):
+    original = rows.copy()
+    CompactDtypes(dtypes=metadata_to_dtypes(METADATA)).fit_transform(rows)
+    pd.testing.assert_frame_equal(rows, original)
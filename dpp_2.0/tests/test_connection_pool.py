@@ -0,0 +1,36 @@
+import sqlite3
+
+import pytest
+
+from utils.connection_manager import ConnectionPool
+
+
+@pytest.fixture
+def pool(tmp_path):
+    pool = ConnectionPool(str(tmp_path / 'test.db'), max_connections=2)
+    with pool.cursor() as cur:
+        cur.execute('CREATE TABLE prices (ndc INTEGER)')
+    yield pool
+    pool.close()
+
+
+def test_connections_are_reused(pool):
+    with pool.connection() as conn:
+        conn.execute('INSERT INTO prices VALUES (1)')
+    #The uncommitted insert was rolled back when the connection was returned
+    with pool.connection() as reused:
+        assert reused is conn
+        assert reused.execute('SELECT COUNT(*) FROM prices').fetchone()[0] == 0
+
+
+def test_close_while_borrowed(pool):
+    with pool.connection() as conn:
+        conn.execute('INSERT INTO prices VALUES (1)')
+        pool.close()
+    #The connection closed under its borrower is discarded, not queued again
+    assert pool._idle.empty() and pool._connections == []
+    with pytest.raises(sqlite3.ProgrammingError):
+        conn.execute('SELECT 1')
+    with pytest.raises(sqlite3.ProgrammingError):
+        with pool.connection():
+            pass
@@ -0,0 +1,20 @@
+import json
+import os
+
+import pandas as pd
+
+from dashboard_store import DashboardStore, write_dashboard_artifacts
+
+
+def test_names_are_written_for_forecast_ndcs(tmp_path):
+    history = pd.DataFrame({'ndc': [1, 1, 2, 3],
+                            'date': pd.to_datetime(['2020-01-01', '2020-01-08', '2020-01-01', '2020-01-01']),
+                            'nadac_per_unit': [1.0, 1.1, 2.0, 3.0]})
+    forecast = pd.DataFrame({'ndc': [1, 2], 'date': pd.to_datetime(['2020-03-31'] * 2), 'nadac_per_unit': [1.2, 2.1]})
+    names = {1: 'ZOCOR 10MG TABLET', 2: 'LIPITOR 20MG TABLET', 3: 'ADVIL 200MG TABLET'}
+    write_dashboard_artifacts(str(tmp_path), history, forecast, names=names)
+
+    with open(os.path.join(str(tmp_path), 'names.json'), 'r') as names_json:
+        assert json.load(names_json) == {'1': 'ZOCOR 10MG TABLET', '2': 'LIPITOR 20MG TABLET'}
+    store = DashboardStore(str(tmp_path))
+    assert store.manifest['series'] == {'history': {'ndcs': 3, 'rows': 4}, 'forecast': {'ndcs': 2, 'rows': 2}}
@@ -0,0 +1,88 @@
+import os
+import sqlite3
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from data_cleaner import DrugNameNER, NER_LABELS
+
+
+class StubNER(DrugNameNER):
+    #Stands in for the spaCy model: the first word is the drug name, and every call is recorded
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.calls = []
+
+    def extract_entities(self, texts):
+        self.calls.append(list(texts))
+        entities = {label: np.full(len(texts), None, dtype=object) for label in NER_LABELS}
+        entities['DRUGNAME'][:] = [text.split()[0] for text in texts]
+        return entities
+
+
+@pytest.fixture
+def model_dir(tmp_path):
+    folder = tmp_path / 'drug_names'
+    folder.mkdir()
+    (folder / 'meta.json').write_text('{"version": "1.0.0"}')
+    return str(folder)
+
+
+def entity_values(column):
+    #Missing entities as None (pandas may store them as NaN)
+    return [None if pd.isna(value) else value for value in column]
+
+
+def cached_descriptions(cache_db):
+    conn = sqlite3.connect(cache_db)
+    try:
+        return sorted(row[0] for row in conn.execute('SELECT description FROM ner_cache'))
+    finally:
+        conn.close()
+
+
+def test_model_sees_original_text_and_nulls_are_skipped(model_dir):
+    ner = StubNER(col='ndc_description', model_name=model_dir)
+    df = pd.DataFrame({'ndc_description': ['Gabapentin 600 MG', 'GABAPENTIN  600 MG ', np.nan, None, 'Lipitor 20 MG']})
+    result = ner.transform(df)
+    #One call per normalized description, with the text of its first row
+    assert ner.calls == [['Gabapentin 600 MG', 'Lipitor 20 MG']]
+    assert entity_values(result['DRUGNAME']) == ['Gabapentin', 'Gabapentin', None, None, 'Lipitor']
+    assert entity_values(result['QUANTITY']) == [None] * 5
+
+
+def test_cache_hits_misses_and_model_change(model_dir, tmp_path):
+    cache_db = str(tmp_path / 'cache.db')
+    df = pd.DataFrame({'ndc_description': ['GABAPENTIN 600 MG', np.nan, 'LIPITOR 20 MG']})
+    ner = StubNER(col='ndc_description', model_name=model_dir, cache_db=cache_db)
+    ner.transform(df)
+    assert ner.calls == [['GABAPENTIN 600 MG', 'LIPITOR 20 MG']]
+    #Missing descriptions aren't cached (no 'NAN' entry)
+    assert cached_descriptions(cache_db) == ['GABAPENTIN 600 MG', 'LIPITOR 20 MG']
+
+    #Only descriptions the cache doesn't have are run (the same text, differently spaced, is a hit)
+    ner = StubNER(col='ndc_description', model_name=model_dir, cache_db=cache_db)
+    more = pd.DataFrame({'ndc_description': ['Gabapentin  600 mg', 'Advil 200 MG', None]})
+    result = ner.transform(more)
+    assert ner.calls == [['Advil 200 MG']]
+    assert entity_values(result['DRUGNAME']) == ['GABAPENTIN', 'Advil', None]
+
+    #Everything is cached: the model isn't run at all
+    ner = StubNER(col='ndc_description', model_name=model_dir, cache_db=cache_db)
+    ner.transform(more)
+    assert ner.calls == []
+
+    #A re-saved model invalidates the cache
+    with open(os.path.join(model_dir, 'meta.json'), 'w') as meta_file:
+        meta_file.write('{"version": "1.1.0"}')
+    ner = StubNER(col='ndc_description', model_name=model_dir, cache_db=cache_db)
+    ner.transform(more)
+    assert ner.calls == [['Gabapentin  600 mg', 'Advil 200 MG']]
+
+
+def test_only_missing_descriptions(model_dir, tmp_path):
+    ner = StubNER(col='ndc_description', model_name=model_dir, cache_db=str(tmp_path / 'cache.db'))
+    result = ner.transform(pd.DataFrame({'ndc_description': [np.nan, None]}))
+    assert entity_values(result['DRUGNAME']) == [None, None]
+    assert ner.calls == []
@@ -0,0 +1,63 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from data_cleaner import ExpandDates
+
+
+@pytest.fixture
+def prices():
+    #Weekly-ish observations of three drugs, out of order; drug 3 has a single row
+    return pd.DataFrame({'ndc': [1, 2, 1, 3, 1, 2, 1, 2],
+                         'effective_date': pd.to_datetime(['2020-01-08', '2020-01-01', '2020-01-01', '2020-02-01',
+                                                           '2020-01-15', '2020-01-03', '2020-01-22', '2020-01-10']),
+                         'nadac_per_unit': [1.0, 5.0, 1.0, 9.0, 1.5, 5.0, 1.5, 4.0]})
+
+
+def notebook_panel(prices):
+    #Daily panel as built in the notebooks: per drug, asfreq('D') with a forward fill
+    frames = []
+    for ndc, rows in prices.groupby('ndc'):
+        daily = rows.set_index('effective_date').sort_index()[['nadac_per_unit']].asfreq('D').ffill()
+        frames.append(daily.reset_index().assign(ndc=ndc))
+    return pd.concat(frames, ignore_index=True)[['ndc', 'effective_date', 'nadac_per_unit']]
+
+
+def test_daily_matches_asfreq_ffill(prices):
+    panel = ExpandDates(mode='daily').fit_transform(prices)
+    expected = notebook_panel(prices)
+    pd.testing.assert_frame_equal(panel[['ndc', 'effective_date', 'nadac_per_unit']], expected, check_dtype=False)
+    #One row per drug per day, and a single-row drug keeps its row
+    assert len(panel) == 22 + 10 + 1
+    assert panel[panel['ndc'] == 3]['effective_date'].tolist() == [pd.Timestamp('2020-02-01')]
+
+
+def test_daily_duplicate_dates_keep_last(prices):
+    duplicated = pd.concat([prices, pd.DataFrame({'ndc': [1], 'effective_date': [pd.Timestamp('2020-01-08')], 'nadac_per_unit': [1.2]})],
+                           ignore_index=True)
+    panel = ExpandDates(mode='daily').fit_transform(duplicated)
+    assert panel.loc[(panel['ndc'] == 1) & (panel['effective_date'] == '2020-01-09'), 'nadac_per_unit'].tolist() == [1.2]
+
+
+def test_intervals(prices):
+    intervals = ExpandDates(mode='intervals').fit_transform(prices)
+    assert intervals[['ndc', 'effective_date', 'effective_date_end', 'nadac_per_unit']].values.tolist() == [
+        [1, pd.Timestamp('2020-01-01'), pd.Timestamp('2020-01-14'), 1.0],
+        [1, pd.Timestamp('2020-01-15'), pd.Timestamp('2020-01-22'), 1.5],
+        [2, pd.Timestamp('2020-01-01'), pd.Timestamp('2020-01-09'), 5.0],
+        [2, pd.Timestamp('2020-01-10'), pd.Timestamp('2020-01-10'), 4.0],
+        [3, pd.Timestamp('2020-02-01'), pd.Timestamp('2020-02-01'), 9.0]]
+
+
+def test_intervals_cover_the_daily_panel(prices):
+    #Expanding each interval day by day gives back the daily panel
+    intervals = ExpandDates(mode='intervals').fit_transform(prices)
+    days = (intervals['effective_date_end'] - intervals['effective_date']).dt.days.to_numpy() + 1
+    expanded = intervals.loc[np.repeat(intervals.index, days), ['ndc', 'nadac_per_unit']].reset_index(drop=True)
+    panel = ExpandDates(mode='daily').fit_transform(prices)
+    pd.testing.assert_frame_equal(expanded, panel[['ndc', 'nadac_per_unit']])
+
+
+def test_invalid_mode():
+    with pytest.raises(ValueError):
+        ExpandDates(mode='weekly')
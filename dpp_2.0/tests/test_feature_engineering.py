@@ -0,0 +1,40 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from feature_engineering import GroupFeatures, group_lag, group_min, group_positions
+
+
+@pytest.fixture
+def prices():
+    return pd.DataFrame({'ndc': ['b', 'a', 'b', 'a', 'b'],
+                         'effective_date': pd.to_datetime(['2020-01-08', '2020-01-01', '2020-01-01', '2020-01-08', '2020-01-15']),
+                         'nadac_per_unit': [2.0, 1.0, 3.0, 1.5, 2.5],
+                         'approval_date': pd.to_datetime(['2010-01-01', '2012-01-01', '2009-01-01', np.nan, np.nan])})
+
+
+def test_transform_leaves_input_unchanged(prices):
+    original = prices.copy()
+    features = GroupFeatures(reference_date='2020-01-01', lags=[1], rolling_windows=[2]).fit_transform(prices)
+    pd.testing.assert_frame_equal(prices, original)
+    assert 'drug_age' in features and 'nadac_per_unit_lag_1' not in prices
+    #Lag of each row within its drug, in the original row order
+    np.testing.assert_array_equal(features['nadac_per_unit_lag_1'].to_numpy(), [3.0, np.nan, np.nan, 1.0, 2.0])
+    np.testing.assert_array_equal(features['drug_age'].to_numpy(), np.float32([4017, 2922, 4017, 2922, 4017]))
+
+
+def test_transform_empty_frame(prices):
+    features = GroupFeatures(reference_date='2020-01-01').fit_transform(prices.iloc[:0])
+    assert len(features) == 0 and 'drug_age' in features
+
+
+def test_empty_groups():
+    starts, positions = group_positions(np.array([], dtype=np.int64))
+    assert len(starts) == 0 and len(positions) == 0
+    assert len(group_min(np.array([]), starts)) == 0
+
+
+@pytest.mark.parametrize('lag', [0, -1])
+def test_invalid_lag(lag):
+    with pytest.raises(ValueError):
+        group_lag(np.arange(3.0), np.arange(3), lag)
@@ -0,0 +1,127 @@
+import os
+import sys
+import subprocess
+
+import dill
+import numpy as np
+import pandas as pd
+import pyarrow.parquet as pq
+import pytest
+
+import forecast
+from forecast import (batch_forecast, horizon_dates, load_base_rows, read_forecasts,
+                      ParquetForecastWriter, SQLForecastWriter, PROGRESS_TABLE)
+from group_estimator import GroupbyEstimator, pipeline_factory
+from feature_engineering import SparseOneHotEncoder
+from model_artifact import save_model
+
+
+NDCS = [11, 12, 13, 14, 15]
+HORIZONS = ['2020-02-01', '2020-03-01']
+
+
+@pytest.fixture
+def workdir(tmp_path, monkeypatch):
+    #The forecasts database is db/<database name> under the working directory
+    monkeypatch.chdir(tmp_path)
+    rng = np.random.default_rng(0)
+    dates = pd.date_range('2019-01-01', periods=12, freq='MS')
+    features = pd.DataFrame({'ndc': np.repeat(NDCS, len(dates)),
+                             #Date parts are float16 in the notebooks' feature frames
+                             'effective_date_year': np.tile(dates.year, len(NDCS)).astype(np.float16),
+                             'effective_date_month': np.tile(dates.month, len(NDCS)).astype(np.float16),
+                             'effective_date_day': np.tile(dates.day, len(NDCS)).astype(np.float16),
+                             'otc': rng.choice(['Y', 'N'], len(NDCS) * len(dates)),
+                             'nadac_per_unit': rng.normal(10, 1, len(NDCS) * len(dates))})
+    #Newest rows first, so the base rows have to be sorted
+    features = features.iloc[::-1].reset_index(drop=True)
+    with open('features_created.pkd', 'wb') as outfile:
+        dill.dump(features, outfile)
+    model = GroupbyEstimator('ndc', pipeline_factory, encoder=SparseOneHotEncoder()).fit(features, 'nadac_per_unit')
+    save_model(model, 'model')
+    return {'features': features, 'model': model}
+
+
+def expected_forecasts(workdir, ndcs=NDCS):
+    features = workdir['features']
+    latest = features[features['effective_date_month'] == 12].set_index('ndc').loc[ndcs].reset_index()
+    expected = []
+    for horizon in pd.to_datetime(HORIZONS):
+        rows = latest.assign(effective_date_year=horizon.year, effective_date_month=horizon.month, effective_date_day=horizon.day)
+        expected.append(pd.DataFrame({'ndc': rows['ndc'], 'forecast_date': horizon,
+                                      'nadac_per_unit': workdir['model'].predict(rows)['nadac_per_unit'].to_numpy()}))
+    return pd.concat(expected).sort_values(['ndc', 'forecast_date']).reset_index(drop=True)
+
+
+def test_base_rows(workdir):
+    base_rows = load_base_rows('features_created.pkd', workdir['model'].groups, ndcs=[13, 11, 99])
+    assert base_rows['ndc'].tolist() == [11, 13]
+    assert (base_rows['effective_date_month'] == 12).all()
+
+
+def test_sql_writer(workdir):
+    written = batch_forecast('model', 'features_created.pkd', horizon_dates(HORIZONS), SQLForecastWriter('test.db'), chunk_size=2)
+    assert written == len(NDCS) * len(HORIZONS)
+    forecasts = read_forecasts('test.db')
+    pd.testing.assert_frame_equal(forecasts, expected_forecasts(workdir), check_dtype=False)
+
+    subset = read_forecasts('test.db', ndcs=[12, 14], start='2020-03-01')
+    assert subset['ndc'].tolist() == [12, 14]
+    assert (subset['forecast_date'] == pd.Timestamp('2020-03-01')).all()
+
+
+def test_parquet_writer(workdir):
+    written = batch_forecast('model', 'features_created.pkd', horizon_dates(HORIZONS), ParquetForecastWriter('forecasts'), chunk_size=2)
+    assert written == len(NDCS) * len(HORIZONS)
+    assert sorted(os.listdir(os.path.join('forecasts', 'forecast_date=2020-02-01'))) == \
+        ['part-00000.parquet', 'part-00001.parquet', 'part-00002.parquet']
+    forecasts = pq.read_table('forecasts').to_pandas()
+    forecasts['forecast_date'] = pd.to_datetime(forecasts['forecast_date'].astype(str))
+    forecasts = forecasts.sort_values(['ndc', 'forecast_date']).reset_index(drop=True)
+    pd.testing.assert_frame_equal(forecasts[['ndc', 'forecast_date', 'nadac_per_unit']], expected_forecasts(workdir),
+                                  check_dtype=False)
+
+
+@pytest.mark.parametrize('make_writer', [lambda: SQLForecastWriter('test.db'), lambda: ParquetForecastWriter('forecasts')])
+def test_resume(workdir, monkeypatch, make_writer):
+    writer = make_writer()
+    write = type(writer).write
+    written_chunks = []
+    def failing_write(self, key, chunk, forecasts, schema_hash):
+        if chunk == 1:
+            raise RuntimeError('interrupted')
+        written_chunks.append(chunk)
+        write(self, key, chunk, forecasts, schema_hash)
+    monkeypatch.setattr(type(writer), 'write', failing_write)
+    with pytest.raises(RuntimeError):
+        batch_forecast('model', 'features_created.pkd', horizon_dates(HORIZONS), writer, chunk_size=2)
+    assert written_chunks == [0]
+
+    #Resuming only scores the chunks that weren't finished
+    monkeypatch.setattr(type(writer), 'write', write)
+    written = batch_forecast('model', 'features_created.pkd', horizon_dates(HORIZONS), writer, chunk_size=2)
+    assert written == 3 * len(HORIZONS)
+    assert batch_forecast('model', 'features_created.pkd', horizon_dates(HORIZONS), writer, chunk_size=2) == 0
+
+    #A different run (here another chunk size) doesn't reuse those chunks, and resume=False starts over
+    assert batch_forecast('model', 'features_created.pkd', horizon_dates(HORIZONS), writer, chunk_size=3) == 10
+    assert batch_forecast('model', 'features_created.pkd', horizon_dates(HORIZONS), writer, chunk_size=2, resume=False) == 10
+
+
+def test_no_horizons(workdir):
+    with pytest.raises(ValueError):
+        batch_forecast('model', 'features_created.pkd', [], SQLForecastWriter('test.db'))
+
+
+def test_cli(workdir, tmp_path):
+    script = os.path.abspath(forecast.__file__)
+    env = dict(os.environ, DATABASE_NAME='cli.db',
+               PYTHONPATH=os.pathsep.join([os.path.dirname(script), os.environ.get('PYTHONPATH', '')]))
+    result = subprocess.run([sys.executable, script, '--model', 'model', '--features', 'features_created.pkd',
+                             '--start', HORIZONS[0], '--end', HORIZONS[1], '--ndc', '12', '--ndc', '14', '--chunk-size', '1'],
+                            cwd=str(tmp_path), env=env, capture_output=True, text=True)
+    assert result.returncode == 0, result.stderr
+    assert '4 forecasts written.' in result.stdout
+    pd.testing.assert_frame_equal(read_forecasts('cli.db'), expected_forecasts(workdir, [12, 14]), check_dtype=False)
+    with forecast.db_connection(os.path.join('db', 'cli.db')) as conn:
+        assert conn.execute('SELECT COUNT(*) FROM {}'.format(PROGRESS_TABLE)).fetchone()[0] == 2
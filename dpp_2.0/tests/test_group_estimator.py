@@ -0,0 +1,75 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import group_estimator
+from group_estimator import GroupbyEstimator, pipeline_factory, solve_groups
+
+
+@pytest.fixture
+def prices():
+    rng = np.random.default_rng(0)
+    n = 200
+    return pd.DataFrame({'ndc': np.repeat([1, 2, 3, 4], n // 4),
+                         'effective_date_year': rng.integers(2015, 2021, n),
+                         'effective_date_month': rng.integers(1, 13, n),
+                         'nadac_per_unit': rng.normal(10, 1, n)})
+
+
+def test_predict_selects_features_by_name(prices):
+    model = GroupbyEstimator('ndc', pipeline_factory).fit(prices, 'nadac_per_unit')
+    reordered = prices[['effective_date_month', 'ndc', 'effective_date_year']]
+    np.testing.assert_allclose(model.predict(reordered)['nadac_per_unit'], model.predict(prices)['nadac_per_unit'])
+
+
+def test_predict_missing_feature_columns(prices):
+    model = GroupbyEstimator('ndc', pipeline_factory).fit(prices, 'nadac_per_unit')
+    renamed = prices.rename(columns={'effective_date_month': 'month'})
+    with pytest.raises(ValueError, match="effective_date_month"):
+        model.predict(renamed)
+
+
+def test_solve_groups_in_chunks():
+    rng = np.random.default_rng(1)
+    counts = rng.integers(2, 30, 50)
+    starts = np.r_[0, np.cumsum(counts)[:-1]]
+    X = rng.normal(size=(counts.sum(), 5))
+    y = rng.normal(size=counts.sum())
+    #Groups with fewer rows than features are solved with lstsq, the others in batches
+    coefs, intercepts = solve_groups(X, y, starts)
+    for gram_chunk_bytes in [1, 8 * 5 * 5 * 7]:
+        chunk_coefs, chunk_intercepts = solve_groups(X, y, starts, gram_chunk_bytes=gram_chunk_bytes)
+        np.testing.assert_allclose(chunk_coefs, coefs, rtol=1e-10, atol=1e-12)
+        np.testing.assert_allclose(chunk_intercepts, intercepts, rtol=1e-10, atol=1e-12)
+
+
+@pytest.fixture
+def multi_group_prices():
+    rng = np.random.default_rng(2)
+    frames = []
+    for ndc, n in zip([11, 12, 13, 14, 15], [40, 25, 60, 3, 30]):
+        frame = pd.DataFrame({'ndc': ndc,
+                              'x1': rng.normal(size=n),
+                              'x2': rng.normal(size=n),
+                              'x3': rng.normal(size=n)})
+        frame['nadac_per_unit'] = 1.5 * frame['x1'] - 0.5 * frame['x2'] + rng.normal(0, 0.1, n) + ndc
+        frames.append(frame)
+    prices = pd.concat(frames, ignore_index=True)
+    #Rank-deficient groups: a copy of another column in 12, a constant column in 13 (and 14 has fewer rows than features)
+    prices.loc[prices['ndc'] == 12, 'x3'] = 2 * prices.loc[prices['ndc'] == 12, 'x1']
+    prices.loc[prices['ndc'] == 13, 'x3'] = 1.0
+    return prices.sample(frac=1, random_state=0)
+
+
+@pytest.mark.parametrize('gram_chunk_bytes', [None, 8 * 3 * 3 * 2])
+def test_closed_form_matches_pipeline(multi_group_prices, monkeypatch, gram_chunk_bytes):
+    if gram_chunk_bytes is not None:
+        #Two groups per chunk
+        monkeypatch.setattr(group_estimator, 'GRAM_CHUNK_BYTES', gram_chunk_bytes)
+    closed_form = GroupbyEstimator('ndc', pipeline_factory).fit(multi_group_prices, 'nadac_per_unit', solver='closed_form')
+    pipeline = GroupbyEstimator('ndc', pipeline_factory).fit(multi_group_prices, 'nadac_per_unit', solver='pipeline')
+    assert list(closed_form.groups) == list(pipeline.groups)
+    np.testing.assert_allclose(closed_form.coef_matrix, pipeline.coef_matrix, rtol=1e-7, atol=1e-9)
+    np.testing.assert_allclose(closed_form.intercepts, pipeline.intercepts, rtol=1e-7, atol=1e-9)
+    np.testing.assert_allclose(closed_form.predict(multi_group_prices)['nadac_per_unit'],
+                               pipeline.predict(multi_group_prices)['nadac_per_unit'], rtol=1e-7, atol=1e-9)
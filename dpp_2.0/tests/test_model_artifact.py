@@ -0,0 +1,110 @@
+import json
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from group_estimator import GroupbyEstimator, pipeline_factory
+from feature_engineering import SparseOneHotEncoder
+from model_artifact import save_model, load_model, read_manifest, check_compatibility, MANIFEST_FILE
+
+
+def prices(ndcs):
+    rng = np.random.default_rng(0)
+    n = 30 * len(ndcs)
+    return pd.DataFrame({'ndc': pd.Series(np.repeat(ndcs, 30), dtype=object if isinstance(ndcs, list) else None),
+                         'effective_date_year': rng.integers(2015, 2021, n),
+                         'otc': rng.choice(['Y', 'N'], n),
+                         'nadac_per_unit': rng.normal(10, 1, n)})
+
+
+def round_trip(model, artifact_dir, **kwargs):
+    save_model(model, artifact_dir)
+    return load_model(artifact_dir, **kwargs)
+
+
+@pytest.mark.parametrize('mmap', [True, False])
+def test_round_trip(tmp_path, mmap):
+    data = prices(np.array([11, 12, 13]))
+    model = GroupbyEstimator('ndc', pipeline_factory, encoder=SparseOneHotEncoder()).fit(data, 'nadac_per_unit')
+    loaded = round_trip(model, str(tmp_path / 'model'), mmap=mmap)
+    assert isinstance(loaded.coef_matrix, np.memmap) == mmap
+    assert loaded.feature_columns == model.feature_columns
+    pd.testing.assert_index_equal(loaded.groups, model.groups)
+    pd.testing.assert_frame_equal(loaded.predict(data), model.predict(data))
+
+
+@pytest.mark.parametrize('ndcs', [[11, 12, 13], ['00011', '00012', '00013'], np.float32([11, 12, 13])])
+def test_group_keys_keep_their_type(tmp_path, ndcs):
+    data = prices(ndcs)
+    model = GroupbyEstimator('ndc', pipeline_factory, encoder=SparseOneHotEncoder()).fit(data, 'nadac_per_unit')
+    loaded = round_trip(model, str(tmp_path / 'model'))
+    assert loaded.groups.dtype == model.groups.dtype
+    pd.testing.assert_frame_equal(loaded.predict(data), model.predict(data))
+
+
+def test_mixed_object_groups(tmp_path):
+    #Object keys used to come back as strings, so predict found no model for the int NDCs
+    data = prices(np.array([11, 12, 13]))
+    model = GroupbyEstimator('ndc', pipeline_factory, encoder=SparseOneHotEncoder()).fit(data, 'nadac_per_unit')
+    names = [11, '00012', 13.5]
+    data['ndc'] = data['ndc'].map(dict(zip(model.groups, names))).astype(object)
+    model.groups = pd.Index(names, dtype=object)
+    model.coefs_dict = dict(zip(model.groups, model.coef_matrix))
+    model.intercepts_dict = dict(zip(model.groups, model.intercepts))
+
+    loaded = round_trip(model, str(tmp_path / 'model'))
+    assert loaded.groups.dtype == object
+    assert [type(name) for name in loaded.groups] == [int, str, float]
+    assert set(loaded.coefs_dict) == set(names)
+    predictions = loaded.predict(data)
+    assert predictions.notna().all().all()
+    pd.testing.assert_frame_equal(predictions, model.predict(data))
+
+
+@pytest.fixture
+def artifact_dir(tmp_path):
+    model = GroupbyEstimator('ndc', pipeline_factory, encoder=SparseOneHotEncoder()).fit(prices(np.array([11, 12])), 'nadac_per_unit')
+    artifact_dir = str(tmp_path / 'model')
+    save_model(model, artifact_dir)
+    return artifact_dir
+
+
+def edit_manifest(artifact_dir, **changes):
+    path = os.path.join(artifact_dir, MANIFEST_FILE)
+    with open(path, 'r') as manifest_json:
+        manifest = json.load(manifest_json)
+    manifest.update(changes)
+    with open(path, 'w') as outfile:
+        json.dump(manifest, outfile)
+    return manifest
+
+
+def test_compatibility(artifact_dir):
+    manifest = read_manifest(artifact_dir)
+    check_compatibility(manifest, manifest['schema_hash'], manifest['schema']['feature_columns'])
+    with pytest.raises(ValueError, match='does not match the expected schema'):
+        check_compatibility(manifest, 'f' * 64)
+    with pytest.raises(ValueError, match='Feature columns'):
+        check_compatibility(manifest, feature_columns=['effective_date_year'])
+
+
+def test_format_version_mismatch(artifact_dir):
+    edit_manifest(artifact_dir, format_version=2)
+    with pytest.raises(ValueError, match='format version 2'):
+        load_model(artifact_dir)
+
+
+def test_modified_schema(artifact_dir):
+    manifest = read_manifest(artifact_dir)
+    schema = dict(manifest['schema'], label='other_label')
+    edit_manifest(artifact_dir, schema=schema)
+    with pytest.raises(ValueError, match='does not match its hash'):
+        load_model(artifact_dir)
+
+
+def test_incomplete_artifact(artifact_dir):
+    os.remove(os.path.join(artifact_dir, MANIFEST_FILE))
+    with pytest.raises(FileNotFoundError):
+        load_model(artifact_dir)
@@ -0,0 +1,46 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from name_matcher import match_names
+
+
+PATENT_NAMES = pd.DataFrame({'patent_name': ['ZOCOR 10MG TABLET', 'LIPITOR 20MG TABLET', 'ADVIL 200MG TABLET', 'NEXIUM 40MG CAPSULE'],
+                             'ingredient': ['SIMVASTATIN', 'ATORVASTATIN CALCIUM', 'IBUPROFEN', 'ESOMEPRAZOLE MAGNESIUM'],
+                             'appl_no': ['019766', '020702', '018989', '021153'],
+                             'product_no': ['001', '002', '003', '004']})
+PRICE_NAMES = ['LIPITOR 20 MG TABLET', 'IBUPROFEN 200 MG TABLET', 'NEXIUM 40 MG CAPSULE']
+
+
+def by_description(matches):
+    return matches.set_index('ndc_description').sort_index()
+
+
+def test_matches_ignore_the_index_of_patent_names():
+    expected = match_names(PRICE_NAMES, PATENT_NAMES, min_score=0.3)
+    #A filtered and reordered frame (index labels no longer match row positions)
+    shuffled = PATENT_NAMES.iloc[[3, 1, 2]].copy()
+    shuffled.index = [30, 10, 20]
+    matches = match_names(PRICE_NAMES, shuffled, min_score=0.3)
+    assert len(expected) == 3
+    pd.testing.assert_frame_equal(by_description(matches)[['patent_name', 'appl_no', 'product_no']],
+                                  by_description(expected)[['patent_name', 'appl_no', 'product_no']])
+    assert by_description(matches).loc['IBUPROFEN 200 MG TABLET', 'appl_no'] == '018989'
+
+
+def test_scores_do_not_depend_on_the_batch():
+    #An inexact description, so the score depends on the n-gram weights
+    alone = match_names(['LIPITOR 20 MG TAB'], PATENT_NAMES, min_score=0.3)
+    batch = match_names(PRICE_NAMES + ['LIPITOR 20 MG TAB', 'ZOCOR 10 MG TAB', 'LIPITOR 40 MG TAB'], PATENT_NAMES, min_score=0.3)
+    score = batch.loc[batch['ndc_description'] == 'LIPITOR 20 MG TAB', 'score'].iloc[0]
+    assert alone['score'].iloc[0] == pytest.approx(score)
+
+
+def test_empty_inputs():
+    columns = ['ndc_description', 'patent_name', 'appl_no', 'product_no', 'score']
+    assert list(match_names([], PATENT_NAMES).columns) == columns
+    assert len(match_names([np.nan, None], PATENT_NAMES)) == 0
+    assert len(match_names(PRICE_NAMES, PATENT_NAMES.iloc[:0])) == 0
+    #Names too short for a single 3-gram
+    short_names = PATENT_NAMES.assign(patent_name=['A', 'B', 'C', 'D'])
+    assert list(match_names(PRICE_NAMES, short_names).columns) == columns
@@ -0,0 +1,45 @@
+import os
+import zipfile
+
+import pandas as pd
+import pytest
+
+from get_patent_data import read_orange_file, load_orange_data
+
+
+PRODUCTS = ('Ingredient~DF;Route~Trade_Name~Applicant~Strength~Appl_Type~Appl_No~Product_No~TE_Code~Approval_Date~RLD~RS~Type~Applicant_Full_Name\n'
+            'ATORVASTATIN CALCIUM~TABLET;ORAL~LIPITOR~VIATRIS~EQ 20MG BASE~N~020702~002~AB~Dec 17, 1996~Yes~No~RX~VIATRIS SPECIALTY LLC\n'
+            'IBUPROFEN~TABLET;ORAL~ADVIL~PFIZER~200MG~N~018989~001~~Approved Prior to Jan 1, 1982~Yes~No~OTC~PFIZER INC\n')
+#Columns moved around, a new column, and a different capitalization
+PATENT = ('Appl_No~APPL_TYPE~New_Column~PRODUCT_NO~PATENT_NO~PATENT_EXPIRE_DATE_TEXT~DRUG_SUBSTANCE_FLAG~DRUG_PRODUCT_FLAG~PATENT_USE_CODE~DELIST_FLAG~SUBMISSION_DATE\n'
+          '020702~N~x~002~5273995~Jun 28, 2011~Y~~~~\n')
+EXCLUSIVITY = ('Appl_Type~Appl_No~Product_No~Exclusivity_Code~Exclusivity_Date\n'
+               'N~018989~001~ODE-96~Aug 7, 2022\n')
+
+
+@pytest.fixture
+def archive(tmp_path):
+    zip_path = str(tmp_path / 'orange_book.zip')
+    with zipfile.ZipFile(zip_path, 'w') as zfile:
+        for name, text in [('products', PRODUCTS), ('patent', PATENT), ('exclusivity', EXCLUSIVITY)]:
+            zfile.writestr(name + '.txt', text)
+    return zip_path
+
+
+def test_columns_matched_by_name(archive):
+    df = load_orange_data(archive)
+    assert 'new_column' not in df
+    lipitor = df[df['trade_name'] == 'LIPITOR'].iloc[0]
+    assert lipitor['appl_no'] == '020702' and lipitor['patent_no'] == '5273995'
+    assert lipitor['patent_expire_date_text'] == pd.Timestamp('2011-06-28')
+    advil = df[df['trade_name'] == 'ADVIL'].iloc[0]
+    assert advil['approval_date'] == pd.Timestamp('1982-01-01')
+    assert advil['exclusivity_code'] == 'ODE-96'
+
+
+def test_missing_column(tmp_path):
+    path = str(tmp_path / 'exclusivity.txt')
+    with open(path, 'w') as outfile:
+        outfile.write('Appl_Type~Appl_No~Product_No~Exclusivity_Code\nN~018989~001~ODE-96\n')
+    with pytest.raises(ValueError, match='exclusivity_date'):
+        read_orange_file(path, 'exclusivity')
@@ -0,0 +1,105 @@
+import os
+
+import dill
+import numpy as np
+import pandas as pd
+import pytest
+
+from utils.parquet_store import save_to_parquet, truncate_parquet, load_parquet
+from feature_engineering import load_features, features_dataset_path
+
+
+def nadac_page(dates, start=0):
+    #A page as downloaded from Socrata (every value is text)
+    n = len(dates)
+    return pd.DataFrame({'ndc': ['{:011d}'.format(start + i) for i in range(n)],
+                         'ndc_description': ['GABAPENTIN 600MG TABLET', 'TELMISARTAN 40MG TABLET'] * (n // 2) + ['GABAPENTIN 600MG TABLET'] * (n % 2),
+                         'nadac_per_unit': ['{:.5f}'.format(0.1 * (start + i)) for i in range(n)],
+                         'effective_date': dates})
+
+
+def save(page, dataset_path):
+    save_to_parquet(page, dataset_path, dictionary_cols=['ndc_description'], float_cols=['nadac_per_unit'])
+
+
+@pytest.fixture
+def dataset(tmp_path):
+    dataset_path = str(tmp_path / 'nadac_data')
+    #Two pages, the second one spanning two months
+    save(nadac_page(['2020-01-08T00:00:00.000', '2020-01-15T00:00:00.000', '2020-02-05T00:00:00.000']), dataset_path)
+    save(nadac_page(['2020-02-19T00:00:00.000', '2020-03-04T00:00:00.000'], start=3), dataset_path)
+    return dataset_path
+
+
+def test_partitions_and_types(dataset):
+    assert sorted(os.listdir(dataset)) == ['effective_month=2020-01', 'effective_month=2020-02', 'effective_month=2020-03']
+    df = load_parquet(dataset)
+    assert len(df) == 5
+    assert isinstance(df['ndc_description'].dtype, pd.CategoricalDtype)
+    assert df['nadac_per_unit'].dtype == np.float64
+    assert pd.api.types.is_datetime64_any_dtype(df['effective_date'])
+
+
+def test_projection(dataset):
+    df = load_parquet(dataset, columns=['ndc', 'nadac_per_unit'])
+    assert list(df.columns) == ['ndc', 'nadac_per_unit']
+    assert sorted(df['ndc']) == ['{:011d}'.format(i) for i in range(5)]
+
+
+def test_month_filters_prune_partitions(dataset):
+    df = load_parquet(dataset, filters=[('effective_date', '>', pd.Timestamp('2020-02-05'))])
+    assert sorted(df['ndc']) == ['00000000003', '00000000004']
+    #Months outside the filter aren't opened at all (a corrupt file there doesn't matter)
+    with open(os.path.join(dataset, 'effective_month=2020-03', 'corrupt.parquet'), 'wb') as outfile:
+        outfile.write(b'not parquet')
+    df = load_parquet(dataset, columns=['ndc', 'effective_date'],
+                      filters=[('effective_date', '>=', pd.Timestamp('2020-02-10')), ('effective_date', '<=', pd.Timestamp('2020-02-29'))])
+    assert df['ndc'].tolist() == ['00000000003']
+
+
+def test_truncate_rewrites_only_the_first_month(dataset):
+    truncate_parquet(dataset, '2020-02-10')
+    assert sorted(os.listdir(dataset)) == ['effective_month=2020-01', 'effective_month=2020-02']
+    df = load_parquet(dataset)
+    assert sorted(df['ndc']) == ['00000000000', '00000000001', '00000000002']
+    #Rows downloaded again are appended to the truncated dataset
+    save(nadac_page(['2020-02-19T00:00:00.000'], start=3), dataset)
+    assert sorted(load_parquet(dataset)['ndc']) == ['{:011d}'.format(i) for i in range(4)]
+
+
+def test_truncate_everything(dataset):
+    truncate_parquet(dataset)
+    assert not os.path.exists(dataset)
+    #Nothing to truncate
+    truncate_parquet(dataset, '2020-01-01')
+
+
+def feature_frame():
+    #Shaped like the FeatureEngineering notebook output (date parts only, rows not in date order)
+    return pd.DataFrame({'ndc': np.float32([2, 1, 2, 1, 3]),
+                         'effective_date_year': np.float16([2020, 2020, 2019, 2019, 2020]),
+                         'effective_date_month': np.float16([3, 1, 12, 11, 2]),
+                         'effective_date_day': np.float16([4, 8, 18, 20, 5]),
+                         'nadac_per_unit': np.float32([2.5, 1.5, 2.0, 1.0, 3.0]),
+                         'otc_Y': [True, False, True, False, False]},
+                        index=[10, 4, 7, 1, 0])
+
+
+def test_load_features_from_pickle(tmp_path):
+    features_path = str(tmp_path / 'features_created.pkd')
+    with open(features_path, 'wb') as outfile:
+        dill.dump(feature_frame(), outfile)
+    features = load_features(features_path)
+    assert os.path.isdir(features_dataset_path(features_path))
+    expected = feature_frame().reset_index(drop=True)
+    pd.testing.assert_frame_equal(features, expected)
+
+    subset = load_features(features_path, columns=['ndc', 'nadac_per_unit', 'not_a_feature'], ndcs=[2])
+    assert list(subset.columns) == ['ndc', 'nadac_per_unit']
+    assert subset['nadac_per_unit'].tolist() == [2.5, 2.0]
+
+    #A new pickle replaces the converted dataset
+    with open(features_path, 'wb') as outfile:
+        dill.dump(feature_frame().iloc[:2], outfile)
+    os.utime(features_path, (0, 0))
+    assert len(load_features(features_path)) == 2
@@ -0,0 +1,43 @@
+import os
+
+import pandas as pd
+
+from data_cleaner import SetDtypes, regex_fn_dict
+from main import build_pipeline
+
+
+METADATA = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'raw_data', 'price_metadata.json')
+
+
+def nadac_rows():
+    #Rows as they are read from the prices table (every value is text)
+    return pd.DataFrame({'ndc_description': ['GABAPENTIN 600 MG TAB', 'TELMISARTAN 40 MG TAB', 'GABAPENTIN 600 MG TAB'],
+                         'ndc': ['68001041100', '42571022730', '68001041100'],
+                         'nadac_per_unit': ['0.10423', '0.38687', '0.10423'],
+                         'effective_date': ['2020-11-18T00:00:00.000', '2020-11-18T00:00:00.000', '2020-11-18T00:00:00.000'],
+                         'pricing_unit': ['EA', 'EA', 'EA'],
+                         'pharmacy_type_indicator': ['C/I', 'C/I', 'C/I'],
+                         'otc': ['N', 'N', 'N'],
+                         'explanation_code': ['1', '1', '1'],
+                         'classification_for_rate_setting': ['G', 'G', 'G'],
+                         'corresponding_generic_drug_nadac_per_unit': [None, None, None],
+                         'corresponding_generic_drug_effective_date': [None, None, None],
+                         'as_of_date': ['2020-11-25T00:00:00.000'] * 3,
+                         'id': ['GABAPENIN600MGABLE20201118', 'ELMISARAN40MGABLE20201118', 'GABAPENIN600MGABLE20201118']})
+
+
+def test_pipeline_smoke():
+    #The NER step needs the trained spaCy model, which is covered separately
+    pipe = build_pipeline(regex_fn_dict, metadata_path=METADATA).set_params(drug_name_ner='passthrough')
+    df = pipe.fit_transform(nadac_rows())
+    assert len(df) == 2
+    assert 'as_of_date' not in df and 'corresponding_generic_drug_nadac_per_unit' not in df
+    assert df['ndc_description'].tolist() == ['GABAPENTIN 600MG TABLET', 'TELMISARTAN 40MG TABLET']
+    assert pd.api.types.is_datetime64_any_dtype(df['effective_date'])
+    assert df['effective_date'].max() == pd.Timestamp('2020-11-18')
+    assert df['ndc'].tolist() == [68001041100, 42571022730]
+
+
+def test_set_dtypes():
+    df = SetDtypes(cols=['effective_date']).fit_transform(nadac_rows())
+    assert pd.api.types.is_datetime64_any_dtype(df['effective_date'])
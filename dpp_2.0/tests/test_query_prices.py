@@ -0,0 +1,29 @@
+import os
+import sqlite3
+
+import numpy as np
+import pytest
+
+from data_cleaner import query_prices
+
+
+DB_PARAMETERS = {'DATABASE_NAME': 'test.db', 'PRICES_TABLE': 'nadac'}
+
+
+@pytest.fixture
+def database(tmp_path, monkeypatch):
+    #query_prices reads db/<database name> under the working directory
+    monkeypatch.chdir(tmp_path)
+    os.makedirs('db')
+    conn = sqlite3.connect(os.path.join('db', 'test.db'))
+    conn.execute('CREATE TABLE nadac (ndc TEXT, effective_date TEXT, nadac_per_unit REAL)')
+    conn.executemany('INSERT INTO nadac VALUES (?, ?, ?)', [('00000012345', '2020-01-01T00:00:00.000', 1.5),
+                                                            ('00000067890', '2020-01-01T00:00:00.000', 2.5)])
+    conn.commit()
+    conn.close()
+
+
+@pytest.mark.parametrize('ndc', [12345, np.int64(12345), [np.int64(12345)], '00000012345', np.array([12345])])
+def test_ndc_types(database, ndc):
+    df = query_prices(DB_PARAMETERS, ndc=ndc)
+    assert df['ndc'].tolist() == ['00000012345']
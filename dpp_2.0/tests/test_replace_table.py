@@ -0,0 +1,49 @@
+import sqlite3
+
+import pandas as pd
+import pytest
+
+import utils.tools
+from utils.tools import replace_SQL_table
+
+
+def read_table(tmp_path, table_name):
+    conn = sqlite3.connect(str(tmp_path / 'db' / 'test.db'))
+    try:
+        tables = [row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type='table'")]
+        return tables, pd.read_sql_query('SELECT * FROM {}'.format(table_name), conn)
+    finally:
+        conn.close()
+
+
+@pytest.fixture
+def database(tmp_path, monkeypatch):
+    #bulk_save_to_SQL writes to db/<database name> under the working directory
+    monkeypatch.chdir(tmp_path)
+    replace_SQL_table('test.db', 'patents', pd.DataFrame({'id': [1, 2], 'patent_no': ['A', 'B']}), upsert_key='id')
+    return tmp_path
+
+
+def test_table_is_replaced(database):
+    replace_SQL_table('test.db', 'patents', pd.DataFrame({'id': [3], 'patent_no': ['C']}), upsert_key='id')
+    tables, patents = read_table(database, 'patents')
+    assert tables == ['patents']
+    assert patents.to_dict('list') == {'id': [3], 'patent_no': ['C']}
+
+
+def test_failed_load_keeps_old_table(database, monkeypatch):
+    def failing_rows(source_df):
+        raise sqlite3.OperationalError('disk I/O error')
+    monkeypatch.setattr(utils.tools, 'dataframe_to_rows', failing_rows)
+    with pytest.raises(sqlite3.OperationalError):
+        replace_SQL_table('test.db', 'patents', pd.DataFrame({'id': [3], 'patent_no': ['C']}), upsert_key='id')
+    _, patents = read_table(database, 'patents')
+    assert patents.to_dict('list') == {'id': [1, 2], 'patent_no': ['A', 'B']}
+
+    #The next load starts from a clean staging table
+    monkeypatch.undo()
+    monkeypatch.chdir(database)
+    replace_SQL_table('test.db', 'patents', pd.DataFrame({'id': [3], 'patent_no': ['C']}), upsert_key='id')
+    tables, patents = read_table(database, 'patents')
+    assert tables == ['patents']
+    assert patents.to_dict('list') == {'id': [3], 'patent_no': ['C']}
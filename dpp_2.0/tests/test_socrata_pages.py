@@ -0,0 +1,106 @@
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+import pytest
+import requests
+
+import get_price_data
+from get_price_data import iter_socrata_pages
+
+
+N_ROWS = 23
+
+
+class SocrataHandler(BaseHTTPRequestHandler):
+    #Serves N_ROWS rows like the Socrata resource API ($select=count(*) or $offset/$limit pages)
+    def do_GET(self):
+        query = {key: values[0] for key, values in parse_qs(urlparse(self.path).query).items()}
+        if '$select' in query:
+            body = [{'row_count': str(N_ROWS)}]
+        else:
+            offset, limit = int(query['$offset']), int(query['$limit'])
+            with self.server.lock:
+                self.server.requests.append(offset)
+                failures = self.server.failures.get(offset, 0)
+                if failures:
+                    self.server.failures[offset] = failures - 1
+            if failures:
+                self.send_response(503)
+                self.send_header('Content-Type', 'application/json')
+                self.end_headers()
+                self.wfile.write(b'{"message": "unavailable"}')
+                return
+            body = [{'row': str(row)} for row in range(offset, min(offset + limit, N_ROWS))]
+        payload = json.dumps(body).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    httpd = ThreadingHTTPServer(('127.0.0.1', 0), SocrataHandler)
+    httpd.lock, httpd.requests, httpd.failures = threading.Lock(), [], {}
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield httpd
+    httpd.shutdown()
+    httpd.server_close()
+
+
+@pytest.fixture
+def clients(monkeypatch):
+    #Record every client, and whether it was closed; retries don't wait
+    created = []
+    setup_socrata_client = get_price_data.setup_socrata_client
+    def recording_setup(credentials, nadac_parameters):
+        client = setup_socrata_client(credentials, nadac_parameters)
+        client.closed = False
+        close = client.close
+        def recording_close():
+            client.closed = True
+            close()
+        client.close = recording_close
+        created.append(client)
+        return client
+    monkeypatch.setattr(get_price_data, 'setup_socrata_client', recording_setup)
+    monkeypatch.setattr(get_price_data.time, 'sleep', lambda seconds: None)
+    return created
+
+
+def parameters(server, workers=3):
+    return {'WEBSITE': '127.0.0.1:{}'.format(server.server_address[1]), 'URI_PREFIX': 'http://',
+            'DATA_LOCATION': 'a4y5-998d', 'TIMEOUT': '10', 'PAGE_SIZE': '5', 'WORKERS': str(workers)}
+
+
+def test_pages_in_order_with_retry(server, clients):
+    server.failures = {10: 1}
+    pages = list(iter_socrata_pages({'APP_TOKEN': None}, parameters(server)))
+    assert [len(page) for page in pages] == [5, 5, 5, 5, 3]
+    assert [int(row) for page in pages for row in page['row']] == list(range(N_ROWS))
+    #The failed page was requested again
+    assert server.requests.count(10) == 2
+    assert clients and all(client.closed for client in clients)
+
+
+def test_clients_closed_when_retries_are_exhausted(server, clients):
+    server.failures = {15: 10}
+    with pytest.raises(requests.exceptions.RequestException):
+        list(iter_socrata_pages({'APP_TOKEN': None}, parameters(server)))
+    #First attempt + 3 retries
+    assert server.requests.count(15) == 4
+    assert clients and all(client.closed for client in clients)
+
+
+def test_clients_closed_when_caller_stops_early(server, clients):
+    pages = iter_socrata_pages({'APP_TOKEN': None}, parameters(server))
+    assert len(next(pages)) == 5
+    pages.close()
+    assert all(client.closed for client in clients)
@@ -0,0 +1,87 @@
+import os
+import threading
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+import pytest
+
+from utils.source_refresh import conditional_download
+
+
+class FileHandler(BaseHTTPRequestHandler):
+    #Serves server.body with an ETag; honours If-None-Match unless server.ignore_validators is set
+    def do_GET(self):
+        self.server.requests.append(dict(self.headers))
+        etag = '"{}"'.format(self.server.version)
+        if not self.server.ignore_validators and self.headers.get('If-None-Match') == etag:
+            self.send_response(304)
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header('ETag', etag)
+        self.send_header('Content-Length', str(len(self.server.body)))
+        self.end_headers()
+        self.wfile.write(self.server.body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    httpd = HTTPServer(('127.0.0.1', 0), FileHandler)
+    httpd.body, httpd.version, httpd.ignore_validators, httpd.requests = b'first version', 1, False, []
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield httpd
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def url_of(server):
+    return 'http://127.0.0.1:{}/orange_book.zip'.format(server.server_address[1])
+
+
+def test_new_file_is_downloaded(server, tmp_path):
+    dest_path, state = str(tmp_path / 'orange_book.zip'), {}
+    assert conditional_download(url_of(server), dest_path, state, chunk_size=4)
+    with open(dest_path, 'rb') as downloaded:
+        assert downloaded.read() == b'first version'
+    assert state['etag'] == '"1"' and state['sha256']
+    assert 'If-None-Match' not in server.requests[0]
+
+
+def test_not_modified(server, tmp_path):
+    dest_path, state = str(tmp_path / 'orange_book.zip'), {}
+    conditional_download(url_of(server), dest_path, state)
+    saved_state = dict(state)
+    assert not conditional_download(url_of(server), dest_path, state)
+    assert server.requests[-1]['If-None-Match'] == '"1"'
+    assert state == saved_state
+    with open(dest_path, 'rb') as downloaded:
+        assert downloaded.read() == b'first version'
+
+
+def test_unchanged_hash_when_validators_are_ignored(server, tmp_path):
+    dest_path, state = str(tmp_path / 'orange_book.zip'), {}
+    conditional_download(url_of(server), dest_path, state)
+    server.ignore_validators = True
+    mtime = os.path.getmtime(dest_path)
+    assert not conditional_download(url_of(server), dest_path, state)
+    assert os.path.getmtime(dest_path) == mtime
+    #No temporary files are left behind
+    assert os.listdir(str(tmp_path)) == ['orange_book.zip']
+
+    #New content is still picked up
+    server.body, server.version = b'second version', 2
+    assert conditional_download(url_of(server), dest_path, state)
+    with open(dest_path, 'rb') as downloaded:
+        assert downloaded.read() == b'second version'
+
+
+def test_missing_file_is_downloaded_again(server, tmp_path):
+    dest_path, state = str(tmp_path / 'orange_book.zip'), {}
+    conditional_download(url_of(server), dest_path, state)
+    os.remove(dest_path)
+    #The stored validators describe a file that is gone, so they are not sent
+    assert conditional_download(url_of(server), dest_path, state)
+    assert 'If-None-Match' not in server.requests[-1]
@@ -0,0 +1,163 @@
+import os
+import queue
+import atexit
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+
+#Applied once to every new connection: write-ahead logging (readers aren't blocked by
+#the writer), fewer fsyncs (safe with WAL), a 64 MiB page cache and in-memory temp tables
+DEFAULT_PRAGMAS = ['PRAGMA journal_mode=WAL',
+                   'PRAGMA synchronous=NORMAL',
+                   'PRAGMA cache_size=-65536',
+                   'PRAGMA temp_store=MEMORY']
+
+
+class ConnectionPool:
+    """
+    Pool of connections to a single SQLite database file.
+
+    Connections are created lazily (at most max_connections of them), configured once
+    with the pool's pragmas and handed out to one thread at a time, so the pool can be
+    shared across threads.
+    """
+    def __init__(self, db_file, max_connections=8, pragmas=DEFAULT_PRAGMAS, timeout=30):
+        self.db_file = db_file
+        self._pragmas = pragmas
+        self._timeout = timeout
+        self._idle = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(max_connections)
+        self._lock = threading.Lock()
+        self._connections = []
+        self._closed = False
+
+    def _new_connection(self):
+        #check_same_thread is disabled because a connection may be reused by another
+        #thread once it is returned to the pool (never by two threads at once)
+        conn = sqlite3.connect(self.db_file, timeout=self._timeout, check_same_thread=False)
+        for pragma in self._pragmas:
+            conn.execute(pragma)
+        with self._lock:
+            if self._closed:
+                conn.close()
+                raise sqlite3.ProgrammingError('Cannot operate on a closed connection pool')
+            self._connections.append(conn)
+        return conn
+
+    def _release(self, conn):
+        with self._lock:
+            #Connections closed by close() while they were borrowed are not handed out again
+            if conn in self._connections:
+                #Don't hand a half-finished transaction to the next borrower
+                if conn.in_transaction:
+                    conn.rollback()
+                self._idle.put(conn)
+                return
+        conn.close()
+
+    @contextmanager
+    def connection(self):
+        """Borrow a connection from the pool (blocks while all connections are in use)"""
+        self._slots.acquire()
+        try:
+            if self._closed:
+                raise sqlite3.ProgrammingError('Cannot operate on a closed connection pool')
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                conn = self._new_connection()
+            try:
+                yield conn
+            finally:
+                self._release(conn)
+        finally:
+            self._slots.release()
+
+    @contextmanager
+    def cursor(self):
+        """Borrow a cursor; its changes are committed on success and rolled back on error"""
+        with self.connection() as conn:
+            cur = conn.cursor()
+            try:
+                yield cur
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+            finally:
+                cur.close()
+
+    def close(self):
+        """Close every connection opened by the pool; the pool can't be used afterwards"""
+        with self._lock:
+            self._closed = True
+            for conn in self._connections:
+                conn.close()
+            self._connections = []
+            self._idle = queue.LifoQueue()
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(db_file):
+    """
+    Get the connection pool for a database file, creating it (and its folder) on first use
+
+    Args:
+        db_file (str): path to the database file
+
+    Returns:
+        ConnectionPool shared by every caller using the same database file
+    """
+    db_file = os.path.abspath(db_file)
+    with _pools_lock:
+        if db_file not in _pools:
+            db_folder = os.path.dirname(db_file)
+            if not os.path.exists(db_folder):
+                os.makedirs(db_folder)
+                print('No folder "{}" found. Created folder(s) at: '.format(os.path.basename(db_folder)), db_folder)
+            _pools[db_file] = ConnectionPool(db_file)
+            print('Connected to SQL database!')
+        return _pools[db_file]
+
+
+@contextmanager
+def db_connection(db_file):
+    """
+    Borrow a pooled connection to a database file
+
+    Args:
+        db_file (str): path to the database file
+
+    Returns:
+        Context manager yielding a sqlite3.Connection
+    """
+    with get_pool(db_file).connection() as conn:
+        yield conn
+
+
+@contextmanager
+def db_cursor(db_file):
+    """
+    Borrow a cursor on a pooled connection; changes are committed when the block exits
+
+    Args:
+        db_file (str): path to the database file
+
+    Returns:
+        Context manager yielding a sqlite3.Cursor
+    """
+    with get_pool(db_file).cursor() as cur:
+        yield cur
+
+
+@atexit.register
+def close_all_pools():
+    """Close every pooled connection (run automatically at interpreter exit)"""
+    with _pools_lock:
+        for pool in _pools.values():
+            pool.close()
+        _pools.clear()
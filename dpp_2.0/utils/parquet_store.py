@@ -0,0 +1,158 @@
+import os
+import re
+import uuid
+import shutil
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+
+#Hive-style partition column derived from the partition date column (e.g. effective_month=2020-01)
+PARTITION_FORMAT = '%Y-%m'
+
+
+def partition_column_name(partition_col):
+    """Name of the month partition column for a date column (effective_date -> effective_month)"""
+    return re.sub(r'_date$', '', partition_col) + '_month'
+
+
+def set_column_types(dataframe, dictionary_cols=[], float_cols=[], date_cols=[]):
+    """
+    Give columns their storage types: categoricals (dictionary encoded in Parquet), floats and dates
+
+    Args:
+        dataframe (pandas.DataFrame): data to be typed
+        dictionary_cols (list): low-cardinality text columns
+        float_cols (list): numeric columns
+        date_cols (list): date columns
+
+    Returns:
+        Typed copy of the dataframe
+    """
+    typed = {}
+    for col in dictionary_cols:
+        if col in dataframe:
+            typed[col] = dataframe[col].astype('category')
+    for col in float_cols:
+        if col in dataframe:
+            typed[col] = pd.to_numeric(dataframe[col], errors='coerce').astype('float64')
+    for col in date_cols:
+        if col in dataframe:
+            typed[col] = pd.to_datetime(dataframe[col], errors='coerce')
+    return dataframe.assign(**typed)
+
+
+def to_arrow_table(dataframe):
+    """
+    Convert a dataframe to an Arrow table whose schema doesn't depend on the contents of the
+    frame (so that files written from different pages can be read back as one dataset):
+    dictionary columns always use int32 indices, and all-null columns are stored as strings
+
+    Args:
+        dataframe (pandas.DataFrame): data to convert
+
+    Returns:
+        pyarrow.Table
+    """
+    table = pa.Table.from_pandas(dataframe, preserve_index=False)
+    fields = []
+    for field in table.schema:
+        if pa.types.is_dictionary(field.type):
+            field = field.with_type(pa.dictionary(pa.int32(), pa.string()))
+        elif pa.types.is_null(field.type):
+            field = field.with_type(pa.string())
+        fields.append(field)
+    return table.cast(pa.schema(fields, metadata=table.schema.metadata))
+
+
+def save_to_parquet(dataframe, dataset_path, partition_col='effective_date', dictionary_cols=[], float_cols=[], date_cols=[]):
+    """
+    Append data to a Parquet dataset partitioned by the month of partition_col.  Every call
+    writes new files, so pages of a download can be saved as they arrive.
+
+    Args:
+        dataframe (pandas.DataFrame): data to be saved
+        dataset_path (str): folder holding the dataset
+        partition_col (str): date column used to partition the dataset by month
+        dictionary_cols (list): text columns to dictionary encode
+        float_cols (list): numeric columns to store as float64
+        date_cols (list): columns to store as timestamps (partition_col is always included)
+
+    Returns:
+        Nothing (files are written to dataset_path)
+    """
+    date_cols = list(set(date_cols) | {partition_col})
+    dataframe = set_column_types(dataframe, dictionary_cols, float_cols, date_cols)
+    partition_name = partition_column_name(partition_col)
+    dataframe = dataframe.assign(**{partition_name: dataframe[partition_col].dt.strftime(PARTITION_FORMAT)})
+    table = to_arrow_table(dataframe)
+    pq.write_to_dataset(table, dataset_path,
+                        partition_cols=[partition_name],
+                        basename_template='part-{}-{{i}}.parquet'.format(uuid.uuid4().hex),
+                        existing_data_behavior='overwrite_or_ignore')
+
+
+def truncate_parquet(dataset_path, since=None, partition_col='effective_date'):
+    """
+    Remove rows with partition_col on or after a date from a Parquet dataset (whole months
+    are removed by deleting their folders; only the month of `since` itself is rewritten)
+
+    Args:
+        dataset_path (str): folder holding the dataset
+        since (str or datetime): first date to remove (None removes the whole dataset)
+        partition_col (str): date column the dataset is partitioned on
+
+    Returns:
+        Nothing
+    """
+    if not os.path.exists(dataset_path):
+        return
+    if since is None:
+        shutil.rmtree(dataset_path)
+        return
+    since = pd.Timestamp(since)
+    partition_name = partition_column_name(partition_col)
+    since_month = since.strftime(PARTITION_FORMAT)
+    for folder in os.listdir(dataset_path):
+        match = re.match(r'{}=(.*)'.format(partition_name), folder)
+        if match is None or match.group(1) < since_month:
+            continue
+        folder_path = os.path.join(dataset_path, folder)
+        if match.group(1) == since_month:
+            kept = pq.read_table(folder_path, filters=[(partition_col, '<', since)])
+            shutil.rmtree(folder_path)
+            if kept.num_rows:
+                os.makedirs(folder_path)
+                pq.write_table(kept, os.path.join(folder_path, 'part-{}-0.parquet'.format(uuid.uuid4().hex)))
+        else:
+            shutil.rmtree(folder_path)
+
+
+def load_parquet(dataset_path, columns=None, filters=None, partition_col='effective_date'):
+    """
+    Load (part of) a Parquet dataset.  Only the requested columns are read, and filters are
+    pushed down to the reader: filters on partition_col also prune whole month partitions,
+    and row groups whose statistics can't match are skipped.
+
+    Args:
+        dataset_path (str): folder holding the dataset
+        columns (list): columns to read (None reads every column)
+        filters (list): (column, operator, value) tuples combined with AND,
+                        e.g. [('effective_date', '>=', pd.Timestamp('2020-01-01'))]
+        partition_col (str): date column the dataset is partitioned on
+
+    Returns:
+        pandas.DataFrame
+    """
+    filters = list(filters or [])
+    partition_name = partition_column_name(partition_col)
+    #Translate date filters into partition filters, so that months outside the range aren't opened
+    for col, op, value in list(filters):
+        if col == partition_col and op in ('>', '>=', '<', '<=', '=', '=='):
+            month = pd.Timestamp(value).strftime(PARTITION_FORMAT)
+            month_op = {'>': '>=', '<': '<=', '=': '=='}.get(op, op)
+            filters.append((partition_name, month_op, month))
+    partitioning = ds.partitioning(pa.schema([(partition_name, pa.string())]), flavor='hive')
+    table = pq.read_table(dataset_path, columns=columns, filters=filters or None, partitioning=partitioning)
+    return table.to_pandas()
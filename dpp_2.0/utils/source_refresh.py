@@ -0,0 +1,128 @@
+import os
+import json
+import shutil
+import hashlib
+import tempfile
+from urllib.request import Request, urlopen
+from urllib.error import HTTPError
+
+
+#Validators (ETag, Last-Modified, content hash) and load markers of each data source
+SOURCE_STATE_FILE = os.path.join('raw_data', 'source_state.json')
+
+
+def load_source_state(state_file=SOURCE_STATE_FILE):
+    """
+    Load the stored state of every data source
+
+    Args:
+        state_file (str): path of the state file
+
+    Returns:
+        dict of {source name: dict of stored values} (empty if nothing was stored yet)
+    """
+    if not os.path.exists(state_file):
+        return {}
+    with open(state_file, 'r') as state_json:
+        return json.load(state_json)
+
+
+def save_source_state(source_name, source_state, state_file=SOURCE_STATE_FILE):
+    """
+    Store the state of one data source (the states of other sources are kept).  Call this
+    only once the downloaded data has been loaded, so a failed load is retried next run.
+
+    Args:
+        source_name (str): name of the data source
+        source_state (dict): values to store (see conditional_download)
+        state_file (str): path of the state file
+
+    Returns:
+        Nothing
+    """
+    state = load_source_state(state_file)
+    state[source_name] = source_state
+    folder = os.path.dirname(state_file)
+    if folder and not os.path.exists(folder):
+        os.makedirs(folder)
+    #Write to a temporary file first so an interrupted run can't leave a corrupt state file
+    with open(state_file + '.tmp', 'w') as outfile:
+        json.dump(state, outfile, indent=2, sort_keys=True)
+    os.replace(state_file + '.tmp', state_file)
+
+
+def conditional_download(url, dest_path, source_state, headers=None, timeout=60, chunk_size=1024*1024):
+    """
+    Download a file only if it changed since the last download.
+
+    The stored ETag and Last-Modified values are sent as If-None-Match/If-Modified-Since,
+    so an unchanged file costs a single "304 Not Modified" response.  Servers that ignore
+    these headers are caught by comparing the SHA-256 of the downloaded content with the
+    stored one, in which case the existing file is left untouched.  The response is
+    streamed to disk in chunks.
+
+    Args:
+        url (str): URL of the file
+        dest_path (str): where the file is saved
+        source_state (dict): stored state of the source (etag, last_modified, sha256); it is
+                             updated in place with the values of a new download
+        headers (dict): extra request headers (e.g. an API token)
+        timeout (int): request timeout in seconds
+        chunk_size (int): number of bytes read at a time
+
+    Returns:
+        True if a new version of the file was saved to dest_path, False if it didn't change
+    """
+    request_headers = dict(headers or {})
+    #Validators are only useful if the file they describe is still on disk
+    if os.path.exists(dest_path):
+        if source_state.get('etag'):
+            request_headers['If-None-Match'] = source_state['etag']
+        if source_state.get('last_modified'):
+            request_headers['If-Modified-Since'] = source_state['last_modified']
+
+    try:
+        response = urlopen(Request(url, headers=request_headers), timeout=timeout)
+    except HTTPError as error:
+        if error.code == 304:
+            print('{} not modified; skipping download.'.format(os.path.basename(dest_path)))
+            return False
+        raise
+
+    folder = os.path.dirname(dest_path) or '.'
+    if not os.path.exists(folder):
+        os.makedirs(folder)
+    sha256 = hashlib.sha256()
+    with response, tempfile.NamedTemporaryFile(dir=folder, delete=False) as tmp_file:
+        while True:
+            chunk = response.read(chunk_size)
+            if not chunk:
+                break
+            sha256.update(chunk)
+            tmp_file.write(chunk)
+        etag, last_modified = response.headers.get('ETag'), response.headers.get('Last-Modified')
+
+    source_state['etag'], source_state['last_modified'] = etag, last_modified
+    if os.path.exists(dest_path) and sha256.hexdigest() == source_state.get('sha256'):
+        os.remove(tmp_file.name)
+        print('{} content unchanged; skipping download.'.format(os.path.basename(dest_path)))
+        return False
+    shutil.move(tmp_file.name, dest_path)
+    source_state['sha256'] = sha256.hexdigest()
+    print('Downloaded new version of {}'.format(os.path.basename(dest_path)))
+    return True
+
+
+def metadata_signature(metadata):
+    """
+    Summarize the parts of Socrata metadata that matter downstream: when the rows were last
+    updated, and the column names and types (view counts etc. change on every request)
+
+    Args:
+        metadata (dict): Socrata dataset metadata
+
+    Returns:
+        dict with rows_updated_at and columns ([field name, data type] pairs)
+    """
+    return {'rows_updated_at': metadata.get('rowsUpdatedAt'),
+            'columns': [[col['fieldName'], col['dataTypeName']] for col in metadata['columns']]}
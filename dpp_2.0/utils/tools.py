@@ -1,7 +1,9 @@
 import os
 import json
-import sqlite3
 import dotenv
+import pandas as pd
+
+from utils.connection_manager import db_connection
 
 
 def load_env_vars():
@@ -43,51 +45,118 @@ def save_to_disk(file_location_name, data_to_save):
         json.dump(data_to_save, outfile)#added .to_json() for patent data (may cause problems for price dataset)
 
 
-def connect_to_database(db_file):
+def get_SQL_data(db_path, num_values):
+    with db_connection(os.path.join('db', db_path)) as conn:
+        df = pd.read_sql_query('SELECT * FROM nadac_data LIMIT ?', conn, params=(num_values,))
+    return df
+
+
+def save_to_SQL(database_name, table_name, source_df):
     """
-    Connect to SQLite database
+    Add data to the database
 
     Args:
-        db_file (str): database file name
+        database_name (str): name of database to be accessed
+        table_name (str): name of table in which to insert data
+        source_df (pandas.DataFrame): pandas dataframe to be added to SQLite database
 
     Returns:
-        Connection object (connection to database file specified)
+        Nothing (data is added to database)
     """
-    check_build_filepath('db')
-    conn = None
-    #connect to database
-    try:
-        conn = sqlite3.connect(db_file) #automatically creates the db file if nonexistant
-        print('Connected to SQL database!')
-    except sqlite3.Error as e:
-        print(e)
-
-    return conn
+    with db_connection(os.path.join(os.getcwd(), 'db', database_name)) as conn:
+        #Dropping duplicate
+        print('{} new entries detected'.format(len(source_df)))
+        #Load data into table
+        print('Adding data to table')
+        source_df.to_sql(name=table_name, con=conn, if_exists='append', index=False, index_label='id', chunksize=1000)
+        conn.commit()
+    print('Data added to SQL database.')
 
 
-def get_SQL_data(db_path, num_values):
-    conn = connect_to_database(os.path.join('db', db_path))
-    df = pd.read_sql_query('SELECT * FROM nadac_data LIMIT {}'.format(num_values), conn)
-    conn.close()
-    return df
+def dataframe_to_rows(source_df):
+    """
+    Convert a dataframe into rows of SQLite-compatible Python values, working a column
+    at a time on NumPy arrays (missing values become None, dates become ISO strings)
 
+    Args:
+        source_df (pandas.DataFrame): dataframe to convert
 
-def save_to_SQL(database_name, table_name, source_df):
+    Returns:
+        Iterator of row tuples
     """
-    Add data to the database
+    columns = []
+    for col in source_df.columns:
+        values = source_df[col]
+        if pd.api.types.is_datetime64_any_dtype(values):
+            values = values.dt.strftime('%Y-%m-%dT%H:%M:%S.000')
+        array = values.to_numpy(dtype=object, copy=True)
+        array[values.isna().to_numpy()] = None
+        columns.append(array)
+    return zip(*columns)
+
+
+def bulk_save_to_SQL(database_name, table_name, source_df, upsert_key=None, batch_size=50000):
+    """
+    Bulk load data into the database with prepared executemany statements, one
+    transaction per batch on a pooled connection (WAL mode, see
+    utils.connection_manager).  If upsert_key is given, rows whose key already exists
+    are updated in place (INSERT ... ON CONFLICT DO UPDATE), so revised values
+    replace old ones.  The table is created from the dataframe if it doesn't exist.
 
     Args:
         database_name (str): name of database to be accessed
         table_name (str): name of table in which to insert data
         source_df (pandas.DataFrame): pandas dataframe to be added to SQLite database
+        upsert_key (str): primary key (or unique) column used to detect existing rows (optional)
+        batch_size (int): number of rows written per transaction
 
     Returns:
         Nothing (data is added to database)
     """
-    conn = connect_to_database(os.path.join(os.getcwd(), 'db', database_name))
-    #Dropping duplicate
-    print('{} new entries detected'.format(len(source_df)))
-    #Load data into table
-    print('Adding data to table')
-    source_df.to_sql(name=table_name, con=conn, if_exists='append', index=False, index_label='id', chunksize=1000)
+    with db_connection(os.path.join(os.getcwd(), 'db', database_name)) as conn:
+        if not conn.execute("SELECT name FROM sqlite_master WHERE name=?", (table_name,)).fetchone():
+            with conn:
+                conn.execute(pd.io.sql.get_schema(source_df, table_name, keys=upsert_key, con=conn))
+
+        columns = ['"{}"'.format(col) for col in source_df.columns]
+        query = 'INSERT INTO {0} ({1}) VALUES ({2})'.format(table_name, ', '.join(columns), ', '.join(['?'] * len(columns)))
+        if upsert_key is not None:
+            updates = ['{0}=excluded.{0}'.format(col) for col in columns if col != '"{}"'.format(upsert_key)]
+            query += ' ON CONFLICT("{}") DO UPDATE SET {}'.format(upsert_key, ', '.join(updates))
+
+        print('Adding {} rows to table {}'.format(len(source_df), table_name))
+        for start in range(0, len(source_df), batch_size):
+            batch = source_df.iloc[start:start + batch_size]
+            with conn: #commits the batch as a single transaction
+                conn.executemany(query, dataframe_to_rows(batch))
     print('Data added to SQL database.')
+
+
+def replace_SQL_table(database_name, table_name, source_df, upsert_key=None, batch_size=50000):
+    """
+    Replace a table with the rows of a dataframe without ever leaving it missing or
+    half-loaded: the rows are loaded into a staging table (<table_name>_new), which then
+    takes the place of the old table (DROP + ALTER TABLE ... RENAME) in a single
+    transaction.  If the load fails, the old table is left untouched.
+
+    Args:
+        database_name (str): name of database to be accessed
+        table_name (str): name of table to be replaced
+        source_df (pandas.DataFrame): pandas dataframe to be saved in the SQLite database
+        upsert_key (str): primary key of the new table (optional, see bulk_save_to_SQL)
+        batch_size (int): number of rows written per transaction while loading
+
+    Returns:
+        Nothing (table is replaced in database)
+    """
+    staging_table = '{}_new'.format(table_name)
+    with db_connection(os.path.join(os.getcwd(), 'db', database_name)) as conn:
+        #Leftovers of a load that failed earlier
+        with conn:
+            conn.execute('DROP TABLE IF EXISTS {}'.format(staging_table))
+    bulk_save_to_SQL(database_name, staging_table, source_df, upsert_key=upsert_key, batch_size=batch_size)
+    with db_connection(os.path.join(os.getcwd(), 'db', database_name)) as conn:
+        with conn: #swaps the tables as a single transaction
+            conn.execute('DROP TABLE IF EXISTS {}'.format(table_name))
+            conn.execute('ALTER TABLE {} RENAME TO {}'.format(staging_table, table_name))
+    print('Replaced table {}'.format(table_name))